@@ -0,0 +1,19 @@
+"""Benchmark suite of BrownBat.
+
+The suite is run from the root of the project with ``python -m benchmarks``. It runs the workloads of
+:mod:`benchmarks.workloads`, reports the build time, render time, peak memory and number of nodes of
+each of them, and can save them as a JSON baseline or compare them with a previous baseline::
+
+    python -m benchmarks --save baseline.json
+    python -m benchmarks --compare baseline.json
+
+:mod:`benchmarks.scaling` builds and renders a workload for each node class with 1k, 10k and 100k nodes,
+fits the growth exponent of the costs, and fails if it is worse than O(n log n). The tests of the *tests*
+directory check the growth of the number of function calls, which is reproducible, and only check the times
+if the ``BROWNBAT_SLOW_TESTS`` environment variable is set::
+
+    python -m benchmarks.scaling
+    python -m benchmarks.scaling --count
+
+The other modules of the package are standalone benchmarks of specific features.
+"""
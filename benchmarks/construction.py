@@ -0,0 +1,66 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Benchmark of the number of nodes built per second by the constructors of the most common nodes,
+compared to their fast construction methods.
+
+Usage: construction.py [NUMBER_OF_INSTANCES]
+"""
+
+import gc
+import sys
+import time
+
+# If BrownBat is not installed, this enable the benchmark to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+
+
+def measure(build, instance_nb):
+    """Return the number of calls to *build* per second, called with the index of the instance."""
+    gc.collect()
+    gc.disable()
+    try:
+        begin = time.perf_counter()
+        instance_list = [build(i) for i in range(instance_nb)]
+        end = time.perf_counter()
+    finally:
+        gc.enable()
+    return instance_nb/(end-begin)
+
+def fill_append(stmt_list):
+    container = C.StmtContainer()
+    for stmt in stmt_list:
+        container.append(stmt)
+    return container
+
+def fill_extend_nodes(stmt_list):
+    container = C.StmtContainer()
+    container.extend_nodes(stmt_list)
+    return container
+
+def main(instance_nb):
+    # The names are built beforehand, so their construction is not accounted
+    name_list = ['name_{0}'.format(i) for i in range(instance_nb)]
+    stmt_list = ['a = b' if i % 2 else C.Expr('b = a') for i in range(instance_nb)]
+    build_list = [
+        ('Expr', lambda i: C.Expr('a = b')),
+        ('Expr.make', lambda i: C.Expr.make('a = b')),
+        ('Var', lambda i: C.Var(type='int', name=name_list[i])),
+        ('Var.make', lambda i: C.Var.make('int', name_list[i])),
+        ('Var (all)', lambda i: C.Var(type='int', name=name_list[i], storage_list='static', initializer='4')),
+        ('Var.make (all)', lambda i: C.Var.make('int', name_list[i], storage_list='static', initializer='4')),
+    ]
+    for name, build in build_list:
+        print('{0:>26}: {1:.0f} nodes/s'.format(name, measure(build, instance_nb)))
+
+    # The containers are built once, so the numbers are the number of statements added per second
+    for name, fill in (
+            ('StmtContainer.append', fill_append),
+            ('StmtContainer.extend_nodes', fill_extend_nodes),
+        ):
+        print('{0:>26}: {1:.0f} nodes/s'.format(name, measure(lambda i: fill(stmt_list), 1)*instance_nb))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
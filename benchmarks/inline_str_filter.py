@@ -0,0 +1,57 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Benchmark of the cost of the inline_str_filter support when printing a large tree of nodes
+where no node has a filter, and where the names of the functions have one.
+
+Usage: inline_str_filter.py [NUMBER_OF_NODES]
+"""
+
+import gc
+import sys
+import time
+
+# If BrownBat is not installed, this enable the benchmark to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+import brownbat.core as core
+
+from benchmarks.workloads import build_fun, count_nodes
+
+
+def build_tree(fun_nb):
+    fun_list = [build_fun('fun_{0}'.format(i)) for i in range(fun_nb)]
+    source = C.SourceFile('big', node_list=[fun.defi() for fun in fun_list])
+    return source, fun_list
+
+def time_render(tree, repeat=5):
+    time_list = list()
+    # The garbage collector walking the whole tree would hide the cost being measured
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            begin = time.perf_counter()
+            str(tree)
+            time_list.append(time.perf_counter()-begin)
+    finally:
+        gc.enable()
+    return min(time_list)
+
+def main(node_nb):
+    fun_node_nb = count_nodes(build_tree(2)[0])-count_nodes(build_tree(1)[0])
+    fun_nb = max(1, node_nb//fun_node_nb)
+    tree, fun_list = build_tree(fun_nb)
+    node_nb = count_nodes(tree)
+
+    render_time = time_render(tree)
+    print('{0} nodes without filter: {1:.3f} s ({2:.2f} us/node)'.format(node_nb, render_time, render_time/node_nb*1e6))
+
+    for fun in fun_list:
+        fun.name.inline_str_filter = lambda name: core.format_string(name, 'UPPER_UNDERSCORE_CASE')
+    render_time = time_render(tree)
+    print('{0} nodes with {1} filters: {2:.3f} s ({3:.2f} us/node)'.format(node_nb, fun_nb, render_time, render_time/node_nb*1e6))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
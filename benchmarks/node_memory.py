@@ -0,0 +1,49 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Benchmark of the memory used by the most common nodes, including the nodes they create
+for their attributes, measured with tracemalloc.
+
+Usage: node_memory.py [NUMBER_OF_INSTANCES]
+"""
+
+import gc
+import sys
+import tracemalloc
+
+# If BrownBat is not installed, this enable the benchmark to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+
+from benchmarks.workloads import build_fun
+
+
+def measure(build, instance_nb):
+    """Return the average number of bytes allocated by *build*, called with the index of the instance."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        instance_list = [build(i) for i in range(instance_nb)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after-before)/instance_nb
+
+def main(instance_nb):
+    # The names are built beforehand, so their memory is not accounted
+    name_list = ['name_{0}'.format(i) for i in range(instance_nb)]
+    build_list = [
+        ('Expr', lambda i: C.Expr('a = b')),
+        ('Var', lambda i: C.Var(name_list[i], 'int')),
+        ('Var (parsed)', lambda i: C.Var('static int '+name_list[i]+'[3] = 4')),
+        ('VarDecl', lambda i, var=C.Var('int x'): var.decl()),
+        ('Fun', lambda i: C.Fun(name_list[i], 'int', param_list=['int a', 'char *b'])),
+        ('Fun with a body', lambda i: build_fun(name_list[i])),
+    ]
+    for name, build in build_list:
+        print('{0:>16}: {1:.0f} bytes'.format(name, measure(build, instance_nb)))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
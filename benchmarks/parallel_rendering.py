@@ -0,0 +1,49 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Benchmark of the rendering of many independent files with core.render_parallel,
+for an increasing number of worker processes.
+
+Usage: parallel_rendering.py [FILE_NUMBER [FUNCTION_NUMBER]]
+"""
+
+import sys
+import os
+import time
+
+# If BrownBat is not installed, this enable the benchmark to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+import brownbat.core as core
+
+from benchmarks.workloads import build_fun
+
+
+def build_file(file_index, fun_nb):
+    header = C.HeaderFile('file_{0}'.format(file_index))
+    for i in range(fun_nb):
+        header.append(build_fun('fun_{0}_{1}'.format(file_index, i)).defi())
+    return header
+
+def main(file_nb=64, fun_nb=100):
+    node_list = [build_file(i, fun_nb) for i in range(file_nb)]
+    print('{0} files of {1} functions, {2} CPU'.format(file_nb, fun_nb, os.cpu_count()))
+
+    reference_result_list = None
+    worker_nb = 1
+    while worker_nb <= max(os.cpu_count(), 2):
+        begin = time.perf_counter()
+        result_list = core.render_parallel(node_list, max_workers=worker_nb)
+        duration = time.perf_counter()-begin
+
+        if reference_result_list is None:
+            reference_result_list = result_list
+            reference_duration = duration
+        assert result_list == reference_result_list
+
+        print('{0:>3} workers: {1:.3f} s (speedup {2:.2f})'.format(worker_nb, duration, reference_duration/duration))
+        worker_nb *= 2
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
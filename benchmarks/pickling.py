@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Benchmark of the size and speed of pickling large trees of nodes.
+
+Usage: pickling.py [NODE_NUMBER]
+"""
+
+import sys
+import time
+import pickle
+
+# If BrownBat is not installed, this enable the benchmark to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+
+from benchmarks.workloads import build_fun, count_nodes
+
+
+def build_tree(fun_nb):
+    source = C.SourceFile('big')
+    for i in range(fun_nb):
+        source.append(build_fun('fun_{0}'.format(i)).defi())
+    return source
+
+def main(node_nb=1000000):
+    # Estimate the number of functions needed
+    fun_node_nb = count_nodes(build_tree(2))-count_nodes(build_tree(1))
+    fun_nb = max(1, node_nb//fun_node_nb)
+    tree = build_tree(fun_nb)
+    node_nb = count_nodes(tree)
+    output = str(tree)
+    print('{0} nodes, {1} functions'.format(node_nb, fun_nb))
+
+    begin = time.perf_counter()
+    data = pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+    dump_duration = time.perf_counter()-begin
+    print('size: {0:.1f} MiB ({1:.1f} bytes/node)'.format(len(data)/2**20, len(data)/node_nb))
+    print('dump: {0:.3f} s'.format(dump_duration))
+
+    del tree
+    begin = time.perf_counter()
+    tree = pickle.loads(data)
+    load_duration = time.perf_counter()-begin
+    print('load: {0:.3f} s'.format(load_duration))
+
+    assert str(tree) == output
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,168 @@
+
+"""Runner of the benchmark suite.
+
+It measures the build time, render time, peak memory and number of nodes of each workload, can store
+the results as a JSON baseline, and compare the results with a baseline to flag the regressions.
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import brownbat.C as C
+import brownbat.core as core
+
+from benchmarks.workloads import WORKLOAD_LIST, WORKLOAD_DICT, count_nodes
+
+
+# Measurements compared with the baseline
+COMPARED_KEY_LIST = ('build_time', 'render_time', 'peak_memory')
+
+@contextlib.contextmanager
+def configuration(config):
+    """Use *config* as the default configuration of the C nodes inside the *with* statement."""
+    if config is None:
+        yield
+        return
+    old_config = C.Node.config
+    C.Node.config = config
+    try:
+        yield
+    finally:
+        C.Node.config = old_config
+
+def run_workload(workload, size, repeat=3):
+    """Run *workload* with *size* and return a dictionary of measurements.
+
+    The times are the best of *repeat* runs. The peak memory is measured with :mod:`tracemalloc`
+    in a separate run, because tracing slows down the execution.
+    """
+    build_time_list = list()
+    render_time_list = list()
+    with configuration(workload.config):
+        for i in range(repeat):
+            gc.collect()
+            begin = time.perf_counter()
+            root = workload.build(size)
+            build_time_list.append(time.perf_counter()-begin)
+
+            begin = time.perf_counter()
+            output = str(root)
+            render_time_list.append(time.perf_counter()-begin)
+
+        node_nb = count_nodes(root)
+        del root
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            str(workload.build(size))
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'size': size,
+        'node_count': node_nb,
+        'output_size': len(output),
+        'build_time': min(build_time_list),
+        'render_time': min(render_time_list),
+        'peak_memory': peak_memory,
+    }
+
+def profile_workload(workload, size, path, top=10):
+    """Render *workload* with a :class:`brownbat.core.RenderProfiler`, save the flame graph to *path*
+    and print the *top* node classes.
+    """
+    with configuration(workload.config):
+        root = workload.build(size)
+        with core.RenderProfiler() as profiler:
+            str(root)
+    profiler.save_collapsed_stacks(path)
+    print(profiler.report(top))
+
+def compare(result_dict, baseline_dict, tolerance):
+    """Compare the results with the baseline, and return the list of regression messages."""
+    regression_list = list()
+    for name, result in result_dict.items():
+        baseline = baseline_dict.get(name)
+        if baseline is None:
+            print('{0}: not in the baseline'.format(name))
+            continue
+        if baseline['size'] != result['size']:
+            print('{0}: size {1} differs from the baseline size {2}, not compared'.format(name, result['size'], baseline['size']))
+            continue
+
+        for key in COMPARED_KEY_LIST:
+            ratio = result[key]/baseline[key] if baseline[key] else 1
+            flag = ''
+            if ratio > 1+tolerance:
+                flag = ' REGRESSION'
+                regression_list.append('{0} {1}: {2:.2f}x the baseline'.format(name, key, ratio))
+            print('{0:>16} {1:<12} {2:>8.2f}x{3}'.format(name, key, ratio, flag))
+    return regression_list
+
+def print_result(name, result):
+    print('{name:>16}: {node_count:>8} nodes, build {build_time:.3f} s, render {render_time:.3f} s, peak memory {peak_memory_mib:.1f} MiB'.format(
+        name = name,
+        peak_memory_mib = result['peak_memory']/2**20,
+        **result
+    ))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog = 'python -m benchmarks',
+        description = 'Run the BrownBat benchmark suite.'
+    )
+    parser.add_argument('-w', '--workload', action='append', choices=list(WORKLOAD_DICT.keys()),
+        help='workload to run, can be repeated. All the workloads are run by default.')
+    parser.add_argument('--scale', type=float, default=1, help='factor applied to the default size of the workloads')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs used to measure the times')
+    parser.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='relative increase above which a measurement is considered as a regression')
+    parser.add_argument('--profile', metavar='PREFIX',
+        help='profile the rendering of each workload and save a flame graph to PREFIX.WORKLOAD.folded')
+    parser.add_argument('--list', action='store_true', help='list the workloads and exit')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for workload in WORKLOAD_LIST:
+            print('{0:>16}: {1} {2}'.format(workload.name, workload.default_size, workload.description))
+        return 0
+
+    workload_list = [WORKLOAD_DICT[name] for name in args.workload] if args.workload else WORKLOAD_LIST
+
+    result_dict = dict()
+    for workload in workload_list:
+        size = max(1, int(workload.default_size*args.scale))
+        result = run_workload(workload, size, args.repeat)
+        result_dict[workload.name] = result
+        print_result(workload.name, result)
+        if args.profile:
+            profile_workload(workload, size, '{0}.{1}.folded'.format(args.profile, workload.name))
+
+    if args.save:
+        with open(args.save, 'w') as stream:
+            json.dump({
+                'python': platform.python_version(),
+                'workloads': result_dict,
+            }, stream, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as stream:
+            baseline_dict = json.load(stream)['workloads']
+        regression_list = compare(result_dict, baseline_dict, args.tolerance)
+        if regression_list:
+            print('Regressions:')
+            for regression in regression_list:
+                print('    '+regression)
+            return 1
+
+    return 0
@@ -0,0 +1,193 @@
+"""Asymptotic scaling guard.
+
+The workload of each node class of :mod:`brownbat.C` (see :data:`benchmarks.workloads.NODE_WORKLOAD_LIST`)
+is built and rendered with 1k, 10k and 100k nodes. The growth exponents of the best build time and render
+time of several runs, and of the number of memory blocks still in use once the output is rendered, are
+fitted against the size of the output, with a least squares fit in log-log scale. An exponent close to 1
+means a linear cost, and an O(n log n) cost gives an exponent slightly above 1 on the measured range. The
+guard exits with a non-zero status if an exponent exceeds the limit, so quadratic behaviours are noticed::
+
+    python -m benchmarks.scaling
+    python -m benchmarks.scaling -w Enum -w Struct --size 1000 --size 10000
+    python -m benchmarks.scaling -w functions --size 20 --size 200 --size 2000
+
+With ``--count``, the number of function calls made while building and rendering the workloads with 100
+and 1000 nodes is checked instead. It does not depend on the load of the machine, so this check is the one
+run by the test suite, the timings being only checked there if the ``BROWNBAT_SLOW_TESTS`` environment
+variable is set. It catches the Python loops growing too fast, but not the copies made by builtin
+functions, which only show up in the times::
+
+    python -m benchmarks.scaling --count
+"""
+
+import argparse
+import functools
+import gc
+import math
+import sys
+import time
+
+from benchmarks.runner import configuration
+from benchmarks.workloads import NODE_WORKLOAD_LIST, NODE_WORKLOAD_DICT, WORKLOAD_DICT
+
+
+# Number of nodes of the workloads
+DEFAULT_SIZE_LIST = (1000, 10000, 100000)
+
+# Number of runs of each workload, only the best times are kept
+DEFAULT_REPEAT = 3
+
+# Maximum growth exponent, leaving some room for O(n log n) costs and for the measurement noise
+DEFAULT_MAX_EXPONENT = 1.3
+
+# Number of nodes of the workloads when counting the function calls, which are exactly reproducible
+COUNT_SIZE_LIST = (100, 1000)
+
+# Maximum growth exponent of the function call count, which is not noisy
+DEFAULT_MAX_COUNT_EXPONENT = 1.1
+
+# Measurements of measure_workload() checked by the guard, with their index
+MEASURE_NAME_LIST = ((1, 'build time'), (2, 'render time'), (3, 'retained blocks'))
+
+# Measurements of count_workload() checked by the guard, with their index
+COUNT_NAME_LIST = ((1, 'function calls'),)
+
+def fit_exponent(x_list, y_list):
+    """Return the slope of the least squares line fitting log(*y_list*) as a function of log(*x_list*)."""
+    log_x_list = [math.log(x) for x in x_list]
+    log_y_list = [math.log(max(y, 1e-9)) for y in y_list]
+    mean_x = sum(log_x_list)/len(log_x_list)
+    mean_y = sum(log_y_list)/len(log_y_list)
+    covariance = sum((x-mean_x)*(y-mean_y) for x, y in zip(log_x_list, log_y_list))
+    variance = sum((x-mean_x)**2 for x in log_x_list)
+    return covariance/variance
+
+def measure_workload(workload, size, repeat=DEFAULT_REPEAT):
+    """Return the output size, the best build time and render time of *repeat* runs, and the number
+    of memory blocks retained by building and rendering *workload* with *size*.
+
+    The blocks are counted with :func:`sys.getallocatedblocks`. Only the blocks still in use once the
+    node tree is rendered are counted, the temporary objects only show up in the times.
+    """
+    build_time_list = list()
+    render_time_list = list()
+    block_nb_list = list()
+    with configuration(workload.config):
+        for i in range(repeat):
+            gc.collect()
+            # The garbage collections would add a cost depending on everything else in memory
+            gc.disable()
+            try:
+                block_nb = sys.getallocatedblocks()
+                begin = time.perf_counter()
+                root = workload.build(size)
+                build_end = time.perf_counter()
+                output = str(root)
+                render_end = time.perf_counter()
+            finally:
+                gc.enable()
+            gc.collect()
+            block_nb_list.append(sys.getallocatedblocks()-block_nb)
+            build_time_list.append(build_end-begin)
+            render_time_list.append(render_end-build_end)
+            del root
+
+    return len(output), min(build_time_list), min(render_time_list), min(block_nb_list)
+
+def count_workload(workload, size):
+    """Return the output size and the number of function calls, including the builtin ones, made while
+    building and rendering *workload* with *size*.
+    """
+    call_nb = 0
+    def profile(frame, event, arg):
+        nonlocal call_nb
+        if event == 'call' or event == 'c_call':
+            call_nb += 1
+
+    with configuration(workload.config):
+        old_profile = sys.getprofile()
+        sys.setprofile(profile)
+        try:
+            output = str(workload.build(size))
+        finally:
+            sys.setprofile(old_profile)
+
+    return len(output), call_nb
+
+def check_workload(workload, size_list, repeat=DEFAULT_REPEAT, max_exponent=DEFAULT_MAX_EXPONENT,
+        verbose=True, count=False):
+    """Measure *workload* with all the sizes of *size_list*, print the fitted exponents if *verbose*
+    is True and return the list of the measurements growing faster than allowed by *max_exponent*.
+
+    :param count: if True, the function calls are counted with :func:`count_workload` instead of
+                  measuring the times and memory with :func:`measure_workload`.
+    """
+    if count:
+        measure = count_workload
+        name_list = COUNT_NAME_LIST
+    else:
+        measure = functools.partial(measure_workload, repeat=repeat)
+        name_list = MEASURE_NAME_LIST
+
+    # Warm up the caches, so that they are not only filled by the first measurement
+    measure(workload, size_list[0])
+    measure_list = [measure(workload, size) for size in size_list]
+    output_size_list = [measure[0] for measure in measure_list]
+    if len(set(output_size_list)) < 2:
+        return ['{0}: the output size does not depend on the size of the workload'.format(workload.name)]
+
+    failure_list = list()
+    for index, name in name_list:
+        exponent = fit_exponent(output_size_list, [measure[index] for measure in measure_list])
+        flag = ''
+        if exponent > max_exponent:
+            flag = ' TOO STEEP'
+            failure_list.append('{0} {1}: exponent {2:.2f} > {3:.2f}'.format(workload.name, name, exponent, max_exponent))
+        if verbose:
+            print('{0:>34} {1:<16} O(n^{2:.2f}){3}'.format(workload.name, name, exponent, flag))
+    return failure_list
+
+def main(argv=None):
+    workload_dict = dict(NODE_WORKLOAD_DICT)
+    workload_dict.update(WORKLOAD_DICT)
+
+    parser = argparse.ArgumentParser(
+        prog = 'python -m benchmarks.scaling',
+        description = 'Check that the building and rendering costs grow at most as O(n log n) with the output size.'
+    )
+    parser.add_argument('-w', '--workload', action='append', choices=list(workload_dict.keys()),
+        help='workload to check, can be repeated. The workloads of all the node classes are checked by default.')
+    parser.add_argument('--size', type=int, action='append',
+        help='size of the workloads, can be repeated. Defaults to {0}.'.format(
+            ', '.join(str(size) for size in DEFAULT_SIZE_LIST)))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+        help='number of runs used to measure the times, the best one is kept')
+    parser.add_argument('--count', action='store_true',
+        help='check the number of function calls instead of the times, with {0} nodes by default'.format(
+            ', '.join(str(size) for size in COUNT_SIZE_LIST)))
+    parser.add_argument('--max-exponent', type=float,
+        help='maximum growth exponent allowed. Defaults to {0} for the times and {1} for the counts.'.format(
+            DEFAULT_MAX_EXPONENT, DEFAULT_MAX_COUNT_EXPONENT))
+    args = parser.parse_args(argv)
+
+    if args.max_exponent is None:
+        args.max_exponent = DEFAULT_MAX_COUNT_EXPONENT if args.count else DEFAULT_MAX_EXPONENT
+
+    workload_list = [workload_dict[name] for name in args.workload] if args.workload else NODE_WORKLOAD_LIST
+    size_list = sorted(set(args.size or (COUNT_SIZE_LIST if args.count else DEFAULT_SIZE_LIST)))
+    if len(size_list) < 2:
+        parser.error('at least two different sizes are needed')
+
+    failure_list = list()
+    for workload in workload_list:
+        failure_list.extend(check_workload(workload, size_list, args.repeat, args.max_exponent, count=args.count))
+
+    if failure_list:
+        print('Superlinear growth:')
+        for failure in failure_list:
+            print('    '+failure)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
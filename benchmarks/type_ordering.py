@@ -0,0 +1,37 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Benchmark of the reordering of compound type definitions done by C.OrderedTypeContainer,
+on large random graphs of structures containing or pointing to each other, and of printing
+again the container after renaming one structure.
+
+Usage: type_ordering.py [NUMBER_OF_STRUCTURES...]
+"""
+
+import sys
+import time
+
+# If BrownBat is not installed, this enable the benchmark to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+from benchmarks.workloads import build_type_container
+
+
+def main(struct_nb_list):
+    for struct_nb in struct_nb_list:
+        cont = build_type_container(struct_nb)
+        begin = time.perf_counter()
+        snippet = str(cont)
+        duration = time.perf_counter()-begin
+        print('{0:>6} structures: {1:.3f} s ({2} lines)'.format(struct_nb, duration, snippet.count('\n')))
+
+        # Only the modified structure is analyzed again when printing the container after a small change
+        struct = cont[0]
+        struct.name = 'renamed_struct'
+        begin = time.perf_counter()
+        snippet = str(cont)
+        duration = time.perf_counter()-begin
+        print('{0:>6} structures, after renaming one: {1:.3f} s'.format(struct_nb, duration))
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 2000, 4000, 8000])
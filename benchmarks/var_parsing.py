@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Benchmark of the parsing of variable declaration strings by C.Var on a corpus of declarations
+typical of generated code: the regular expressions alone, the tokenizer handling the common forms,
+and the tokenizer with the cache of C.Var.parse_decl.
+
+Usage: var_parsing.py [NUMBER_OF_VARIABLES]
+"""
+
+import sys
+import time
+
+# If BrownBat is not installed, this enable the benchmark to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+
+
+DECLARATION_LIST = [
+    'int {name}',
+    'int {name} = 0',
+    'unsigned int {name}',
+    'size_t {name}',
+    'char *{name}',
+    'const char *{name}',
+    'char {name}[256]',
+    'uint8_t {name}[16] = {{0}}',
+    'static int {name} = 0',
+    'static const uint32_t {name}[256]',
+    'extern volatile uint32_t {name}',
+    'struct list_head *{name}',
+    'struct device {name}',
+    'union value {name}',
+    'enum state {name} = STATE_IDLE',
+    'static struct foo *{name}[FOO_MAX] = {{NULL}}',
+    'double {name}[3] = {{1.0, 2.0, 3.0}}',
+    'void **{name}',
+    'const struct ops *{name}',
+    'static unsigned long long {name}',
+]
+"""Templates of declarations, the name of the variable is given by the *name* field."""
+
+def regex_parse(decl):
+    """Parse *decl* with the regular expressions only, as C.Var did before the tokenizer."""
+    tokenize_decl = C.Var.__dict__['_tokenize_decl']
+    C.Var._tokenize_decl = classmethod(lambda cls, decl: None)
+    try:
+        return C.Var.parse_decl.__wrapped__(C.Var, decl)
+    finally:
+        C.Var._tokenize_decl = tokenize_decl
+
+def time_parse(parse, decl_list):
+    begin = time.perf_counter()
+    for decl in decl_list:
+        parse(decl)
+    return time.perf_counter()-begin
+
+def main(var_nb):
+    name_list = ['var_{0}'.format(i % 50) for i in range(var_nb)]
+    repeated_decl_list = [DECLARATION_LIST[i % len(DECLARATION_LIST)].format(name=name)
+        for i, name in enumerate(name_list)]
+    # Each variable has its own name, the cache only helps when the whole string is repeated
+    unique_decl_list = [DECLARATION_LIST[i % len(DECLARATION_LIST)].format(name='var_{0}'.format(i))
+        for i in range(var_nb)]
+
+    for decl in set(repeated_decl_list):
+        if regex_parse(decl) != C.Var._tokenize_decl(decl):
+            raise AssertionError('The tokenizer and the regular expressions disagree on {0!r}'.format(decl))
+
+    uncached_parse = lambda decl: C.Var.parse_decl.__wrapped__(C.Var, decl)
+    for label, decl_list in (('repeated', repeated_decl_list), ('unique', unique_decl_list)):
+        regex_time = time_parse(regex_parse, decl_list)
+        tokenizer_time = time_parse(uncached_parse, decl_list)
+        C.Var.parse_decl.cache_clear()
+        cached_time = time_parse(C.Var.parse_decl, decl_list)
+        print('parse {0} {1} declarations: regex {2:.3f} s, tokenizer {3:.3f} s ({4:.1f}x), tokenizer and cache {5:.3f} s ({6:.1f}x)'.format(
+            var_nb, label, regex_time,
+            tokenizer_time, regex_time/tokenizer_time,
+            cached_time, regex_time/cached_time
+        ))
+
+    # Building the variables also builds the nodes of their attributes
+    for label, decl_list in (('repeated', repeated_decl_list), ('unique', unique_decl_list)):
+        C.Var.parse_decl.cache_clear()
+        begin = time.perf_counter()
+        var_list = [C.Var(decl) for decl in decl_list]
+        build_time = time.perf_counter()-begin
+        print('build {0} variables from {1} declarations: {2:.3f} s ({3})'.format(
+            var_nb, label, build_time, C.Var.parse_decl.cache_info()))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,357 @@
+
+"""Workloads of the benchmark suite.
+
+Each workload builds a tree of nodes whose size is given by a single integer parameter.
+They are listed in :data:`WORKLOAD_LIST`, with the size used by default.
+
+:data:`NODE_WORKLOAD_LIST` contains a workload for each node class of :mod:`brownbat.C`, named after the
+class, whose size is the number of nodes of that class. They are used by :mod:`benchmarks.scaling`.
+"""
+
+import collections
+import random
+
+import brownbat.C as C
+import brownbat.core as core
+
+
+Workload = collections.namedtuple('Workload', ('name', 'build', 'default_size', 'config', 'description'))
+"""A workload: *build* is called with the size and returns the node to render. *config* is the
+:class:`brownbat.C.Configuration` used while building and rendering it, or None for the default one."""
+
+
+def count_nodes(root):
+    """Count the nodes reachable from *root* through the attributes, containers and token lists."""
+    seen_id_set = set()
+    obj_list = [root]
+    node_nb = 0
+    while obj_list:
+        obj = obj_list.pop()
+        if id(obj) in seen_id_set:
+            continue
+        seen_id_set.add(id(obj))
+        if isinstance(obj, core.NodeABC):
+            node_nb += 1
+            # The state contains the attributes stored in slots and in the __dict__
+            obj_list.extend(obj.__getstate__().values())
+            # The tokens can be stored in a rope after a concatenation
+            if isinstance(obj, core.TokenListABC):
+                obj_list.extend(obj)
+        elif isinstance(obj, (list, tuple)):
+            obj_list.extend(obj)
+        elif isinstance(obj, dict):
+            obj_list.extend(obj.keys())
+            obj_list.extend(obj.values())
+    return node_nb
+
+def build_fun(name):
+    """Build a function with a small body, representative of generated code."""
+    fun = C.Fun(name, 'int', param_list=['int a', 'char *b'])
+    fun.extend([
+        'int i = a',
+        C.For('i = 0', 'i < a', 'i++', ['b[i] = i', 'a += b[i]']),
+        C.If('a > 42', 'return a'),
+        C.While('a > 0', 'a--'),
+        'return 0'
+    ])
+    return fun
+
+def build_functions(size):
+    source = C.SourceFile('functions')
+    for i in range(size):
+        source.append(build_fun('fun_{0}'.format(i)).defi())
+    return source
+
+def build_nested_blocks(size):
+    block_class_list = [
+        lambda body: C.If('a > 0', body),
+        lambda body: C.While('b > 0', body),
+        lambda body: C.For('i = 0', 'i < a', 'i++', body),
+    ]
+    node = C.Expr('a = b')
+    for i in range(size):
+        node = block_class_list[i % len(block_class_list)]([node, 'b--'])
+    fun = C.Fun('nested', 'void', param_list=['int a', 'int b', 'int i'])
+    fun.append(node)
+    return C.SourceFile('nested', node_list=[fun.defi()])
+
+def build_enum(size):
+    return C.HeaderFile('enum', node_list=[
+        C.Enum('big_enum', ['MEMBER_{0}'.format(i) for i in range(size)])
+    ])
+
+def build_switch(size):
+    switch = C.Switch('x', {
+        i: ['y = {0}'.format(i), 'z += y'] for i in range(size)
+    })
+    fun = C.Fun('dispatch', 'int', param_list=['int x'])
+    fun.extend(['int y = 0', 'int z = 0', switch, 'return z'])
+    return C.SourceFile('switch', node_list=[fun.defi()])
+
+def build_type_container(struct_nb, member_nb=4, seed=0):
+    """Build an :class:`brownbat.C.OrderedTypeContainer` with a random graph of structures."""
+    rnd = random.Random(seed)
+    struct_list = list()
+    for i in range(struct_nb):
+        member_list = list()
+        for j in range(rnd.randint(0, member_nb)):
+            type_index = rnd.randrange(struct_nb)
+            # Contained structures only refer to previous ones to avoid impossible cycles,
+            # pointers can refer to any structure and create cycles
+            if type_index < i and rnd.random() < 0.3:
+                member_list.append('s{0} m{1}'.format(type_index, j))
+            else:
+                member_list.append('s{0} *m{1}'.format(type_index, j))
+        struct_list.append(C.Struct('s{0}'.format(i), member_list))
+
+    rnd.shuffle(struct_list)
+    return C.OrderedTypeContainer(node_list=struct_list)
+
+def build_ordered_types(size):
+    return C.HeaderFile('types', node_list=[build_type_container(size, member_nb=8)])
+
+def build_var_parsing(size):
+    declaration_list = [
+        'int var_{0}',
+        'static const unsigned long var_{0} = 42',
+        'struct foo *var_{0}',
+        'extern char var_{0}[16]',
+        'volatile int var_{0}[4] = {{1, 2, 3, 4}}',
+    ]
+    return C.SourceFile('vars', node_list=[
+        C.Var(declaration_list[i % len(declaration_list)].format(i)).decl()
+        for i in range(size)
+    ])
+
+def build_token_concatenation(size):
+    expr = C.Expr('return x_0')
+    for i in range(1, size):
+        expr = expr+' + x_{0}'.format(i)
+    fun = C.Fun('sum', 'int', param_list=['int x_0'])
+    fun.append(expr)
+    return C.SourceFile('sum', node_list=[fun.defi()])
+
+def build_expression_chain(size):
+    # Each operator wraps the previous expression in a new one
+    expr = C.Expr('x')
+    for i in range(size):
+        if i % 3 == 0:
+            expr = expr.deref()
+        elif i % 3 == 1:
+            expr = (expr >> 'next').paren()
+        else:
+            expr = expr.cast('struct node *')
+    fun = C.Fun('walk', 'struct node *', param_list=['struct node *x'])
+    fun.append(C.Expr('return ')+expr)
+    return C.SourceFile('chain', node_list=[fun.defi()])
+
+def build_deep_statements(size):
+    # Conditional compilation and statement groups nested in each other, without indentation
+    # so the size of the output stays linear with the depth
+    node = C.Expr('state = 0')
+    for i in range(size):
+        if i % 2 == 0:
+            node = C.PrepIfDef('STATE_{0}'.format(i), node_list=[node])
+        else:
+            node = C.StmtContainer([node, 'state++'])
+    fun = C.Fun('machine', 'void', param_list=['int state'])
+    fun.append(C.If('state > 0', [node]))
+    return C.SourceFile('machine', node_list=[fun.defi()])
+
+LICENSE_LINE_LIST = [
+    'Copyright (c) 2014, the authors. All rights reserved.',
+    '',
+    'Redistribution and use in source and binary forms, with or without modification, are permitted '
+    'provided that the following conditions are met: redistributions of source code must retain the above '
+    'copyright notice, this list of conditions and the following disclaimer.',
+]*13
+
+def build_comments(size):
+    node_list = list()
+    for i in range(size):
+        # Every file of a generated project starts with the same license header
+        node_list.append(C.Com(list(LICENSE_LINE_LIST)))
+        node_list.append(C.Com(' '.join('field_{0}_{1} ({2} bytes)'.format(i, j, j*4) for j in range(50))))
+    return C.SourceFile('comments', node_list=node_list)
+
+def build_debug_comments(size):
+    return build_functions(size)
+
+
+WORKLOAD_LIST = [
+    Workload('functions', build_functions, 2000, None, 'function definitions'),
+    Workload('nested_blocks', build_nested_blocks, 50, None, 'nested if/while/for blocks'),
+    Workload('enum', build_enum, 100000, None, 'enum members'),
+    Workload('switch', build_switch, 5000, None, 'switch cases'),
+    Workload('ordered_types', build_ordered_types, 2000, None, 'structures reordered by OrderedTypeContainer'),
+    Workload('var_parsing', build_var_parsing, 20000, None, 'variable declarations parsed from strings'),
+    Workload('token_concatenation', build_token_concatenation, 5000, None, 'expression built by adding tokens one by one'),
+    Workload('expression_chain', build_expression_chain, 10000, None, 'expression made of 10k nested operators'),
+    Workload('deep_statements', build_deep_statements, 100000, None, 'statements nested 100k times'),
+    Workload('comments', build_comments, 600, None, 'license headers and long generated comments'),
+    Workload('debug_comments', build_debug_comments, 1000, C.Configuration(enable_debug_comments=True),
+        'function definitions with automatic debugging comments'),
+]
+
+WORKLOAD_DICT = collections.OrderedDict((workload.name, workload) for workload in WORKLOAD_LIST)
+
+
+def node_list_builder(make_node):
+    """Return a function building a source file containing the nodes returned by *make_node*,
+    called with the index of each node.
+    """
+    def build(size):
+        return C.SourceFile('nodes', node_list=[make_node(i) for i in range(size)])
+    return build
+
+def build_member_struct(i, member_nb=2):
+    return C.Struct('s{0}'.format(i), [
+        C.StructMember(type='int', name='m{0}'.format(j), initializer=str(j))
+        for j in range(member_nb)
+    ])
+
+def build_expr_concatenation(size):
+    expr = C.Expr('x_0')
+    for i in range(1, size):
+        # Appending to the result of a concatenation must not copy the previous tokens either
+        if i % 2:
+            expr = expr+C.Expr(' + x_{0}'.format(i))
+        else:
+            expr.append(C.Expr(' + x_{0}'.format(i)))
+    return C.SourceFile('nodes', node_list=[expr])
+
+def build_token_lists(size):
+    return C.SourceFile('nodes', node_list=[
+        C.Expr([C.TokenList(['x_', i, ' + ']) for i in range(size)]+['0'])
+    ])
+
+def build_token_list_container(size):
+    return C.SourceFile('nodes', node_list=[
+        C.Expr(['f(', C.TokenListContainer(['x_{0}'.format(i) for i in range(size)]), ')'])
+    ])
+
+def build_node_container(size):
+    container = C.NodeContainer(node_list=['x_{0}++'.format(i) for i in range(size)],
+        node_classinfo=C.Expr, node_factory=C.Expr)
+    return C.SourceFile('nodes', node_list=[container])
+
+def build_fun_params(size):
+    fun = C.Fun('f', 'int', param_list=['int p_{0}'.format(i) for i in range(size)])
+    return C.SourceFile('nodes', node_list=[fun.decl(), fun.defi()])
+
+def build_enum_members(size):
+    return C.SourceFile('nodes', node_list=[C.Enum('e', ['E_{0}'.format(i) for i in range(size)])])
+
+def build_struct_members(size):
+    return C.SourceFile('nodes', node_list=[build_member_struct(0, size)])
+
+def build_union_members(size):
+    return C.SourceFile('nodes', node_list=[
+        C.Union('u', [C.UnionMember(type='int', name='m{0}'.format(i)) for i in range(size)])
+    ])
+
+def build_switch_cases(size):
+    return C.SourceFile('nodes', node_list=[C.Switch('x', {i: 'y = {0}'.format(i) for i in range(size)})])
+
+def build_designated_initializer(size):
+    return C.SourceFile('nodes', node_list=[
+        C.StructDesignatedInitializer({'m{0}'.format(i): i for i in range(size)})
+    ])
+
+def build_default_designated_initializer(size):
+    return C.SourceFile('nodes', node_list=[build_member_struct(0, size).designated_init()])
+
+def build_header_file(size):
+    return C.HeaderFile('nodes', node_list=['x_{0}++'.format(i) for i in range(size)])
+
+def build_source_file(size):
+    return C.SourceFile('nodes', node_list=['x_{0}++'.format(i) for i in range(size)])
+
+
+# The base classes only used through their subclasses do not have their own workload
+NODE_WORKLOAD_LIST = [
+    Workload('Expr', build_expr_concatenation, 100000, None, 'expressions concatenated in one expression'),
+    Workload('TokenList', build_token_lists, 100000, None, 'token lists in one expression'),
+    Workload('IndentedTokenList', node_list_builder(lambda i: C.IndentedTokenList(['a_', i, ' = b'])), 100000, None,
+        'indented token lists'),
+    Workload('TokenListContainer', build_token_list_container, 100000, None, 'token lists in one container'),
+    Workload('NodeContainer', build_node_container, 100000, None, 'statements in one node container'),
+    Workload('StmtContainer', node_list_builder(lambda i: C.StmtContainer(['x_{0}++'.format(i)])), 100000, None,
+        'statement containers'),
+    Workload('BlockStmt', node_list_builder(lambda i: C.BlockStmt(['x_{0}++'.format(i)])), 100000, None, 'blocks'),
+    Workload('OrderedTypeContainer', lambda size: C.SourceFile('nodes', node_list=[build_type_container(size)]),
+        100000, None, 'structures reordered by one container'),
+    Workload('If', node_list_builder(lambda i: C.If('x > {0}'.format(i), 'x++')), 100000, None, 'if statements'),
+    Workload('Else', node_list_builder(lambda i: C.Else(node_list=['x_{0}++'.format(i)])), 100000, None,
+        'else statements'),
+    Workload('ElseIf', node_list_builder(lambda i: C.ElseIf('x > {0}'.format(i), 'x++')), 100000, None,
+        'else if statements'),
+    Workload('While', node_list_builder(lambda i: C.While('x > {0}'.format(i), 'x--')), 100000, None,
+        'while loops'),
+    Workload('For', node_list_builder(lambda i: C.For('i = 0', 'i < {0}'.format(i), 'i++', 'x++')), 100000, None,
+        'for loops'),
+    Workload('DoWhile', node_list_builder(lambda i: C.DoWhile('x > {0}'.format(i), 'x--')), 100000, None,
+        'do while loops'),
+    Workload('Switch', build_switch_cases, 100000, None, 'cases of one switch'),
+    Workload('Var', node_list_builder(lambda i: C.Var(type='int', name='v{0}'.format(i))), 100000, None,
+        'variables'),
+    Workload('VarDecl', node_list_builder(lambda i: C.Var(type='int', name='v{0}'.format(i)).decl()), 100000, None,
+        'variable declarations'),
+    Workload('VarDefi', node_list_builder(lambda i: C.Var(type='int', name='v{0}'.format(i), initializer='0').defi()),
+        100000, None, 'variable definitions'),
+    Workload('VarExternDecl', node_list_builder(lambda i: C.Var(type='int', name='v{0}'.format(i)).extern_decl()),
+        100000, None, 'extern variable declarations'),
+    Workload('Fun', node_list_builder(lambda i: C.Fun('f{0}'.format(i), 'int', node_list=['return 0'])), 100000, None,
+        'functions'),
+    Workload('FunDef', node_list_builder(lambda i: C.Fun('f{0}'.format(i), 'int', node_list=['return 0']).defi()),
+        100000, None, 'function definitions'),
+    Workload('FunDecl', node_list_builder(lambda i: C.Fun('f{0}'.format(i), 'int', param_list=['int a']).decl()),
+        100000, None, 'function declarations'),
+    Workload('FunParam', build_fun_params, 100000, None, 'parameters of one function'),
+    Workload('FunCall', node_list_builder(lambda i: C.Fun('f{0}'.format(i), 'int').call(['a', 'b'])), 100000, None,
+        'function calls'),
+    Workload('Type', node_list_builder(lambda i: C.Var(type=C.Type('unsigned int'), name='v{0}'.format(i))), 100000,
+        None, 'types of variables'),
+    Workload('TypePointer', node_list_builder(lambda i: C.Var(type=C.Struct('s{0}'.format(i)).ptr(), name='p')),
+        100000, None, 'pointers to structures'),
+    Workload('CompoundTypeAnonymousView', node_list_builder(lambda i: C.Var(type=build_member_struct(i).anonymous(),
+        name='v{0}'.format(i))), 100000, None, 'anonymous structures'),
+    Workload('CompoundTypeForwardDeclaration', node_list_builder(lambda i: C.Struct('s{0}'.format(i)).forward_decl()),
+        100000, None, 'forward declarations of structures'),
+    Workload('Enum', node_list_builder(lambda i: C.Enum('e{0}'.format(i), ['E{0}_A'.format(i), 'E{0}_B'.format(i)])),
+        100000, None, 'enums'),
+    Workload('EnumMember', build_enum_members, 100000, None, 'members of one enum'),
+    Workload('Struct', node_list_builder(build_member_struct), 100000, None, 'structures'),
+    Workload('StructMember', build_struct_members, 100000, None, 'members of one structure'),
+    Workload('Union', node_list_builder(lambda i: C.Union('u{0}'.format(i), ['int a', 'float b'])), 100000, None,
+        'unions'),
+    Workload('UnionMember', build_union_members, 100000, None, 'members of one union'),
+    Workload('StructDesignatedInitializer', build_designated_initializer, 100000, None,
+        'fields of one designated initializer'),
+    Workload('StructDefaultDesignatedInitializer', build_default_designated_initializer, 100000, None,
+        'fields of the default designated initializer of one structure'),
+    Workload('Typedef', node_list_builder(lambda i: C.Typedef('int', 't{0}'.format(i))), 100000, None, 'typedefs'),
+    # FunPtrTypedef cannot be printed in a freestanding context, it is only printed as its name
+    Workload('FunPtrTypedef', node_list_builder(lambda i: C.Expr([C.FunPtrTypedef('cb{0}'.format(i), 'int', ['int a']),
+        ' x'])), 100000, None, 'names of function pointer types'),
+    Workload('PrepDef', node_list_builder(lambda i: C.PrepDef('M{0}'.format(i), str(i))), 100000, None, 'defines'),
+    Workload('PrepInclude', node_list_builder(lambda i: C.PrepInclude('h{0}.h'.format(i))), 100000, None, 'includes'),
+    Workload('PrepIf', node_list_builder(lambda i: C.PrepIf('M > {0}'.format(i), node_list=['x++'])), 100000, None,
+        'conditional compilation blocks'),
+    Workload('PrepIfDef', node_list_builder(lambda i: C.PrepIfDef('M{0}'.format(i), node_list=['x++'])), 100000, None,
+        '#ifdef blocks'),
+    Workload('PrepIfNDef', node_list_builder(lambda i: C.PrepIfNDef('M{0}'.format(i), node_list=['x++'])), 100000,
+        None, '#ifndef blocks'),
+    Workload('Com', node_list_builder(lambda i: C.Com('comment {0}'.format(i))), 100000, None, 'comments'),
+    Workload('SingleLineCom', node_list_builder(lambda i: C.Expr('x++', side_comment='comment {0}'.format(i))), 100000,
+        None, 'side comments'),
+    # Consecutive new lines are merged, so they are separated by statements
+    Workload('NewLine', node_list_builder(lambda i: C.StmtContainer(['x_{0}++'.format(i), C.NewLine()])), 100000, None,
+        'new lines'),
+    Workload('HeaderFile', build_header_file, 100000, None, 'statements in one header file'),
+    Workload('SourceFile', build_source_file, 100000, None, 'statements in one source file'),
+    Workload('Backtrace', node_list_builder(lambda i: C.Expr('x_{0}++'.format(i))), 100000,
+        C.Configuration(enable_debug_comments=True), 'automatic debugging comments'),
+]
+
+NODE_WORKLOAD_DICT = collections.OrderedDict((workload.name, workload) for workload in NODE_WORKLOAD_LIST)
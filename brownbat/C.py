@@ -33,18 +33,26 @@ import builtins
 import inspect
 import os
 import copy
+import functools
+import itertools
 
 import brownbat.core as core
 
 class Configuration:
     """This class holds configuration keys used to modify the behavior of the module.
     """
-    def __init__(self, enable_debug_comments):
+    def __init__(self, enable_debug_comments, debug_comments_max_depth=None, debug_comments_source_map=False):
         """
         :param enable_debug_comments: enables automatic debugging comments in generated sources. Automatic comments are built with the line of the Python code that created the object represented and its type.
+        :param debug_comments_max_depth: maximum number of frames of the backtrace displayed in automatic debugging comments. None means no limit.
+        :param debug_comments_source_map: if True, automatic debugging comments are not printed in the generated sources,
+                                          but recorded in the :class:`~brownbat.core.SourceMap` given when writing the sources.
+                                          The generated sources then do not change when the Python code creating them moves.
 
         """
         self.enable_debug_comments = enable_debug_comments
+        self.debug_comments_max_depth = debug_comments_max_depth
+        self.debug_comments_source_map = debug_comments_source_map
 
 default_config = Configuration(
     enable_debug_comments = False
@@ -88,16 +96,34 @@ class Node(core.NodeBase):
         # in this file, any constructor call here will turn into infinite
         # recursion. Fortunately, side_comment is irrelevant for Backtrace
         if self.config.enable_debug_comments and not isinstance(self, (Backtrace, SingleLineCom)):
-            self.instanciation_backtrace = Backtrace()
-            side_comment_backtrace = self.__class__.__name__+' created at '+self.instanciation_backtrace
+            self.instanciation_backtrace = Backtrace(max_depth=self.config.debug_comments_max_depth)
+            # The comment itself is only built if it is printed
+            side_comment = DebugSideComment(self)
 
-            # Also display backtrace of the parent object if this one is just a NodeView
-            if isinstance(self, NodeView):
-                side_comment_backtrace.extend(" (view of "+self.parent.__class__.__name__+" created at "+self.parent.instanciation_backtrace+")")
+        super().__init__(comment=comment, side_comment=side_comment, parent=parent)
 
-            side_comment = SingleLineCom(side_comment_backtrace)
+    @property
+    def _view_cache_enabled(self):
+        # The views record where they were requested in their debug comments, so they cannot be shared
+        return not self.config.enable_debug_comments
 
-        super().__init__(comment=comment, side_comment=side_comment, parent=parent)
+    @classmethod
+    def _new(cls):
+        """Create an instance without calling *__init__*, with the attributes set by :meth:`Node.__init__`
+        when it is called without parameters.
+
+        It is used by the fast construction methods such as :meth:`Var.make`, which then set the attributes
+        of their class directly, without going through the descriptors.
+        """
+        self = cls.__new__(cls)
+        slot_member_dict = cls._slot_member_dict
+        slot_member_dict['comment'].__set__(self, core.PHANTOM_NODE)
+        if self.config.enable_debug_comments and not issubclass(cls, (Backtrace, SingleLineCom)):
+            self.instanciation_backtrace = Backtrace(max_depth=self.config.debug_comments_max_depth)
+            slot_member_dict['side_comment'].__set__(self, DebugSideComment(self))
+        else:
+            slot_member_dict['side_comment'].__set__(self, core.PHANTOM_NODE)
+        return self
 
 class NodeView(core.NodeViewBase, Node):
     """This class is the C implementation of :class:`~brownbat.core.NodeViewBase` class.
@@ -143,9 +169,47 @@ class TokenListContainer(NodeContainer):
     def __init__(self, *args, **kwargs):
         super().__init__(node_classinfo=TokenList, *args, **kwargs)
 
+    @classmethod
+    def make(cls, node_list=None):
+        """Build a container, like calling the class with *node_list* but faster.
+
+        See :meth:`~brownbat.core.NodeContainerBase.extend_nodes` for the way *node_list* is processed.
+        """
+        if cls.__init__ is not TokenListContainer.__init__:
+            return cls(node_list)
+        self = cls._new()
+        self.node_classinfo = (TokenList,)
+        self.node_factory = _token_list_factory
+        self.node_list = list()
+        if node_list is not None:
+            self.extend_nodes(core.listify(node_list))
+        return self
+
+    def _fast_node_factory(self):
+        factory = super()._fast_node_factory()
+        if factory is TokenList:
+            return TokenList.make
+        return factory
+
 class TokenList(core.TokenListBase, Node):
     """This class is the C implementation of :class:`~brownbat.core.TokenListBase`."""
-    pass
+
+    @classmethod
+    def make(cls, token_list=None):
+        """Build a token list, like calling the class with *token_list* but faster.
+
+        It does not go through the whole chain of constructors, so it is intended for code building
+        lots of nodes, such as ``Expr.make('a = b')``. Subclasses with their own constructor are built
+        by calling the class.
+        """
+        if cls.__init__ is not TokenList.__init__:
+            return cls(token_list)
+        self = cls._new()
+        self._token_list = core.listify(token_list)
+        return self
+
+# Factory of the containers built by TokenListContainer.make(), shared by all of them
+_token_list_factory = core._NodeFactoryWrapper(TokenList)
 
 class DelegatedTokenList(core.DelegatedTokenListBase, Node):
     """This class is the C implementation of :class:`~brownbat.core.DelegatedTokenListBase`."""
@@ -168,6 +232,55 @@ class Backtrace(core.BacktraceBase, TokenList):
         return SingleLineCom(('Object built at ', self)).freestanding_str(idt)
 
 
+class DebugSideComment(core.NodeBase):
+    """This class is the placeholder used as side comment when automatic debugging comments are enabled.
+
+    The :class:`.SingleLineCom` showing where the node was created is only built when the placeholder is printed,
+    so the nodes that never reach the output do not pay for it. When the configuration of the node enables
+    *debug_comments_source_map*, the placeholder writes a :class:`~brownbat.core.SourceMap` marker instead.
+    """
+    # DebugSideComment must not call Node.__init__ because it is built from Node.__init__
+    def __init__(self, node):
+        self.node = node
+        self.parent = self
+        self.comment = core.PHANTOM_NODE
+        self.side_comment = core.PHANTOM_NODE
+        self._com = None
+
+    def materialize(self):
+        """Build the :class:`.SingleLineCom` the first time it is needed, and return it."""
+        if self._com is None:
+            node = self.node
+            side_comment_backtrace = node.__class__.__name__+' created at '+node.instanciation_backtrace
+
+            # Also display backtrace of the parent object if this one is just a NodeView
+            if isinstance(node, NodeView):
+                side_comment_backtrace.extend(" (view of "+node.parent.__class__.__name__+" created at "+node.parent.instanciation_backtrace+")")
+
+            self._com = SingleLineCom(side_comment_backtrace)
+
+        return self._com
+
+    def source_map_entry_list(self):
+        node = self.node
+        entry_list = [(node.__class__.__name__, node.instanciation_backtrace.location_list)]
+        if isinstance(node, NodeView):
+            entry_list.append((node.parent.__class__.__name__, node.parent.instanciation_backtrace.location_list))
+        return entry_list
+
+    def write_inline(self, emitter, idt=None):
+        if self.node.config.debug_comments_source_map:
+            emitter.write(core.SourceMap.marker(self))
+        else:
+            self.materialize().write_inline(emitter, idt)
+
+    def write_freestanding(self, emitter, idt=None):
+        if self.node.config.debug_comments_source_map:
+            emitter.write(core.SourceMap.marker(self))
+        else:
+            self.materialize().write_freestanding(emitter, idt)
+
+
 class _Expr:
     __format_string = '{expr};{side_comment}'
 
@@ -244,6 +357,12 @@ class DelegatedExpr(_Expr, IndentedDelegatedTokenList):
     pass
 
 
+def _ensure_node(obj, factory):
+    """Return *obj* if it is a node, or the node built by *factory* from it, checking plain strings first."""
+    if obj.__class__ is not str and isinstance(obj, core.NodeABC):
+        return obj
+    return factory(obj)
+
 class StmtContainer(NodeContainer, core.NonIterable):
     """This class is a :class:`.NodeContainer` that uses :class:`Expr` as its factory.
 
@@ -261,6 +380,13 @@ class StmtContainer(NodeContainer, core.NonIterable):
 
         super().__init__(node_list=node_list, node_classinfo=node_classinfo_list, node_factory=node_factory, *args, **kwargs)
 
+    def _fast_node_factory(self):
+        factory = super()._fast_node_factory()
+        # Statements given as strings are the most common case
+        if factory is Expr:
+            return Expr.make
+        return factory
+
 
 class BlockStmt(StmtContainer):
     """This class is a subclass of :class:`.StmtContainer`.
@@ -268,7 +394,7 @@ class BlockStmt(StmtContainer):
     It extends *inline_str* by outputing *{* at the front and *}* at the end,
     and also indent its content.
     """
-    def inline_str(self, idt=None):
+    def iter_write_inline(self, emitter, idt=None):
         idt = core.Indentation.ensure_idt(idt)
         # Hide side comment for derived class because
         # they usually display it in their own format
@@ -277,43 +403,122 @@ class BlockStmt(StmtContainer):
         else:
             side_comment = ''
 
-        snippet = '\n'+str(idt)+'{'+side_comment
-        idt.indent()
-        snippet += super().inline_str(idt)
-        idt.dedent()
-        snippet += '\n'+str(idt)+'}'
+        emitter.write('\n'+str(idt)+'{'+side_comment)
+        yield from super().iter_write_inline(emitter, idt.indent())
+        emitter.write('\n'+str(idt)+'}')
 
-        return snippet
 
+def _sort_type_definitions(root_list, dependency_dict, weak_dependency_dict):
+    """Sort the compound types reachable from *root_list* so that each type is defined after
+    the types it depends on.
 
-class OrderedTypeContainer(StmtContainer):
-    """This class is a container that automatically reorder
-    compound type definitions to satisfy the dependencies.
-
-    It inserts the reordered type definitions at the beginning,
-    and also include a forward declaration for each type, to allow
-    pointer cross-referencing.
+    *dependency_dict* and *weak_dependency_dict* map the id of a type to the list of the types it
+    respectively contains and points to. Weak dependencies can be satisfied by a forward declaration.
+    It returns the sorted list of types and the list of types that must be forward declared.
+    It runs in linear time with respect to the number of types and dependencies.
     """
+    def iter_dependencies(node):
+        return itertools.chain(dependency_dict.get(id(node), ()), weak_dependency_dict.get(id(node), ()))
+
+    # The preferred order is the postorder of a DFS following both kinds of dependencies,
+    # and ignoring the dependencies closing a cycle
+    # The state of a node is True while it is on the DFS stack, and False once it is finished
+    preferred_node_list = list()
+    state_dict = dict()
+    for root in root_list:
+        if id(root) in state_dict:
+            continue
+        state_dict[id(root)] = True
+        stack = [(root, iter_dependencies(root))]
+        while stack:
+            node, dep_node_iterator = stack[-1]
+            for dep_node in dep_node_iterator:
+                if id(dep_node) not in state_dict:
+                    state_dict[id(dep_node)] = True
+                    stack.append((dep_node, iter_dependencies(dep_node)))
+                    break
+            else:
+                stack.pop()
+                state_dict[id(node)] = False
+                preferred_node_list.append(node)
+
+    # Only the contained types must be defined before: sort topologically the graph of these
+    # dependencies, following the preferred order. When no cycle was closed by a contained type in
+    # the first DFS, the preferred order already satisfies them and is kept as is
+    sorted_node_list = list()
+    state_dict = dict()
+    for root in preferred_node_list:
+        if id(root) in state_dict:
+            continue
+        state_dict[id(root)] = True
+        stack = [(root, iter(dependency_dict.get(id(root), ())))]
+        while stack:
+            node, dep_node_iterator = stack[-1]
+            for dep_node in dep_node_iterator:
+                dep_node_state = state_dict.get(id(dep_node))
+                if dep_node_state is None:
+                    state_dict[id(dep_node)] = True
+                    stack.append((dep_node, iter(dependency_dict.get(id(dep_node), ()))))
+                    break
+                elif dep_node_state:
+                    raise ValueError('The dependency graph of compound types is not a DAG, cannot sort the type definitions')
+            else:
+                stack.pop()
+                state_dict[id(node)] = False
+                sorted_node_list.append(node)
 
-    def inline_str(self, idt=None):
-        # Only touch the a copy
-        self_copy = copy.copy(self)
+    # The types pointed to by a type defined before them must be forward declared
+    position_dict = {id(node): position for position, node in enumerate(sorted_node_list)}
+    forward_decl_id_set = set()
+    for node in sorted_node_list:
+        position = position_dict[id(node)]
+        for dep_node in weak_dependency_dict.get(id(node), ()):
+            if position_dict[id(dep_node)] >= position:
+                forward_decl_id_set.add(id(dep_node))
+    forward_decl_type_list = [node for node in sorted_node_list if id(node) in forward_decl_id_set]
 
-        # Build a dictionary mapping the type names to the type objects
-        type_dict = collections.OrderedDict()
-        for item in self:
-            if isinstance(item, (Struct, Union)):
-                type_dict[item.name.inline_str().strip()] = item
+    return (sorted_node_list, forward_decl_type_list)
 
-        types_to_sort_list = list()
-        # Build a dependency graph of unions and structures
-        dependency_dict = collections.defaultdict(list)
-        # Build a dependency graph of unions and structures that takes pointers into account
-        weak_dependency_dict = collections.defaultdict(list)
-        # Translation table used to remove character from type name to analyse weak dependencies
-        transtable = str.maketrans({char:None for char in '*()'})
-        for item in type_dict.values():
+class _TypeIndex:
+    """Index of the compound types of an :class:`OrderedTypeContainer` and of their dependencies.
+
+    The names of the types and the names of the types of their members are only computed again when
+    the type or its members are modified, and the dependency graph is only built again when something
+    changed. :class:`~brownbat.core.RenderObserver` are used to get notified of the modifications.
+    """
+
+    # Translation table used to remove character from type name to analyse weak dependencies
+    _transtable = str.maketrans({char:None for char in '*()'})
+
+    def __init__(self, container):
+        self.owner_id = id(container)
+        # List of the compound types of the container, None when the container was modified
+        self.type_list = None
+        self.container_observer = core.RenderObserver(self._container_modified)
+        # Map the id of the types to a (type, name, member type name list) tuple, and to their observer.
+        # The type is kept to tell it apart from a new type that got the same id after it was removed
+        self.analysis_dict = dict()
+        self.observer_dict = dict()
+        self.modified_type_id_set = set()
+        # (types to sort list, dependency dict, weak dependency dict), None when something was modified
+        self.dependency_graph = None
+
+    def _container_modified(self):
+        self.type_list = None
+
+    def _make_type_modified(self, type_id):
+        def type_modified():
+            self.modified_type_id_set.add(type_id)
+        return type_modified
+
+    def _analyze_type(self, item):
+        observer = core.RenderObserver(self._make_type_modified(id(item)))
+        with observer:
+            name = item.name.inline_str().strip()
+            member_type_name_list = list()
             for member in item:
+                # The type can be replaced without modifying the type object
+                observer.add_dependency(member)
                 # Determine dependencies with the type name, to
                 # allow hardcoded types to be taken into account
                 member_type_name = member.type.inline_str().strip()
@@ -324,95 +529,118 @@ class OrderedTypeContainer(StmtContainer):
                     if member_type_name.startswith(prefix):
                         member_type_name = member_type_name[len(prefix):].lstrip()
                         break
+                # Something that looks like a pointer to a known type is a weak dependency
+                stripped_member_type_name = member_type_name.translate(self._transtable).strip()
+                member_type_name_list.append((member_type_name, stripped_member_type_name))
 
-                # Try to find a type with the exact name
-                try:
-                    type_ = type_dict[member_type_name]
-                    # Only try to access [item] key after making sure the type exists,
-                    # to avoid triggering the creation of an empty list, and having
-                    # a key in dependency_dict with no dependencies
-                    dependency_dict[item].append(type_)
+        self.analysis_dict[id(item)] = (item, name, member_type_name_list)
+        self.observer_dict[id(item)] = observer
+
+    def get_dependency_graph(self, container):
+        """Return the list of types to sort of *container*, and the dependency graphs expected
+        by :func:`_sort_type_definitions`.
+        """
+        if self.type_list is None:
+            with self.container_observer:
+                self.type_list = [item for item in container if isinstance(item, (Struct, Union))]
+            type_dict = {id(item): item for item in self.type_list}
+            # Forget the types that were removed, even if a new type got the same id
+            for type_id, analysis in list(self.analysis_dict.items()):
+                if type_dict.get(type_id) is not analysis[0]:
+                    del self.analysis_dict[type_id]
+                    del self.observer_dict[type_id]
+            self.dependency_graph = None
+
+        # Only analyze the new types and the modified ones
+        if self.modified_type_id_set or len(self.analysis_dict) != len(self.type_list):
+            for item in self.type_list:
+                if id(item) in self.modified_type_id_set or id(item) not in self.analysis_dict:
+                    self._analyze_type(item)
+            self.modified_type_id_set.clear()
+            self.dependency_graph = None
+
+        if self.dependency_graph is None:
+            self.dependency_graph = self._build_dependency_graph()
+        return self.dependency_graph
+
+    def _build_dependency_graph(self):
+        # Build a dictionary mapping the type names to the type objects
+        type_dict = collections.OrderedDict()
+        for item in self.type_list:
+            type_dict[self.analysis_dict[id(item)][1]] = item
 
+        types_to_sort_list = list()
+        # Build a dependency graph of unions and structures, indexed by the id of the types
+        dependency_dict = collections.defaultdict(list)
+        # Build a dependency graph of unions and structures that takes pointers into account
+        weak_dependency_dict = collections.defaultdict(list)
+        for item in type_dict.values():
+            for member_type_name, stripped_member_type_name in self.analysis_dict[id(item)][2]:
+                # Try to find a type with the exact name
+                type_ = type_dict.get(member_type_name)
+                if type_ is not None:
+                    dependency_dict[id(item)].append(type_)
                     # Build a list of types that will be reordered
                     types_to_sort_list.append(item)
+                    continue
+
                 # If the type name is not found, try to add it as a weak dependency
-                except KeyError:
-                    # Try to find something that looks like a pointer to a known type
-                    stripped_member_type_name = member_type_name.translate(transtable).strip()
-                    try:
-                        # Only try to access [item] key after making sure the type exists,
-                        # to avoid triggering the creation of an empty list, and having
-                        # a key in weak_dependency_dict with no dependencies
-                        type_ = type_dict[stripped_member_type_name]
-                        weak_dependency_dict[item].append(type_)
-
-                       # Build a list of types that will be reordered
-                        types_to_sort_list.append(item)
-                    # If nothing was found, give up
-                    except KeyError:
-                        pass
-
-        # Do a topological sort of the dependency graph of the types
-        sorted_node_list = list()
-        temporary_marked = set()
-        permanently_marked = set()
-
-        forward_decl_type_set = set()
-        def visit(node):
-            nonlocal temporary_marked
-            nonlocal permanently_marked
-            nonlocal sorted_node_list
-            if node in temporary_marked:
-                raise ValueError('The dependency graph of compound types is not a DAG, cannot sort the type definitions')
-            elif node not in permanently_marked:
-                temporary_marked.add(node)
-                for dep_node in dependency_dict[node]:
-                    visit(dep_node)
-                for dep_node in weak_dependency_dict[node]:
-                    try:
-                        # Backup all data structures in case the DFS fails
-                        sorted_node_list_backup = copy.copy(sorted_node_list)
-                        temporary_marked_backup = copy.copy(temporary_marked)
-                        permanently_marked_backup = copy.copy(permanently_marked)
-                        forward_decl_type_set_backup = copy.copy(forward_decl_type_set)
-
-                        visit(dep_node)
-
-                    except ValueError:
-                        forward_decl_type_set.add(dep_node)
-                        # Restore bookkeeping data
-                        sorted_node_list = sorted_node_list_backup
-                        temporary_marked = temporary_marked_backup
-                        permanently_marked = permanently_marked_backup
-
-
-                permanently_marked.add(node)
-                temporary_marked.discard(node)
-                sorted_node_list.append(node)
+                type_ = type_dict.get(stripped_member_type_name)
+                if type_ is not None:
+                    weak_dependency_dict[id(item)].append(type_)
+                    # Build a list of types that will be reordered
+                    types_to_sort_list.append(item)
 
+        return (types_to_sort_list, dependency_dict, weak_dependency_dict)
 
-        # Only consider types that have dependencies
-        # types_to_sort_list may have duplicates
-        for node in types_to_sort_list:
-            visit(node)
+class OrderedTypeContainer(StmtContainer):
+    """This class is a container that automatically reorder
+    compound type definitions to satisfy the dependencies.
 
+    It inserts the reordered type definitions at the beginning,
+    and also include a forward declaration for each type, to allow
+    pointer cross-referencing.
+    """
+
+    _unpickled_attribute_set = StmtContainer._unpickled_attribute_set | {'_type_index'}
+
+    def _get_type_index(self):
+        # The index is stored in the __dict__ of the container, which is copied when copying
+        # the container, so it must be able to tell which container it belongs to
+        type_index = self.__dict__.get('_type_index')
+        if type_index is None or type_index.owner_id != id(self):
+            type_index = _TypeIndex(self)
+            self.__dict__['_type_index'] = type_index
+        return type_index
+
+    def iter_write_inline(self, emitter, idt=None):
+        # Only touch the a copy
+        self_copy = copy.copy(self)
+
+        types_to_sort_list, dependency_dict, weak_dependency_dict = self._get_type_index().get_dependency_graph(self)
+
+        sorted_node_list, forward_decl_type_list = _sort_type_definitions(
+            types_to_sort_list, dependency_dict, weak_dependency_dict
+        )
 
         # Build a list of nodes that do not contain the reordered type definitions
         # We must be carefull, as the 'not in' operator for lists tests for equality
-        sorted_node_id_list = [id(node) for node in sorted_node_list]
-        remaining_node_list = [item for item in self if id(item) not in sorted_node_id_list]
+        sorted_node_id_set = {id(node) for node in sorted_node_list}
+        remaining_node_list = [item for item in self if id(item) not in sorted_node_id_set]
 
         # Build a list of forward declaration to add before type definitions
-        forward_decl_list = [item.forward_decl() for item in forward_decl_type_set]
+        forward_decl_list = [core.shared_view(item, 'forward_decl') for item in forward_decl_type_list]
 
         # Insert the reordered type definitions at the beginning
         self_copy[:] = forward_decl_list+sorted_node_list+[NewLine()]+remaining_node_list
 
-        # Print using the StmtContainer.inline_str() method
-        return super(OrderedTypeContainer, self_copy).inline_str(idt)
+        # Print using the StmtContainer.iter_write_inline() method
+        yield from super(OrderedTypeContainer, self_copy).iter_write_inline(emitter, idt)
 
 class ConditionnalStmtBase(BlockStmt):
-    cond = core.EnsureNode('cond', TokenList)
+    __slots__ = ('_cond_node',)
+
+    cond = core.EnsureNode('_cond_node', TokenList)
     """The condition of the conditional statement."""
 
     def __init__(self, cond=None, *args, **kwargs):
@@ -422,10 +650,10 @@ class ConditionnalStmtBase(BlockStmt):
         self.cond = cond
         super().__init__(*args, **kwargs)
 
-    def inline_str(self, idt=None):
-        return self.__format_string.format(
+    def iter_write_inline(self, emitter, idt=None):
+        yield from core.compile_format(self.__format_string).iter_write(emitter,
             cond = self.cond.inline_str(idt),
-            stmt = super().inline_str(idt),
+            stmt = super().iter_write_inline(emitter, idt),
             side_comment = self.side_comment.inline_str(idt),
             idt_nl = '\n'+str(idt)
         )
@@ -459,13 +687,15 @@ class While(ConditionnalStmtBase):
 class For(BlockStmt):
     """This class represents the C *for* statement."""
 
-    init = core.EnsureNode('init', TokenList)
+    __slots__ = ('_init_node', '_cond_node', '_action_node')
+
+    init = core.EnsureNode('_init_node', TokenList)
     """This is the initalization expression (``a`` in ``for(a;b;c){}``)."""
 
-    cond = core.EnsureNode('cond', TokenList)
+    cond = core.EnsureNode('_cond_node', TokenList)
     """This is the stop condition (``b`` in ``for(a;b;c){}``)."""
 
-    action = core.EnsureNode('action', TokenList)
+    action = core.EnsureNode('_action_node', TokenList)
     """This is the expression evaluated each time(``c`` in ``for(a;b;c){}``)."""
 
 
@@ -483,12 +713,12 @@ class For(BlockStmt):
         self.action = action
         super().__init__(*args, **kwargs)
 
-    def inline_str(self, idt=None):
-        return self.__format_string.format(
+    def iter_write_inline(self, emitter, idt=None):
+        yield from core.compile_format(self.__format_string).iter_write(emitter,
             cond = self.cond.inline_str(idt),
             init = self.init.inline_str(idt),
             action = self.action.inline_str(idt),
-            stmt = super().inline_str(idt),
+            stmt = super().iter_write_inline(emitter, idt),
             side_comment = self.side_comment.inline_str(idt),
             idt_nl = '\n'+str(idt)
         )
@@ -506,11 +736,11 @@ class DoWhile(BlockStmt):
         self.cond = cond
         super().__init__(*args, **kwargs)
 
-    def inline_str(self, idt=None):
+    def iter_write_inline(self, emitter, idt=None):
         idt = core.Indentation.ensure_idt(idt)
 
-        return self.__format_string.format(
-            stmt = super().inline_str(idt),
+        yield from core.compile_format(self.__format_string).iter_write(emitter,
+            stmt = super().iter_write_inline(emitter, idt),
             cond = self.cond.inline_str(idt),
             side_comment = self.side_comment.inline_str(idt),
             idt_nl = '\n'+str(idt)
@@ -527,6 +757,12 @@ class Switch(Node, core.NonIterable, collections.MutableMapping):
     expr = core.EnsureNode('expr', TokenList)
     """This is the expression to switch on."""
 
+    case_map = core.RenderedAttribute('case_map')
+    """The mapping of the cases to the code to execute."""
+
+    auto_break = core.RenderedAttribute('auto_break')
+    """If True, a *break* statement is inserted at the end of the code of the cases."""
+
     __format_string = "switch({expr}){side_comment}{idt_nl}{{{stmt}{idt_nl}}}"
     __case_format_string = "{idt_nl}case ({case}):{side_comment}{stmt}{auto_break}\n"
     __default_format_string = "{idt_nl}default:{side_comment}{stmt}{auto_break}\n"
@@ -558,49 +794,47 @@ class Switch(Node, core.NonIterable, collections.MutableMapping):
         self.auto_break = auto_break
         super().__init__(*args, **kwargs)
 
-    def inline_str(self, idt=None):
+    def iter_write_inline(self, emitter, idt=None):
         idt = core.Indentation.ensure_idt(idt)
-        body = ""
-
-        idt.indent()
-        for case, stmt in self.case_map.items():
-            case = TokenList.ensure_node(case)
-            case_string = case.inline_str(idt)
-            if case_string == "default":
-                format_string = self.__default_format_string
-            else:
-                format_string = self.__case_format_string
-
-            idt.indent()
-            stmt_snippet = stmt.inline_str(idt)
-            if self.auto_break:
-                auto_break = '\n'+str(idt)+"break;"
-            else:
-                auto_break = ""
-            idt.dedent()
+        case_idt = idt.indent()
+        stmt_idt = case_idt.indent()
+
+        case_template = core.compile_format(self.__case_format_string)
+        default_template = core.compile_format(self.__default_format_string)
+
+        def iter_write_body():
+            for case, stmt in self.case_map.items():
+                case = TokenList.ensure_node(case)
+                case_string = case.inline_str(case_idt)
+                if case_string == "default":
+                    template = default_template
+                else:
+                    template = case_template
 
-            body += format_string.format(
-                idt_nl = '\n'+str(idt),
-                case = case_string,
-                side_comment = case.side_comment.inline_str(idt),
-                stmt = stmt_snippet,
-                auto_break = auto_break
-            )
+                if self.auto_break:
+                    auto_break = '\n'+str(stmt_idt)+"break;"
+                else:
+                    auto_break = ""
 
-        idt.dedent()
+                yield from template.iter_write(emitter,
+                    idt_nl = '\n'+str(case_idt),
+                    case = case_string,
+                    side_comment = case.side_comment.inline_str(case_idt),
+                    stmt = core.WriteCall.inline(stmt, emitter, stmt_idt),
+                    auto_break = auto_break
+                )
 
-        snippet = self.__format_string.format(
+        yield from core.compile_format(self.__format_string).iter_write(emitter,
             idt_nl = '\n'+str(idt),
             expr = self.expr.inline_str(idt),
             side_comment = self.side_comment.inline_str(idt),
-            stmt = body
+            stmt = iter_write_body()
         )
-        return snippet
 
     def __copy__(self):
         cls = type(self)
         new_obj = cls.__new__(cls)
-        new_obj.__dict__.update(self.__dict__)
+        new_obj._copy_attributes(self)
         new_obj.case_map = copy.copy(self.case_map)
         new_obj.expr = copy.copy(self.expr)
         return new_obj
@@ -610,9 +844,11 @@ class Switch(Node, core.NonIterable, collections.MutableMapping):
 
     def __setitem__(self, key, value):
         self.case_map[key] = StmtContainer(value)
+        core.invalidate_render_cache(self)
 
     def __delitem__(self, key):
         del self.case_map[key]
+        core.invalidate_render_cache(self)
 
     def __len__(self):
         return len(self.case_map)
@@ -622,19 +858,21 @@ class Switch(Node, core.NonIterable, collections.MutableMapping):
 
 
 class Var(DelegatedExpr):
-    storage_list = core.EnsureNode('storage_list', TokenListContainer)
+    __slots__ = ('_storage_list_node', '_type_node', '_name_node', '_array_size_node', '_initializer_node')
+
+    storage_list = core.EnsureNode('_storage_list_node', TokenListContainer)
 
-    type = core.EnsureNode('type',
+    type = core.EnsureNode('_type_node',
         node_factory=lambda type: TokenList(type) if type is not None else None,
         node_classinfo=TokenList
     )
-    name = core.EnsureNode('name', node_factory=TokenList)
+    name = core.EnsureNode('_name_node', node_factory=TokenList)
 
-    _array_size = core.EnsureNode('_array_size',
+    _array_size = core.EnsureNode('_array_size_node',
         node_factory=lambda array_size: TokenList(array_size) if array_size is not None else None,
         node_classinfo=TokenList
     )
-    initializer = core.EnsureNode('initializer',
+    initializer = core.EnsureNode('_initializer_node',
         node_factory=lambda initializer: TokenList(initializer) if initializer is not None else None,
         node_classinfo=TokenList
     )
@@ -679,48 +917,150 @@ class Var(DelegatedExpr):
     #   * optionally, initializer of the variable. None if not specified
     var_storage_list_defi_regex = re.compile("^\s*"+var_defi_storage_list_regex_str+"\s+"+var_def_type_regex_str+"\s*"+var_defi_name_array_initializer_regex_str+"\s*$")
 
+    # Tokens of the part of a declaration before the array size and the initializer
+    decl_token_regex = re.compile(r"\s*(?:(?P<identifier>[a-zA-Z_][a-zA-Z0-9_]*)|(?P<stars>\*+)|(?P<other>\S))")
+    compound_keyword_set = frozenset(('struct', 'union', 'enum'))
+
+    @classmethod
+    def _tokenize_decl(cls, decl):
+        """Parse the common forms of declarations in a single pass over their tokens, and return
+        the same tuple as :meth:`parse_decl`, or None if the regular expressions must be used.
+
+        Only the declarations for which the result is known to be the same as the one of the
+        regular expressions are handled: strings on one line, with at most one array size,
+        and a type made of an identifier optionally preceded by struct, union or enum and
+        optionally followed by stars.
+        """
+        if '\n' in decl:
+            return None
+
+        # The initializer starts at the first equal sign
+        head, equal, initializer = decl.partition('=')
+        initializer = initializer.strip() if equal else None
+
+        array_begin = head.find('[')
+        if array_begin == -1:
+            if ']' in head:
+                return None
+            array_size = None
+        else:
+            array_end = head.find(']')
+            if (array_end < array_begin or '[' in head[array_begin+1:]
+                    or ']' in head[array_end+1:] or head[array_end+1:].strip()):
+                return None
+            array_size = head[array_begin+1:array_end].strip()
+            head = head[:array_begin]
+
+        token_list = list()
+        for match in cls.decl_token_regex.finditer(head):
+            if match.group('other') is not None:
+                return None
+            token_list.append((match.group('identifier'), match.start(match.lastindex), match.end()))
+
+        if not token_list or token_list[-1][0] is None:
+            return None
+        name = token_list[-1][0]
+        token_list = token_list[:-1]
+        if not token_list:
+            return (None, None, name, array_size, initializer)
+
+        # The storage list is as short as possible, and separated from the type by spaces
+        for type_begin in range(len(token_list)):
+            if type_begin and token_list[type_begin-1][2] == token_list[type_begin][1]:
+                continue
+            type_token_list = [token[0] for token in token_list[type_begin:]]
+            pointer = type_token_list[-1] is None
+            if pointer:
+                type_token_list.pop()
+            if None in type_token_list or not type_token_list:
+                continue
+            if len(type_token_list) == 2 and type_token_list[0] in cls.compound_keyword_set:
+                break
+            if len(type_token_list) == 1:
+                # The regular expressions split the name when the type is a lone compound keyword
+                if not pointer and type_token_list[0] in cls.compound_keyword_set and len(name) > 1:
+                    return None
+                break
+        else:
+            return None
+
+        decl_type = head[token_list[type_begin][1]:token_list[-1][2]]
+        first_star_index = decl_type.find('*')
+        if first_star_index != -1:
+            decl_type = decl_type[:first_star_index].strip()+' '+decl_type[first_star_index:].strip()
+
+        if type_begin:
+            storage_list = tuple(head[:token_list[type_begin-1][2]].split())
+        else:
+            storage_list = None
+        return (storage_list, decl_type, name, array_size, initializer)
+
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def parse_decl(cls, decl):
+        """Parse the declaration or definition string *decl*, and return a tuple
+        (storage_list, type, name, array_size, initializer).
+
+        Each item is None when it is not specified, and *storage_list* is a tuple of strings.
+        Generators usually build lots of variables from the same strings, so the results are
+        kept in a bounded LRU cache.
+
+        :raises ValueError: if *decl* cannot be parsed.
+        """
+        result = cls._tokenize_decl(decl)
+        if result is not None:
+            return result
+
+        # Try to match without a storage list and without a type
+        match = cls.var_no_type_defi_regex.match(decl)
+        if match is None:
+            # If the previous regex failed to match, try the one with type support
+            match = cls.var_defi_regex.match(decl)
+        if match is None:
+            # If the previous regex failed to match, try the one with type and storage list support
+            match = cls.var_storage_list_defi_regex.match(decl)
+        if match is None:
+            raise ValueError("Cannot parse variable declaration/definition")
+
+        # Try to get the storage list if there is one
+        try:
+            decl_storage_list = tuple(match.group('storage_list').split())
+        except IndexError:
+            decl_storage_list = None
+
+        # Try to get the type if there is one
+        try:
+            decl_type = match.group('type')
+        except IndexError:
+            decl_type = None
+
+        # Remove multiple spaces before the star in pointer declarations
+        # for example: "    *" => " *"
+        if decl_type is not None:
+            try:
+                first_star_index = decl_type.index('*')
+                decl_type = decl_type[:first_star_index].strip()+' '+decl_type[first_star_index:].strip()
+            # No star was found
+            except ValueError:
+                pass
+
+        return (
+            decl_storage_list,
+            decl_type,
+            match.group('name'),
+            match.group('array_size'),
+            match.group('initializer')
+        )
 
     def __init__(self, decl=None, storage_list=None, type=None, name=None, initializer=None, array_size=None, *args, **kwargs):
 
         if decl is not None:
             # Parse the declaration
             if isinstance(decl, str):
-                # Try to match without a storage list and without a type
-                match = self.var_no_type_defi_regex.match(decl)
-                if match is None:
-                    # If the previous regex failed to match, try the one with type support
-                    match = self.var_defi_regex.match(decl)
-                if match is None:
-                    # If the previous regex failed to match, try the one with type and storage list support
-                    match = self.var_storage_list_defi_regex.match(decl)
-                if match is None:
-                    raise ValueError("Cannot parse variable declaration/definition")
-
-                # Try to get the storage list if there is one
-                try:
-                    decl_storage_list = match.group('storage_list').split()
-                except IndexError:
-                    decl_storage_list = None
-
-                # Try to get the type if there is one
-                try:
-                    decl_type = match.group('type')
-                except IndexError:
-                    decl_type = None
-
-                # Remove multiple spaces before the star in pointer declarations
-                # for example: "    *" => " *"
-                if decl_type is not None:
-                    try:
-                        first_star_index = decl_type.index('*')
-                        decl_type = decl_type[:first_star_index].strip()+' '+decl_type[first_star_index:].strip()
-                    # No star was found
-                    except ValueError:
-                        pass
-
-                decl_name = match.group('name')
-                decl_array_size = match.group('array_size')
-                decl_initializer = match.group('initializer')
+                (decl_storage_list, decl_type, decl_name,
+                    decl_array_size, decl_initializer) = self.parse_decl(decl)
+                if decl_storage_list is not None:
+                    decl_storage_list = list(decl_storage_list)
 
             # Make a shallow copy of the other Var
             elif isinstance(decl, Var):
@@ -769,8 +1109,36 @@ class Var(DelegatedExpr):
         # Store the name in the token_list member to allow Expr magic
         super().__init__(tokenlist_attr_name='name', *args, **kwargs)
 
+    @classmethod
+    def make(cls, type, name, storage_list=None, array_size=None, initializer=None):
+        """Build a variable from its *type* and *name*, like calling the class with keyword arguments but faster.
+
+        The parameters are nodes, used as is, or plain strings, which are not parsed as declarations. It does not
+        go through the whole chain of constructors, so it is intended for code building lots of variables.
+        Subclasses with their own constructor are built by calling the class.
+        """
+        if cls.__init__ is not Var.__init__:
+            return cls(storage_list=storage_list, type=type, name=name, array_size=array_size, initializer=initializer)
+        self = cls._new()
+        self.tokenlist_attr_name = 'name'
+
+        if storage_list.__class__ is str:
+            storage_list = storage_list.split()
+        self._storage_list_node = _ensure_node(storage_list, TokenListContainer.make)
+        self._type_node = _ensure_node(type, TokenList.make) if type is not None else None
+        self._name_node = _ensure_node(name, TokenList.make)
+
+        # Subclasses such as StructMember manage these attributes with their own properties
+        if cls.array_size is Var.array_size and cls.initializer is Var.initializer:
+            self._array_size_node = _ensure_node(array_size, TokenList.make) if array_size is not None else None
+            self._initializer_node = _ensure_node(initializer, TokenList.make) if initializer is not None else None
+        else:
+            self.array_size = array_size
+            self.initializer = initializer
+        return self
+
     def freestanding_str(self, idt=None):
-        return self.defi().freestanding_str(idt)
+        return core.shared_view(self, 'defi').freestanding_str(idt)
 
     def decl(self):
         return VarDecl(self)
@@ -832,8 +1200,11 @@ class VarDefi(VarDecl):
     pass
 
 class VarExternDecl(VarDecl):
+    hide_initializer = core.RenderedAttribute('hide_initializer')
+    hide_array_size = core.RenderedAttribute('hide_array_size')
+
     def __init__(self, var, hide_initializer=True, hide_array_size=True, *args, **kwargs):
-        self.hide_initializer=hide_initializer
+        self.hide_initializer = hide_initializer
         self.hide_array_size = hide_array_size
         super().__init__(var, *args, **kwargs)
 
@@ -855,10 +1226,12 @@ class VarExternDecl(VarDecl):
 
 
 class Fun(BlockStmt):
-    name = core.EnsureNode('name', TokenList)
-    return_type = core.EnsureNode('return_type', TokenList)
-    storage_list = core.EnsureNode('storage_list', TokenListContainer)
-    param_list = core.EnsureNode('param_list', TokenListContainer)
+    __slots__ = ('_name_node', '_return_type_node', '_storage_list_node', '_param_list_node')
+
+    name = core.EnsureNode('_name_node', TokenList)
+    return_type = core.EnsureNode('_return_type_node', TokenList)
+    storage_list = core.EnsureNode('_storage_list_node', TokenListContainer)
+    param_list = core.EnsureNode('_param_list_node', TokenListContainer)
 
 
     def __init__(self, name=None, return_type="void", storage_list=None, param_list=None, *args, **kwargs):
@@ -868,8 +1241,8 @@ class Fun(BlockStmt):
         self.param_list = param_list
         super().__init__(*args, **kwargs)
 
-    def inline_str(self, idt=None):
-        return self.defi().inline_str(idt)
+    def iter_write_inline(self, emitter, idt=None):
+        yield core.WriteCall.inline(core.shared_view(self, 'defi'), emitter, idt)
 
     def __call__(self, *args):
         return self.call(args)
@@ -885,12 +1258,12 @@ class Fun(BlockStmt):
 
 class FunParam(Var):
     def inline_str(self, idt=None):
-        return self.decl().inline_str(idt)
+        return core.shared_view(self, 'decl').inline_str(idt)
 
 class FunDef(NodeView):
     __format_string = "{idt_nl}{storage_list}{type}{name}({param_list}){side_comment}{body}"
 
-    def inline_str(self, idt=None):
+    def iter_write_inline(self, emitter, idt=None):
         storage_list = " ".join(storage.inline_str(idt) for storage in self.parent.storage_list)+" "
         storage_list = storage_list.strip()
         if storage_list:
@@ -901,13 +1274,13 @@ class FunDef(NodeView):
         if not param_list:
             param_list = "void"
 
-        return self.__format_string.format(
+        yield from core.compile_format(self.__format_string).iter_write(emitter,
             type = self.parent.return_type.inline_str(idt)+' ',
             name = self.parent.name.inline_str(idt),
             param_list = param_list,
             side_comment = self.parent.side_comment.inline_str(idt),
             storage_list = storage_list,
-            body = super(Fun, self.parent).inline_str(idt),
+            body = super(Fun, self.parent).iter_write_inline(emitter, idt),
             idt_nl = '\n'+str(idt)
         )
 
@@ -935,14 +1308,13 @@ class FunDecl(NodeView):
 
 class FunCall(NodeView, Expr, core.NonIterable):
     param_list = core.EnsureNode('param_list', TokenListContainer)
-    param_joiner = ', '
+    param_joiner = core.RenderedAttribute('param_joiner')
 
     __format_string = "{name}({param_list})"
 
     def __init__(self, parent, param_list=None, param_joiner=None, *args, **kwargs):
         self.param_list = param_list
-        if param_joiner is not None:
-            self.param_joiner = param_joiner
+        self.param_joiner = param_joiner if param_joiner is not None else ', '
         super().__init__(parent=parent, *args, **kwargs)
 
     def inline_str(self, idt=None):
@@ -979,6 +1351,7 @@ class TypePointer(NodeView):
 
 class CompoundType(BlockStmt):
     name = core.EnsureNode('name', TokenList)
+    auto_typedef = core.RenderedAttribute('auto_typedef')
 
     def __init__(self, name=None, auto_typedef=True, *args, **kwargs):
         self.name = name
@@ -991,21 +1364,22 @@ class CompoundType(BlockStmt):
     def inline_str(self, idt=None):
         return self.name.inline_str(idt)
 
-    def freestanding_str(self, idt=None):
+    def iter_write_freestanding(self, emitter, idt=None):
         idt = core.Indentation.ensure_idt(idt)
         if self.auto_typedef:
             format_string = self.__typedef_format_string
         else:
             format_string = self.__format_string
+        template = core.compile_format(format_string)
 
         # The format string do not contain the newline and indentation
         # at their beginning to be consistent with the format string of
         # other classes
-        format_string = '\n\n'+str(idt)+format_string
+        emitter.write('\n\n'+str(idt))
 
-        return format_string.format(
+        yield from template.iter_write(emitter,
             name = self.name.inline_str(idt),
-            members = super().inline_str(idt),
+            members = super().iter_write_inline(emitter, idt),
             side_comment = self.side_comment.inline_str(idt),
             idt_nl = '\n'+str(idt)
         )
@@ -1023,7 +1397,7 @@ class CompoundTypeAnonymousView(NodeView):
     def inline_str(self, idt=None):
         return (self.parent.__prefix_string+' {'+
             self.parent.__separator_string.join(
-                member.decl().inline_str()
+                core.shared_view(member, 'decl').inline_str()
                 for member in self.parent
                 )+
             self.parent.__separator_string.rstrip()+'}')
@@ -1058,7 +1432,7 @@ class EnumMember(Var):
         else:
             addend = ','
 
-        return '\n'+str(idt)+self.decl().inline_str(idt)+addend+self.side_comment.inline_str(idt)
+        return '\n'+str(idt)+core.shared_view(self, 'decl').inline_str(idt)+addend+self.side_comment.inline_str(idt)
 
 class Enum(CompoundType):
     _CompoundType__typedef_format_string = "typedef enum {name}{members} {name};{side_comment}"
@@ -1071,24 +1445,25 @@ class Enum(CompoundType):
     def __init__(self, name=None, member_list=None, auto_typedef=True, *args, **kwargs):
         super().__init__(name, auto_typedef, node_list=member_list, node_classinfo=EnumMember, *args, **kwargs)
 
-    def freestanding_str(self, idt=None):
+    def iter_write_freestanding(self, emitter, idt=None):
         # If there is at least one enumerator, so we can take the last member because it exists
         if self:
             last_member = self[-1]
             is_last_member_value = last_member.is_last_member
             try:
                 last_member.is_last_member = True
-                snippet = super().freestanding_str(idt)
+                yield from super().iter_write_freestanding(emitter, idt)
             finally:
                 # Restore the old value in case we want to append another
                 # enumerator after we printed the enum once
                 last_member.is_last_member = is_last_member_value
         else:
-            snippet = super().freestanding_str(idt)
-
-        return snippet
+            yield from super().iter_write_freestanding(emitter, idt)
 
 class StructMember(Var):
+    default_initializer = core.RenderedAttribute('default_initializer')
+    """The initializer used by the default designated initializer of the structure."""
+
     @property
     def initializer(self):
         """Special handling of initializer here: if the initializer is queried,
@@ -1221,17 +1596,19 @@ class StructDesignatedInitializer(Expr, collections.MutableMapping):
                 self.value_map[key] = value
         else:
             self.value_map[key] = value
+        core.invalidate_render_cache(self)
 
     def __copy__(self):
         cls = type(self)
         new_obj = cls.__new__(cls)
-        new_obj.__dict__.update(self.__dict__)
+        new_obj._copy_attributes(self)
         new_obj.value_map = copy.copy(self.value_map)
         return new_obj
 
 
     def __delitem__(self, key):
         del self.value_map[key]
+        core.invalidate_render_cache(self)
 
     def __len__(self):
         return len(self.value_map)
@@ -1342,6 +1719,7 @@ class PrepDef(OneLinePrepBase):
 
 class PrepInclude(OneLinePrepBase):
     header_path = core.EnsureNode('header_path', TokenList)
+    system = core.RenderedAttribute('system')
 
     def __init__(self, header_path=None, system=False, *args, **kwargs):
 
@@ -1360,6 +1738,7 @@ class PrepInclude(OneLinePrepBase):
 
 class PrepIf(StmtContainer):
     cond = core.EnsureNode('cond', TokenList)
+    indent_content = core.RenderedAttribute('indent_content')
 
     __format_string = "#if {cond}{side_comment}{stmt}{idt_nl}#endif //{cond}"
 
@@ -1368,16 +1747,15 @@ class PrepIf(StmtContainer):
         self.indent_content = indent_content
         super().__init__(*args, **kwargs)
 
-    def inline_str(self, idt=None):
+    def iter_write_inline(self, emitter, idt=None):
         idt = core.Indentation.ensure_idt(idt)
         if self.indent_content:
-            stmt_idt = copy.copy(idt)
-            stmt_idt.indent()
+            stmt_idt = idt.indent()
         else:
             stmt_idt = idt
-        return self.__format_string.format(
+        yield from core.compile_format(self.__format_string).iter_write(emitter,
             cond = self.cond.inline_str(idt),
-            stmt = super().inline_str(stmt_idt),
+            stmt = super().iter_write_inline(emitter, stmt_idt),
             side_comment = self.side_comment.inline_str(idt),
             idt_nl = '\n'+str(idt)
         )
@@ -1389,6 +1767,45 @@ class PrepIfNDef(PrepIf):
     _PrepIf__format_string = "#ifndef {cond}{side_comment}{stmt}{idt_nl}#endif //ifndef {cond}"
 
 
+# Whitespace characters, as defined by textwrap
+_wrap_whitespace_regex = re.compile('([\t\n\x0b\x0c\r ]+)')
+
+def _wrap_words(string, width):
+    """Wrap *string* in lines of at most *width* characters, like
+    ``textwrap.wrap(string, width, expand_tabs=False, replace_whitespace=False)``.
+
+    Only the simple case of words separated by whitespace is handled, which is faster than
+    the general purpose algorithm of :mod:`textwrap`. None is returned if the string contains
+    hyphens or chunks longer than *width*, that must be split by :func:`textwrap.wrap`.
+    """
+    if '-' in string:
+        return None
+    chunk_list = [chunk for chunk in _wrap_whitespace_regex.split(string) if chunk]
+    if any(len(chunk) > width for chunk in chunk_list):
+        return None
+
+    line_list = list()
+    chunk_index = 0
+    chunk_nb = len(chunk_list)
+    while chunk_index < chunk_nb:
+        # Drop the whitespace at the beginning of the lines, except the first one
+        if line_list and not chunk_list[chunk_index].strip():
+            chunk_index += 1
+
+        line_chunk_list = list()
+        line_len = 0
+        while chunk_index < chunk_nb and line_len+len(chunk_list[chunk_index]) <= width:
+            line_chunk_list.append(chunk_list[chunk_index])
+            line_len += len(chunk_list[chunk_index])
+            chunk_index += 1
+
+        # Drop the whitespace at the end of the lines
+        if line_chunk_list and not line_chunk_list[-1].strip():
+            line_chunk_list.pop()
+        if line_chunk_list:
+            line_list.append(''.join(line_chunk_list))
+    return line_list
+
 class BaseCom(Node, core.NonIterable):
     pass
 
@@ -1400,55 +1817,73 @@ class Com(TokenListContainer, BaseCom):
     # Maximum line length when auto_wrap is enabled
     max_line_length = 80
 
+    auto_wrap = core.RenderedAttribute('auto_wrap')
+
     def __init__(self, node_list=None, auto_wrap=True, *args, **kwargs):
         self.auto_wrap = auto_wrap
         super().__init__(node_list, *args, **kwargs)
 
-    def inline_str(self, idt=None):
+    def write_inline(self, emitter, idt=None):
         idt = core.Indentation.ensure_idt(idt)
         string = "\n".join(comment.inline_str(idt) for comment in self)
         if not string:
-            return ''
-
+            return
+
+        idt_string = str(idt)
+        sub_idt, string = self.format_comment(string, self.start_string, self.end_string,
+            self.max_line_length if self.auto_wrap else None, len(idt_string))
+
+        string += self.side_comment.inline_str(idt)
+        with emitter.indent(idt_string+sub_idt):
+            emitter.write(string)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def format_comment(string, start_string, end_string, max_line_length, idt_width):
+        """Add *start_string* and *end_string* around the comment *string*, and wrap it if one
+        of its lines does not fit in *max_line_length* once indented by *idt_width* characters.
+        No wrapping is done if *max_line_length* is None.
+
+        Return a tuple (sub_idt, comment), *sub_idt* being the indentation to add to align
+        the paragraphs. The same comments are usually repeated many times, like a license
+        header at the top of every file, so the results are kept in a bounded LRU cache.
+        """
         split_string = string.split("\n")
         first_line = split_string [0]
         last_line = split_string [-1]
         # If the first line is not empty, add a few spaces to indentation to
         # align the paragraphs correctly
         if first_line.strip():
-            sub_idt = len(self.start_string)*" "
-            start_string = self.start_string
+            sub_idt = len(start_string)*" "
         else:
             sub_idt = ""
-            start_string = self.start_string.strip()
-        joiner = "\n"+str(idt)+sub_idt
+            start_string = start_string.strip()
 
 
-        if last_line.strip():
-            end_string = self.end_string
-        else:
-            end_string = self.end_string.strip()
+        if not last_line.strip():
+            end_string = end_string.strip()
 
         # If the comment cannot fit on a single line and auto wrapping is enabled
-        if self.auto_wrap and any(
-            len(line) > self.max_line_length-len(start_string)-len(end_string)-len(str(idt))
+        if max_line_length is not None and any(
+            len(line) > max_line_length-len(start_string)-len(end_string)-idt_width
             for line in split_string
         ):
-            string = "\n".join(textwrap.wrap(
-                string,
-                width=self.max_line_length,
-                expand_tabs=False,
-                replace_whitespace=False,
-            ))
-
-        string = start_string+string+end_string+self.side_comment.inline_str(idt)
-        string = string.replace("\n", joiner)
-
-        return string
-
-    def freestanding_str(self, idt=None):
+            line_list = _wrap_words(string, max_line_length)
+            if line_list is None:
+                line_list = textwrap.wrap(
+                    string,
+                    width=max_line_length,
+                    expand_tabs=False,
+                    replace_whitespace=False,
+                )
+            string = "\n".join(line_list)
+
+        return (sub_idt, start_string+string+end_string)
+
+    def write_freestanding(self, emitter, idt=None):
         idt = core.Indentation.ensure_idt(idt)
-        return '\n\n'+str(idt)+self.inline_str(idt)
+        emitter.write('\n\n'+str(idt))
+        self.write_inline(emitter, idt)
 
 class SingleLineCom(DelegatedTokenList, BaseCom):
     content = core.EnsureNode('content', TokenList)
@@ -1474,10 +1909,31 @@ class NewLine(Node):
     freestanding_str = inline_str
 
 
-class HeaderFile(PrepIfNDef):
+class _File:
+    # Extension added to the filename to build the path
+    file_extension = ''
+
+    @property
+    def path(self):
+        """Path of the file, made of the *filename* attribute followed by the *file_extension* class attribute.
+        It is None if there is no filename. It is used by :class:`~brownbat.core.OutputSet`.
+        """
+        if self.filename is None:
+            return None
+        return self.filename+self.file_extension
+
+class HeaderFile(_File, PrepIfNDef):
+    """This class represents a header file, with an include guard around its content."""
     include_guard_define = core.EnsureNode('include_guard_define', TokenList)
 
+    file_extension = '.h'
+
     def __init__(self, filename=None, include_guard=None, template=None, node_list=None, *args, **kwargs):
+        """
+        :param filename: the name of the file, without extension. It is used to build the include guard and the path of the file.
+        :param include_guard: the macro used as include guard. It defaults to a name built from *filename*.
+        """
+        self.filename = filename
         if include_guard is None and filename is not None:
             self.include_guard_define = core.format_string(filename, 'UPPER_UNDERSCORE_CASE')+'_H_'
         else:
@@ -1487,4 +1943,14 @@ class HeaderFile(PrepIfNDef):
 
         super().__init__(core.NodeAttrProxy(self, 'include_guard_define'), indent_content=False, node_list=node_list, *args, **kwargs)
 
+class SourceFile(_File, StmtContainer):
+    """This class represents a source file, which prints its content like :class:`StmtContainer`."""
+
+    file_extension = '.c'
 
+    def __init__(self, filename=None, node_list=None, *args, **kwargs):
+        """
+        :param filename: the name of the file, without extension. It is used to build the path of the file.
+        """
+        self.filename = filename
+        super().__init__(node_list=node_list, *args, **kwargs)
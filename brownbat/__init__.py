@@ -4,4 +4,5 @@ The following modules are provided:
 
 * :mod:`brownbat.core` implements the langage independant base classes and helpers used to build specific source generation modules.
 * :mod:`brownbat.C` implements the C source generation API.
+* :mod:`brownbat.sourcemap` is a command line tool showing which Python code created a line of a generated file.
 """
@@ -29,16 +29,33 @@ The following helpers functions are provided:
 * :func:`listify`: create a list from an iterable or a single element.
 * :func:`format_string`: format a string according to the given convention (camel case, upper case, etc.).
 * :func:`strip_starting_blank_lines`: strip the blank lines at the beginning of a multiline string.
+* :func:`write_format`: write a format string to an :class:`Emitter`, with fields that can be streamed.
+* :func:`compile_format`: get the :class:`FormatTemplate` of a format string, parsed only once.
+* :func:`render_to`: write the source code of a node to a stream.
+* :func:`render_parallel`: render several nodes in a pool of processes.
+* :func:`run_render_steps`: run the rendering steps of a node with an explicit stack instead of recursive calls.
+* :func:`shared_view`: get a view of a node built only once, to print it without modifying it.
+* :func:`invalidate_render_cache`: invalidate the render cache of a node and of the nodes that printed it.
+* :func:`load_source_map`: load a source map saved by :meth:`SourceMap.save`.
 
 The following classes are provided:
 
-* :class:`Indentation`: manage the indentation level in the code generator.
+* :class:`Indentation`: immutable indentation level in the code generator.
+* :class:`FormatTemplate`: format string split once into literal text and fields.
+* :class:`Emitter`: receive the chunks of source code produced by the nodes and forward them to a stream.
+* :class:`SourceMap`: record which Python code created each line of a generated file, in a separate file.
+* :class:`WriteCall`: call to a streaming method of a node, yielded by the rendering steps of another node.
+* :class:`RenderObserver`: get notified when the nodes read to compute something are modified.
+* :class:`RenderProfiler`: record the time spent rendering each node class, and export it as a report or a flame graph.
+* :class:`OutputSet`: write a set of generated files, only replacing the files whose content changed.
 * :class:`NonIterable`: inheriting that class allows a class which can be considered as iterable to be considered as a non iterable by :func:`listify`.
 * :class:`NodeMeta`: metaclass of all class representing some source code constructs.
+* :class:`InlineStrFilterAttribute`: descriptor of the *inline_str_filter* attribute, installing the filtering methods on the nodes that have a filter.
 * :class:`NodeABC`: abstract base class of all class representing some source code constructs.
 * :class:`NodeBase`: base class of almost all class representing some source code constructs.
 * :class:`NodeAttrProxy`: proxy class that forwards the calls to the :class:`NodeABC` API to an attribute which is itself a :class:`NodeABC`. It implements composition.
 * :class:`EnsureNode`: descriptor used to build attributes that guarantee that they contain an instance of NodeABC.
+* :class:`RenderedAttribute`: descriptor used to build attributes that change the printed source code without being nodes, such as the options of the nodes.
 * :class:`DelegatedAttribute`: descriptor used to delegate an attribute to another instance which has the given attribute name.
 * :class:`NodeViewBase`: base class for class representing a view of another node (for example a variable declaration is a view of a variable).
 * :class:`PhantomNode`: class which can be used as an empty placeholder when a node is required.
@@ -60,6 +77,20 @@ import inspect
 import copy
 import functools
 import os
+import io
+import string
+import weakref
+import sys
+import linecache
+import json
+import itertools
+import hashlib
+import stat
+import pickle
+import multiprocessing
+import concurrent.futures
+import time
+import types
 
 
 def listify(iterable_or_single_elem):
@@ -72,6 +103,12 @@ def listify(iterable_or_single_elem):
     """
     if iterable_or_single_elem is None:
         return []
+    # Fast path for the most common types, which avoids the costly checks of the abstract base classes
+    cls = iterable_or_single_elem.__class__
+    if cls is str:
+        return [iterable_or_single_elem]
+    elif cls is list or cls is tuple:
+        return list(iterable_or_single_elem)
     # We exclude iterables such as strings or NonIterable (StmtContainer for example)
     # because we want to keep them as one object and not split them
     if isinstance(iterable_or_single_elem, collections.Iterable) \
@@ -132,23 +169,216 @@ def strip_starting_blank_lines(snippet):
     # Only keep one new line at the beginning, to avoid multiple blank lines
     return snippet[last_new_line_pos:]
 
+# Formatter used to split the format strings into literal text and fields
+_formatter = string.Formatter()
+
+class FormatTemplate:
+    """Format string split once into its literal text and its fields.
+
+    :meth:`write` writes it to an :class:`Emitter` like :func:`write_format`, without parsing the
+    format string again. The format strings only formatted into a string do not need a template,
+    as :meth:`str.format` is already implemented in C.
+    Use :func:`compile_format` to get the template of a format string.
+    """
+    __slots__ = ('format_string', '_item_list')
+
+    def __init__(self, format_string):
+        self.format_string = format_string
+
+        # Tuples of (literal_text, field_name, format_spec, conversion), the field of the last one is None
+        item_list = list()
+        literal_text_list = list()
+        for literal_text, field_name, format_spec, conversion in _formatter.parse(format_string):
+            literal_text_list.append(literal_text)
+            if field_name is not None:
+                item_list.append((''.join(literal_text_list), field_name, format_spec, conversion))
+                literal_text_list = list()
+        item_list.append((''.join(literal_text_list), None, None, None))
+        self._item_list = tuple(item_list)
+
+    def write(self, emitter, **field_dict):
+        """Write the template to *emitter*, see :func:`write_format` for the meaning of *field_dict*."""
+        write = emitter.write
+        for literal_text, field_name, format_spec, conversion in self._item_list:
+            if literal_text:
+                write(literal_text)
+            if field_name is None:
+                continue
+
+            value = field_dict[field_name]
+            if value.__class__ is str and not format_spec and not conversion:
+                write(value)
+            elif callable(value):
+                value(emitter)
+            else:
+                value = _formatter.convert_field(value, conversion)
+                write(_formatter.format_field(value, format_spec))
+
+    def iter_write(self, emitter, **field_dict):
+        """Generator variant of :meth:`write`, used by the rendering steps of the nodes (see :class:`WriteCall`).
+
+        The fields whose value is a :class:`WriteCall` or a generator are yielded instead of being
+        written, so :func:`run_render_steps` renders them when the field is reached.
+        """
+        write = emitter.write
+        for literal_text, field_name, format_spec, conversion in self._item_list:
+            if literal_text:
+                write(literal_text)
+            if field_name is None:
+                continue
+
+            value = field_dict[field_name]
+            if value.__class__ is str and not format_spec and not conversion:
+                write(value)
+            elif value.__class__ is WriteCall or value.__class__ is types.GeneratorType:
+                yield value
+            elif callable(value):
+                value(emitter)
+            else:
+                value = _formatter.convert_field(value, conversion)
+                write(_formatter.format_field(value, format_spec))
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self.format_string)
+
+@functools.lru_cache(maxsize=1024)
+def compile_format(format_string):
+    """Return the :class:`FormatTemplate` of *format_string*.
+
+    The templates are kept in a bounded LRU cache keyed on the format string, so the format strings
+    of the classes, including the ones overridden in subclasses or in instances, are only parsed once.
+    """
+    return FormatTemplate(format_string)
+
+def write_format(emitter, format_string, **field_dict):
+    """Write *format_string* to *emitter*, like :meth:`str.format` would format it.
+
+    The values of *field_dict* are either strings, which are formatted as :meth:`str.format`
+    would do, or callables taking the emitter as only parameter. The callables are called
+    when the field is reached, so they can write an arbitrary large content directly to the emitter
+    without building an intermediate string.
+    """
+    compile_format(format_string).write(emitter, **field_dict)
+
+def render_to(stream, node, idt=None, binary=None, encoding='utf-8', source_map=None):
+    """Write the source code of *node* to *stream*, as a freestanding node.
+
+    The source code is sent to the stream while the tree of nodes is walked,
+    so the whole output is never held in memory.
+    See :class:`Emitter` for the meaning of *binary* and *encoding*.
+
+    If *source_map* is a :class:`SourceMap`, it records the lines where the nodes
+    supporting it were written.
+    """
+    emitter = Emitter(stream, binary=binary, encoding=encoding, source_map=source_map)
+    if source_map is None:
+        node.write_freestanding(emitter, idt)
+    else:
+        _active_source_map_list.append(source_map)
+        try:
+            node.write_freestanding(emitter, idt)
+        finally:
+            _active_source_map_list.pop()
+    emitter.flush()
+
+# Nodes rendered by the worker process, when it is forked by render_parallel(). It is only set in the
+# worker processes, so each call to render_parallel() has its own list.
+_inherited_node_list = None
+
+def _set_inherited_node_list(node_list):
+    global _inherited_node_list
+    _inherited_node_list = node_list
+
+def _render_to_bytes(node, encoding, with_source_map):
+    stream = io.BytesIO()
+    source_map = SourceMap() if with_source_map else None
+    render_to(stream, node, binary=True, encoding=encoding, source_map=source_map)
+    # The source map is sent back as plain data, as the nodes it refers to only exist in the worker
+    return (stream.getvalue(), source_map.to_json_object() if with_source_map else None)
+
+def _render_inherited_node(index, encoding, with_source_map):
+    return _render_to_bytes(_inherited_node_list[index], encoding, with_source_map)
+
+def _render_pickled_node(data, encoding, with_source_map):
+    return _render_to_bytes(pickle.loads(data), encoding, with_source_map)
+
+def render_parallel(node_list, max_workers=None, encoding='utf-8', with_source_map=False):
+    """Render the nodes of *node_list* as freestanding nodes using a pool of processes, and return
+    a list of *(data, source_map)* tuples in the same order as *node_list*.
+
+    *data* is the output encoded with *encoding*, and *source_map* is a :class:`SourceMap` if *with_source_map*
+    is True, or None otherwise.
+
+    When the processes can be forked, they inherit the nodes from the calling process when they are created,
+    so nothing has to be transferred. Otherwise, the nodes are pickled, and the nodes that cannot be pickled are rendered
+    in the calling process while the pool renders the others.
+
+    :param max_workers: the number of processes of the pool, as for :class:`concurrent.futures.ProcessPoolExecutor`.
+                        The nodes are rendered in the calling process if it is 1.
+    """
+    node_list = list(node_list)
+    result_list = [None]*len(node_list)
+
+    if max_workers == 1 or len(node_list) <= 1:
+        result_list = [_render_to_bytes(node, encoding, with_source_map) for node in node_list]
+
+    elif 'fork' in multiprocessing.get_all_start_methods():
+        # The arguments of the initializer are not pickled when the processes are forked
+        with concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('fork'),
+            initializer=_set_inherited_node_list, initargs=(node_list,)
+        ) as executor:
+            result_list = list(executor.map(_render_inherited_node,
+                range(len(node_list)), itertools.repeat(encoding), itertools.repeat(with_source_map)
+            ))
+
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            future_dict = dict()
+            serial_index_list = list()
+            for i, node in enumerate(node_list):
+                try:
+                    data = pickle.dumps(node, pickle.HIGHEST_PROTOCOL)
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    serial_index_list.append(i)
+                else:
+                    future_dict[i] = executor.submit(_render_pickled_node, data, encoding, with_source_map)
+
+            for i in serial_index_list:
+                result_list[i] = _render_to_bytes(node_list[i], encoding, with_source_map)
+            for i, future in future_dict.items():
+                result_list[i] = future.result()
+
+    return [
+        (data, SourceMap.from_json_object(source_map_data) if source_map_data is not None else None)
+        for data, source_map_data in result_list
+    ]
+
 class Indentation:
-    """This class manages the indentation in the source code output.
+    """This class represents an indentation level in the source code output.
 
     Instances can be printed to give the string to put at the beginning of a new indented line.
+    They are immutable and interned: there is only one instance for a given class, indentation string and level,
+    and its string is computed once. :meth:`indent` and :meth:`dedent` return the instance of the next or previous
+    level, so the same instance can be shared by nodes rendered concurrently.
 
     >>> idt = Indentation()
-    >>> idt.indent()
+    >>> idt = idt.indent()
     >>> print('*'+str(idt)+'indented Hello World')
     *    indented Hello World
+    >>> idt is Indentation(1)
+    True
     """
 
     # Default indentation style (4 spaces)
     indentation_string = '    '
 
+    # Interned instances, with (class, indentation string, level) as keys
+    _instance_dict = dict()
+
     @classmethod
     def ensure_idt(cls, idt):
-        """Create a new indentation instance if *idt* is None,
+        """Return the indentation of level 0 if *idt* is None, an indentation of level *idt* if it is an integer,
+           an indentation of level 0 using *idt* as indentation string if it is a string,
            or return *idt* if it is already an :class:`Indentation` instance.
         """
         if idt is None:
@@ -159,31 +389,1057 @@ class Indentation:
             idt = cls(indentator=idt)
         return idt
 
-
-    def __init__(self, level=0, indentator=None):
+    def __new__(cls, level=0, indentator=None):
         """
-        :param level: the initial indentation level
+        :param level: the indentation level
         :type level: int
         :param indentator: the string used to display indentation.
                            It defaults to the class attribute *indentation_string* which is four spaces.
         """
-        self.indentation_level = level
-        # If an indentation is string is given, override the classwide default with
-        # an instance-local string
-        if indentator is not None:
-            self.indentation_string = indentator
+        if indentator is None:
+            indentator = cls.indentation_string
+        key = (cls, indentator, level)
+        try:
+            return cls._instance_dict[key]
+        except KeyError:
+            pass
+
+        self = super().__new__(cls)
+        object.__setattr__(self, 'indentation_level', level)
+        object.__setattr__(self, 'indentation_string', indentator)
+        object.__setattr__(self, '_prefix', indentator*level)
+        object.__setattr__(self, '_next', None)
+        return cls._instance_dict.setdefault(key, self)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Indentation instances are immutable, use indent() or dedent() to get another level')
+
+    __delattr__ = __setattr__
 
     def indent(self, level=1):
-        """Increase the indentation level by *level* levels."""
-        self.indentation_level += level
+        """Return the indentation increased by *level* levels."""
+        if level == 1:
+            next_idt = self._next
+            if next_idt is None:
+                next_idt = type(self)(self.indentation_level+1, self.indentation_string)
+                object.__setattr__(self, '_next', next_idt)
+            return next_idt
+        return type(self)(self.indentation_level+level, self.indentation_string)
 
     def dedent(self, level=1):
-        """Decrease the indentation level by *level* levels."""
-        self.indentation_level -= level
+        """Return the indentation decreased by *level* levels."""
+        return type(self)(self.indentation_level-level, self.indentation_string)
 
     def __str__(self):
         """Return the string to be used at the beginning of a line to display the indentation."""
-        return self.indentation_string * self.indentation_level
+        return self._prefix
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r})'.format(type(self).__name__, self.indentation_level, self.indentation_string)
+
+    def __reduce__(self):
+        # Unpickle as the interned instance
+        return (type(self), (self.indentation_level, self.indentation_string))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class _EmitterFilter:
+    """Base class of the filters an :class:`Emitter` applies to the beginning of a region of its output.
+
+    A filter is pending until it has seen enough of the output of its region to know what to do.
+    It then transforms once the content it has kept for itself, and lets everything else go through.
+    Filters are used as context managers delimiting their region.
+    """
+    __slots__ = ('emitter', 'pending')
+
+    def __init__(self, emitter):
+        self.emitter = emitter
+        self.pending = True
+
+    def __enter__(self):
+        self.emitter._pending_filter_list.append(self)
+        return self
+
+    def __exit__(self, *args):
+        if self.pending:
+            # Inner regions are already closed, so this filter is the innermost pending one
+            self.pending = False
+            self.emitter._pending_filter_list.pop()
+            self.emitter._emit(self.close())
+
+    def feed(self, chunk):
+        """Return what must be written when *chunk* is written inside the region."""
+        raise NotImplementedError
+
+    def close(self):
+        """Return what must be written when the region ends while the filter is still pending."""
+        return ''
+
+class _LazyPrefixFilter(_EmitterFilter):
+    """Write a prefix before the content of the region, only if this content is not empty."""
+    __slots__ = ('prefix',)
+
+    def __init__(self, emitter, prefix):
+        self.prefix = prefix
+        super().__init__(emitter)
+
+    def feed(self, chunk):
+        self.pending = False
+        return self.prefix+chunk
+
+class _StripBlankLinesFilter(_EmitterFilter):
+    """Apply :func:`strip_starting_blank_lines` to the content of the region."""
+    __slots__ = ('buffer',)
+
+    def __init__(self, emitter):
+        self.buffer = ''
+        super().__init__(emitter)
+
+    def feed(self, chunk):
+        # Only the leading blank characters are kept, until something else shows up
+        if not chunk.lstrip('\n\t \v'):
+            self.buffer += chunk
+            return ''
+        else:
+            self.pending = False
+            return strip_starting_blank_lines(self.buffer+chunk)
+
+    def close(self):
+        return strip_starting_blank_lines(self.buffer)
+
+class _IndentationLayer:
+    """Context manager adding an indentation string after each new line written inside the *with* statement."""
+    __slots__ = ('emitter', 'indentation_string')
+
+    def __init__(self, emitter, indentation_string):
+        self.emitter = emitter
+        self.indentation_string = indentation_string
+
+    def __enter__(self):
+        emitter = self.emitter
+        emitter._indentation_list.append(self.indentation_string)
+        if self.indentation_string:
+            emitter._indentation_size += len(self.indentation_string)
+            emitter._new_line = None
+        return self
+
+    def __exit__(self, *args):
+        emitter = self.emitter
+        indentation_string = emitter._indentation_list.pop()
+        if indentation_string:
+            emitter._indentation_size -= len(indentation_string)
+            emitter._new_line = None
+
+class Emitter:
+    """This class receives the chunks of source code produced by the nodes when they are written
+    with :meth:`NodeABC.write_inline` and :meth:`NodeABC.write_freestanding`, and forwards them to a stream.
+
+    The chunks are buffered and sent to the stream by blocks of *buffer_size* characters, so the memory
+    used when writing a tree of nodes does not depend on the size of the output. When no stream is given,
+    the chunks are kept in memory and the output can be retrieved with :meth:`getvalue`.
+
+    The emitter also manages the indentation added by the nodes that indent their content (see :meth:`indent`):
+    the indentation of all the enclosing nodes is inserted once when a new line is written, instead of
+    having each node re-indenting the already printed content of its children.
+
+    >>> emitter = Emitter()
+    >>> emitter.write('Hello ')
+    >>> emitter.write('World')
+    >>> emitter.getvalue()
+    'Hello World'
+    """
+
+    # Default number of characters buffered before writing to the stream
+    buffer_size = 64*1024
+
+    def __init__(self, stream=None, binary=None, encoding='utf-8', buffer_size=None, source_map=None):
+        """
+        :param stream: the file object the output is written to. If None, the output is kept in memory.
+        :param binary: True if *stream* expects bytes instead of strings. It defaults to True
+                       for instances of :class:`io.RawIOBase` and :class:`io.BufferedIOBase`.
+        :param encoding: the encoding used when *stream* is a binary stream.
+        :param buffer_size: the number of characters buffered before writing to the stream.
+                            It defaults to the class attribute *buffer_size*.
+        :param source_map: the :class:`SourceMap` that receives the markers found in the output.
+        """
+        self.stream = stream
+        self.source_map = source_map
+        if binary is None:
+            binary = isinstance(stream, (io.RawIOBase, io.BufferedIOBase))
+        self.binary = binary
+        self.encoding = encoding
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+
+        self._chunk_list = []
+        self._chunk_list_size = 0
+        self._pending_filter_list = []
+        # Indentation strings of the enclosing indentation layers, and their total length. The string
+        # that replaces the new lines is only built when needed, so entering and leaving thousands of
+        # nested layers does not copy the indentation each time
+        self._indentation_list = []
+        self._indentation_size = 0
+        self._new_line = '\n'
+
+    def _get_new_line(self):
+        """Return the string that replaces new lines, with the indentation of all the enclosing layers."""
+        new_line = self._new_line
+        if new_line is None:
+            new_line = self._new_line = '\n'+''.join(self._indentation_list)
+        return new_line
+
+    def write(self, chunk):
+        """Write the string *chunk*."""
+        if chunk:
+            if self._indentation_size and '\n' in chunk:
+                chunk = chunk.replace('\n', self._get_new_line())
+            self._emit(chunk)
+
+    def _emit(self, chunk):
+        # Give the chunk to the pending filters, from the innermost region to the outermost one
+        pending_filter_list = self._pending_filter_list
+        while pending_filter_list and chunk:
+            pending_filter = pending_filter_list[-1]
+            chunk = pending_filter.feed(chunk)
+            if pending_filter.pending:
+                return
+            pending_filter_list.pop()
+
+        if self.source_map is not None:
+            chunk = self.source_map.consume(chunk)
+        if not chunk:
+            return
+        self._chunk_list.append(chunk)
+        if self.stream is not None:
+            self._chunk_list_size += len(chunk)
+            if self._chunk_list_size >= self.buffer_size:
+                self.flush()
+
+    def indent(self, indentation_string):
+        """Return a context manager that inserts *indentation_string* after each new line written
+        inside the *with* statement.
+        """
+        return _IndentationLayer(self, str(indentation_string))
+
+    def lazy_prefix(self, prefix):
+        """Return a context manager that writes *prefix* before the content written
+        inside the *with* statement, only if there is such content.
+        """
+        # The prefix is indented according to the place where it is written, not according
+        # to the place where it is triggered
+        return _LazyPrefixFilter(self, prefix.replace('\n', self._get_new_line()))
+
+    def strip_starting_blank_lines(self):
+        """Return a context manager that applies :func:`strip_starting_blank_lines` to the
+        content written inside the *with* statement.
+        """
+        return _StripBlankLinesFilter(self)
+
+    def flush(self):
+        """Send the buffered chunks to the stream."""
+        if self.stream is None or not self._chunk_list:
+            return
+        data = ''.join(self._chunk_list)
+        self._chunk_list.clear()
+        self._chunk_list_size = 0
+        if self.binary:
+            data = data.encode(self.encoding)
+        self.stream.write(data)
+
+    def getvalue(self):
+        """Return the output as a string, when no stream was given."""
+        return ''.join(self._chunk_list)
+
+
+# Stack of the source maps of the outputs being rendered
+_active_source_map_list = []
+
+class SourceMap:
+    """This class records which Python code created each line of a generated file.
+
+    Nodes that want to appear in the source map write a marker returned by :meth:`marker`
+    instead of a debugging comment. The marker is removed from the output by the :class:`Emitter`
+    writing to the file, which records the line where it was found. Unlike comments containing
+    a backtrace, the generated code does not change when the Python code creating it moves, which
+    keeps build caches such as ccache effective.
+
+    The source map is meant to be saved next to the generated file with :meth:`save`, and can be
+    queried with :meth:`lookup`, or from the command line with ``python -m brownbat.sourcemap``.
+    """
+
+    marker_start = '\uE000'
+    marker_end = '\uE001'
+
+    # Objects that can be referenced by a marker, by serial number
+    _provenance_dict = weakref.WeakValueDictionary()
+    _serial_counter = itertools.count()
+
+    def __init__(self, filename=None):
+        """
+        :param filename: name of the generated file, stored in the saved source map.
+        """
+        self.filename = filename
+        # Line number of the last line of the output seen so far
+        self.line_number = 1
+        # List of (line number, entry list) tuples. An entry is a (description, location list) tuple
+        self.line_entry_list = []
+
+    @staticmethod
+    def is_active():
+        """Return True if a source map is recording the output being rendered."""
+        return bool(_active_source_map_list)
+
+    @classmethod
+    def marker(cls, provenance):
+        """Return the marker to write in the output for *provenance*, or an empty string
+        when no source map is active.
+
+        *provenance* must have a *source_map_entry_list* method returning a list of
+        *(description, location_list)* tuples, where *location_list* is a list of
+        *(filename, lineno, function)* tuples.
+        """
+        if not _active_source_map_list:
+            return ''
+        serial = getattr(provenance, '_source_map_serial', None)
+        if serial is None:
+            serial = next(cls._serial_counter)
+            provenance._source_map_serial = serial
+            cls._provenance_dict[serial] = provenance
+        return cls.marker_start+str(serial)+cls.marker_end
+
+    def consume(self, chunk):
+        """Record the markers found in the chunk of output *chunk*, and return the chunk without them."""
+        marker_start = self.marker_start
+        if marker_start not in chunk:
+            self.line_number += chunk.count('\n')
+            return chunk
+
+        part_list = chunk.split(marker_start)
+        text = part_list[0]
+        self.line_number += text.count('\n')
+        text_list = [text]
+        for part in part_list[1:]:
+            serial, _, text = part.partition(self.marker_end)
+            provenance = self._provenance_dict.get(int(serial))
+            if provenance is not None:
+                self.line_entry_list.append((self.line_number, provenance.source_map_entry_list()))
+            self.line_number += text.count('\n')
+            text_list.append(text)
+        return ''.join(text_list)
+
+    def lookup(self, line_number):
+        """Return the list of *(description, location_list)* entries recorded for the line *line_number*."""
+        return [
+            entry
+            for entry_line_number, entry_list in self.line_entry_list if entry_line_number == line_number
+            for entry in entry_list
+        ]
+
+    def format_entry_list(self, entry_list):
+        """Format a list of entries like the automatic debugging comments."""
+        return ' '.join(
+            ('{description} created at {locations}' if i == 0 else '(view of {description} created at {locations})').format(
+                description = description,
+                locations = ', '.join(
+                    '{0}:{1}({2})'.format(os.path.relpath(filename), lineno, function)
+                    for filename, lineno, function in location_list
+                )
+            ) for i, (description, location_list) in enumerate(entry_list)
+        )
+
+    def save(self, path):
+        """Save the source map to the file at *path*."""
+        with open(path, 'w') as stream:
+            self.dump(stream)
+
+    def to_json_object(self):
+        """Return the source map as an object that can be serialized with :func:`json.dump`.
+
+        The locations are stored once in a table, and referenced by their index in the lines entries.
+        """
+        location_dict = collections.OrderedDict()
+        def location_index(location):
+            return location_dict.setdefault(tuple(location), len(location_dict))
+
+        line_list = [
+            [line_number, [
+                [description, [location_index(location) for location in location_list]]
+                for description, location_list in entry_list
+            ]]
+            for line_number, entry_list in self.line_entry_list
+        ]
+        return collections.OrderedDict((
+            ('version', 1),
+            ('file', self.filename),
+            ('locations', list(location_dict.keys())),
+            ('lines', line_list)
+        ))
+
+    def dump(self, stream):
+        """Write the source map to the file object *stream*, in a compact JSON format."""
+        json.dump(self.to_json_object(), stream, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, stream):
+        """Read a source map written by :meth:`dump` from the file object *stream*."""
+        return cls.from_json_object(json.load(stream))
+
+    @classmethod
+    def from_json_object(cls, data):
+        """Build a source map from an object returned by :meth:`to_json_object`."""
+        location_list = [tuple(location) for location in data['locations']]
+        source_map = cls(data['file'])
+        source_map.line_entry_list = [
+            (line_number, [
+                (description, [location_list[i] for i in index_list])
+                for description, index_list in entry_list
+            ])
+            for line_number, entry_list in data['lines']
+        ]
+        return source_map
+
+def load_source_map(path):
+    """Load the source map saved at *path* with :meth:`SourceMap.save`."""
+    with open(path) as stream:
+        return SourceMap.load(stream)
+
+
+class _HashingStream:
+    """Binary file object forwarding the data to *stream*, and computing its hash and size."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.stream.write(data)
+
+def _hash_file(path, block_size=64*1024):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(functools.partial(stream.read, block_size), b''):
+            file_hash.update(block)
+    return file_hash.digest()
+
+def _create_temp_file(directory, prefix):
+    """Create a new file in *directory* with a name starting with *prefix*, and return its path and
+    a binary file object to write it.
+
+    Unlike the files created by :mod:`tempfile`, which are only readable by the user, the file gets the
+    permissions of a file created with :func:`open`, as the umask of the process applies to it.
+    """
+    while True:
+        path = os.path.join(directory, prefix+os.urandom(6).hex())
+        try:
+            fd = os.open(path, os.O_CREAT|os.O_EXCL|os.O_WRONLY|getattr(os, 'O_BINARY', 0), 0o666)
+        except FileExistsError:
+            continue
+        return path, os.fdopen(fd, 'wb')
+
+OutputReport = collections.namedtuple('OutputReport', ('written_path_list', 'unchanged_path_list'))
+"""Result of :meth:`OutputSet.write`: the list of the paths of the files that were written, and the list of the
+paths of the files that were left untouched because their content did not change."""
+
+class OutputSet:
+    """This class writes a set of generated files, and only replaces the files whose content changed.
+
+    Build systems like make or ninja rely on the modification time of the files, so rewriting a file with the same
+    content triggers useless rebuilds. Each file is written to a temporary file in the same directory while its
+    hash is computed, and the temporary file atomically replaces the existing file only if the content is different.
+
+    >>> output_set = OutputSet('generated')
+    >>> output_set.add(header, 'foo.h') # doctest: +SKIP
+    >>> report = output_set.write() # doctest: +SKIP
+    """
+
+    def __init__(self, directory='.', encoding='utf-8', source_map=False):
+        """
+        :param directory: the directory where the files are written. The paths of the files are relative to it.
+        :param encoding: the encoding of the files.
+        :param source_map: if True, a :class:`SourceMap` is saved next to each file, with the same name followed by ``.map``.
+        """
+        self.directory = directory
+        self.encoding = encoding
+        self.source_map = source_map
+        # List of (path, node) tuples, in the order they were added
+        self.output_list = list()
+
+    def add(self, node, path=None):
+        """Add the node *node* to be written as a freestanding node to the file at *path*.
+
+        If *path* is None, the *path* attribute of the node is used, like :attr:`brownbat.C.HeaderFile.path`.
+        """
+        if path is None:
+            path = getattr(node, 'path', None)
+            if path is None:
+                raise ValueError('No path given for the node and the node has no path')
+        self.output_list.append((path, node))
+
+    def __iter__(self):
+        return iter(self.output_list)
+
+    def __len__(self):
+        return len(self.output_list)
+
+    def write(self, max_workers=1):
+        """Write all the files and return an :class:`OutputReport`.
+
+        :param max_workers: if it is not 1, the files are rendered in parallel with :func:`render_parallel`,
+                            using *max_workers* processes.
+        """
+        if max_workers != 1:
+            result_list = render_parallel((node for path, node in self.output_list),
+                max_workers=max_workers, encoding=self.encoding, with_source_map=self.source_map
+            )
+        else:
+            result_list = itertools.repeat(None)
+
+        written_path_list = list()
+        unchanged_path_list = list()
+        for (path, node), result in zip(self.output_list, result_list):
+            path = os.path.join(self.directory, path)
+            if result is not None:
+                data, source_map = result
+                write_fun = lambda stream: stream.write(data)
+            else:
+                source_map = SourceMap() if self.source_map else None
+                write_fun = lambda stream: render_to(
+                    stream, node, binary=True, encoding=self.encoding, source_map=source_map
+                )
+
+            changed = self._write_file(path, write_fun)
+            (written_path_list if changed else unchanged_path_list).append(path)
+
+            if source_map is not None:
+                source_map.filename = os.path.basename(path)
+                map_path = path+'.map'
+                changed = self._write_file(map_path, lambda stream: stream.write(
+                    json.dumps(source_map.to_json_object(), separators=(',', ':')).encode('utf-8')
+                ))
+                (written_path_list if changed else unchanged_path_list).append(map_path)
+
+        return OutputReport(written_path_list, unchanged_path_list)
+
+    @staticmethod
+    def _write_file(path, write_fun):
+        """Call *write_fun* with a binary file object, and replace the file at *path* with what was written
+        if its content changed. Return True if the file was replaced.
+
+        The new file gets the permissions of the file it replaces, or the permissions it would have if it
+        was created with :func:`open`.
+        """
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+
+        temp_path, temp_file = _create_temp_file(directory, '.'+os.path.basename(path)+'.')
+        try:
+            with temp_file:
+                hashing_stream = _HashingStream(temp_file)
+                write_fun(hashing_stream)
+
+            try:
+                path_stat = os.stat(path)
+            except FileNotFoundError:
+                path_stat = None
+            unchanged = (path_stat is not None and path_stat.st_size == hashing_stream.size
+                and _hash_file(path) == hashing_stream.hash.digest())
+
+            if unchanged:
+                os.remove(temp_path)
+            else:
+                if path_stat is not None:
+                    os.chmod(temp_path, stat.S_IMODE(path_stat.st_mode))
+                os.replace(temp_path, path)
+            return not unchanged
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+# Stack of the nodes with an enabled render cache that are being rendered
+_render_cache_stack = []
+
+class _RenderCacheState:
+    """Render cache of a node, and the nodes with a render cache that rendered it."""
+    __slots__ = ('owner_id', 'cache_dict', 'dependent_dict')
+
+    def __init__(self, owner):
+        # The state used to be copied with the attributes of the node when copying it, so it
+        # must be able to tell which node it belongs to
+        self.owner_id = id(owner)
+        # Only created when the render cache of the node is enabled
+        self.cache_dict = None
+        # Map the id of the dependents to weak references to them. A WeakSet is
+        # much slower to create, and most nodes never get a dependent
+        self.dependent_dict = dict()
+
+    def add_dependent(self, dependent):
+        self.dependent_dict[id(dependent)] = weakref.ref(dependent)
+
+def _get_render_cache_state(node):
+    state = getattr(node, '_render_cache_state', None)
+    if state is None or state.owner_id != id(node):
+        state = _RenderCacheState(node)
+        node._render_cache_state = state
+    return state
+
+def _record_render_dependency(node):
+    """Record that the node with a render cache currently being rendered depends on *node*."""
+    dependent = _render_cache_stack[-1]
+    if dependent is not node:
+        _get_render_cache_state(node).add_dependent(dependent)
+    # Views are printed from the attributes of their parent, and the parent is the node invalidated
+    # when these attributes are replaced. The rendering steps of a view can also run the rendering
+    # steps of its parent directly, without going through its streaming methods.
+    if isinstance(node, NodeViewBase):
+        parent = node.parent
+        if parent is not None and parent is not dependent:
+            _get_render_cache_state(parent).add_dependent(dependent)
+
+def invalidate_render_cache(node):
+    """Invalidate the render cache of *node* and of all the nodes which printed it when their
+    render cache was filled.
+
+    This is called automatically by the operations modifying the nodes, but must be called manually
+    when something the nodes cannot know about changed, such as the string returned by a plain object
+    stored in a token list.
+    """
+    node_list = [node]
+    while node_list:
+        node = node_list.pop()
+        if isinstance(node, RenderObserver):
+            node.callback()
+            continue
+        state = getattr(node, '_render_cache_state', None)
+        if state is None or state.owner_id != id(node):
+            continue
+        if state.cache_dict:
+            state.cache_dict.clear()
+        for dependent_ref in state.dependent_dict.values():
+            dependent = dependent_ref()
+            if dependent is not None:
+                node_list.append(dependent)
+        state.dependent_dict.clear()
+
+class RenderObserver:
+    """This class records the nodes read while it is used as a context manager, and calls
+    *callback* without parameters when one of them is modified.
+
+    It relies on the bookkeeping of the render cache: the nodes printed or iterated over inside the
+    *with* statement are recorded, and are considered modified when :func:`invalidate_render_cache`
+    is called on them. It allows some information computed from a tree of nodes to be updated only
+    when needed.
+    """
+    __slots__ = ('callback', '__weakref__')
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def __enter__(self):
+        _render_cache_stack.append(self)
+        return self
+
+    def __exit__(self, *args):
+        _render_cache_stack.pop()
+
+    def add_dependency(self, node):
+        """Record that the observer depends on *node*, even if it was not printed or iterated over."""
+        _get_render_cache_state(node).add_dependent(self)
+
+def _render_cache_key(fun, idt):
+    """Build the key of the render cache for the method *fun* called with *idt*."""
+    if idt is not None:
+        # Indentations are interned, so equal indentations are the same instance
+        idt = Indentation.ensure_idt(idt)
+    # The output contains source map markers only when a source map is active
+    return (fun, idt, bool(_active_source_map_list))
+
+def _make_cached_writer(write_fun):
+    """Wrap the streaming method *write_fun* to use the render cache of the node."""
+    @functools.wraps(write_fun)
+    def wrapper_fun(self, emitter, idt=None):
+        if _render_cache_stack:
+            _record_render_dependency(self)
+        if not self.render_cache_enabled:
+            return write_fun(self, emitter, idt)
+
+        state = _get_render_cache_state(self)
+        cache_dict = state.cache_dict
+        if cache_dict is None:
+            cache_dict = state.cache_dict = dict()
+        key = _render_cache_key(write_fun, idt)
+        try:
+            snippet = cache_dict[key]
+        except KeyError:
+            # Render in a separate emitter, to get the output of the node alone
+            node_emitter = Emitter()
+            _render_cache_stack.append(self)
+            try:
+                write_fun(self, node_emitter, idt)
+            finally:
+                _render_cache_stack.pop()
+            snippet = node_emitter.getvalue()
+            cache_dict[key] = snippet
+
+        emitter.write(snippet)
+
+    return wrapper_fun
+
+def _make_cached_str_renderer(str_fun):
+    """Wrap the string method *str_fun* to use the render cache of the node."""
+    @functools.wraps(str_fun)
+    def wrapper_fun(self, idt=None, *args, **kwargs):
+        if _render_cache_stack:
+            _record_render_dependency(self)
+        # Calls with extra parameters are not cached
+        if not self.render_cache_enabled or args or kwargs:
+            return str_fun(self, idt, *args, **kwargs)
+
+        state = _get_render_cache_state(self)
+        cache_dict = state.cache_dict
+        if cache_dict is None:
+            cache_dict = state.cache_dict = dict()
+        key = _render_cache_key(str_fun, idt)
+        try:
+            return cache_dict[key]
+        except KeyError:
+            _render_cache_stack.append(self)
+            try:
+                snippet = str_fun(self, idt)
+            finally:
+                _render_cache_stack.pop()
+            cache_dict[key] = snippet
+            return snippet
+
+    return wrapper_fun
+
+
+RenderProfileStat = collections.namedtuple('RenderProfileStat',
+    ('call_count', 'inclusive_time', 'exclusive_time', 'output_size'))
+RenderProfileStat.__doc__ = """Statistics recorded by :class:`RenderProfiler` for a node class or a tree path.
+
+The times are in seconds, and *output_size* is the number of characters produced. The inclusive time
+and output size of a node class only account for its outermost calls, so nested nodes of the same class
+are not counted twice.
+"""
+
+class RenderProfiler:
+    """This class records where the time is spent when rendering nodes, while it is used as a context manager.
+
+    The rendering methods built by :class:`NodeMeta` (:meth:`NodeABC.inline_str`, :meth:`NodeABC.self_inline_str`,
+    :meth:`NodeABC.freestanding_str` and their streaming counterparts) and the *inline_str_filter* methods defined
+    in node classes are instrumented when entering the *with* statement, and restored when leaving it, so the
+    profiler costs nothing when it is not used. The calls of *self_inline_str* and *inline_str_filter* appear as
+    separate entries named after the class and the method.
+
+    The statistics are available per node class in :attr:`class_stat_dict` and per tree path in
+    :attr:`path_stat_dict`, and can be exported as a text report with :meth:`report` or as a flame graph
+    with :meth:`save_collapsed_stacks`.
+
+    >>> with RenderProfiler() as profiler: # doctest: +SKIP
+    ...     str(header)
+    >>> print(profiler.report(10)) # doctest: +SKIP
+    """
+
+    # Methods instrumented, with the suffix of the entry name of their calls
+    profiled_method_dict = collections.OrderedDict((
+        ('inline_str', ''),
+        ('freestanding_str', ''),
+        ('write_inline', ''),
+        ('write_freestanding', ''),
+        ('self_inline_str', '.self_inline_str'),
+        ('inline_str_filter', '.inline_str_filter'),
+    ))
+
+    # Key of the number of characters written to an emitter, in its __dict__
+    _emitter_size_key = '_render_profiler_written_size'
+
+    def __init__(self, timer=None):
+        """
+        :param timer: function returning the current time in seconds. It defaults to :func:`time.perf_counter`.
+        """
+        self.timer = timer if timer is not None else time.perf_counter
+        self.class_stat_dict = dict()
+        """Dictionary of :class:`RenderProfileStat` with the names of the node classes as keys."""
+        self.path_stat_dict = dict()
+        """Dictionary of :class:`RenderProfileStat` with tuples of entry names from the root of the tree as keys."""
+        # Stack of [path, time spent in children, node] for the calls in progress
+        self._frame_list = []
+        self._restore_list = []
+
+    def __enter__(self):
+        if self._restore_list:
+            raise RuntimeError('A RenderProfiler cannot be entered twice at the same time')
+
+        class_list = [NodeABC]
+        seen_class_set = set(class_list)
+        while class_list:
+            cls = class_list.pop()
+            for method_name, suffix in self.profiled_method_dict.items():
+                fun = cls.__dict__.get(method_name)
+                # Static methods, class methods and other descriptors are left untouched
+                if not isinstance(fun, types.FunctionType):
+                    continue
+                self._restore_list.append((cls, method_name, fun))
+                setattr(cls, method_name, self._make_profiled_fun(fun, suffix, method_name.startswith('write_')))
+            for subclass in cls.__subclasses__():
+                if subclass not in seen_class_set:
+                    seen_class_set.add(subclass)
+                    class_list.append(subclass)
+
+        # Count the characters written to the emitters, to get the output size of the streaming methods
+        write_fun = Emitter.write
+        size_key = self._emitter_size_key
+        def counting_write(emitter, chunk):
+            emitter_dict = emitter.__dict__
+            emitter_dict[size_key] = emitter_dict.get(size_key, 0)+len(chunk)
+            write_fun(emitter, chunk)
+        self._restore_list.append((Emitter, 'write', write_fun))
+        Emitter.write = counting_write
+
+        return self
+
+    def __exit__(self, *args):
+        for cls, method_name, fun in reversed(self._restore_list):
+            setattr(cls, method_name, fun)
+        self._restore_list.clear()
+        self._frame_list.clear()
+
+    def _make_profiled_fun(self, fun, suffix, is_write_fun):
+        profile_call = self._profile_call
+        if is_write_fun:
+            @functools.wraps(fun)
+            def profiled_fun(node, emitter, *args, **kwargs):
+                return profile_call(fun, suffix, emitter, node, emitter, *args, **kwargs)
+        else:
+            @functools.wraps(fun)
+            def profiled_fun(node, *args, **kwargs):
+                return profile_call(fun, suffix, None, node, *args, **kwargs)
+        return profiled_fun
+
+    def _profile_call(self, fun, suffix, emitter, node, *args, **kwargs):
+        frame_list = self._frame_list
+        # A rendering method implemented with another rendering method of the same node is accounted
+        # in the outermost one
+        if not suffix and frame_list and frame_list[-1][2] is node:
+            return fun(node, *args, **kwargs)
+
+        name = type(node).__name__+suffix
+        path = frame_list[-1][0]+(name,) if frame_list else (name,)
+        frame = [path, 0, node]
+        frame_list.append(frame)
+
+        if emitter is not None:
+            size_before = emitter.__dict__.get(self._emitter_size_key, 0)
+        begin = self.timer()
+        try:
+            result = fun(node, *args, **kwargs)
+        finally:
+            elapsed = self.timer()-begin
+            frame_list.pop()
+            if frame_list:
+                frame_list[-1][1] += elapsed
+
+        if emitter is not None:
+            output_size = emitter.__dict__.get(self._emitter_size_key, 0)-size_before
+        else:
+            output_size = len(result) if isinstance(result, str) else 0
+
+        exclusive_time = elapsed-frame[1]
+        self._add_stat(self.path_stat_dict, path, elapsed, exclusive_time, output_size)
+        # Only the outermost call of recursive classes is accounted in the inclusive measurements
+        if name in path[:-1]:
+            elapsed = 0
+            output_size = 0
+        self._add_stat(self.class_stat_dict, name, elapsed, exclusive_time, output_size)
+
+        return result
+
+    @staticmethod
+    def _add_stat(stat_dict, key, inclusive_time, exclusive_time, output_size):
+        stat = stat_dict.get(key)
+        if stat is None:
+            stat_dict[key] = RenderProfileStat(1, inclusive_time, exclusive_time, output_size)
+        else:
+            stat_dict[key] = RenderProfileStat(
+                stat.call_count+1,
+                stat.inclusive_time+inclusive_time,
+                stat.exclusive_time+exclusive_time,
+                stat.output_size+output_size
+            )
+
+    def report(self, top=20, sort_key='exclusive_time'):
+        """Return a text report of the *top* node classes, sorted by decreasing *sort_key*, which
+        is a field of :class:`RenderProfileStat`.
+        """
+        if sort_key not in RenderProfileStat._fields:
+            raise ValueError('Unknown sort key "'+str(sort_key)+'", must be one of: '+', '.join(RenderProfileStat._fields))
+
+        item_list = sorted(self.class_stat_dict.items(), key=lambda item: getattr(item[1], sort_key), reverse=True)
+        total_time = sum(stat.exclusive_time for stat in self.class_stat_dict.values()) or 1
+        line_list = ['{0:<40} {1:>10} {2:>12} {3:>12} {4:>7} {5:>12}'.format(
+            'node class', 'calls', 'inclusive s', 'exclusive s', '%', 'output size'
+        )]
+        for name, stat in item_list[:top]:
+            line_list.append('{0:<40} {1:>10} {2:>12.6f} {3:>12.6f} {4:>6.1f}% {5:>12}'.format(
+                name, stat.call_count, stat.inclusive_time, stat.exclusive_time,
+                100*stat.exclusive_time/total_time, stat.output_size
+            ))
+        return '\n'.join(line_list)
+
+    def collapsed_stack_list(self):
+        """Return the lines of the flame graph in the collapsed stack format, with the
+        exclusive time of each tree path in microseconds.
+        """
+        return [
+            ';'.join(path)+' '+str(int(round(stat.exclusive_time*1e6)))
+            for path, stat in sorted(self.path_stat_dict.items())
+        ]
+
+    def save_collapsed_stacks(self, path):
+        """Save the flame graph in the collapsed stack format to the file *path*.
+
+        The file can be turned into a flame graph by tools such as flamegraph.pl or speedscope.
+        """
+        with open(path, 'w', encoding='utf-8') as stream:
+            for line in self.collapsed_stack_list():
+                stream.write(line+'\n')
+
+
+# Map the streaming methods built by NodeMeta from rendering steps to these rendering steps
+_render_step_driver_dict = dict()
+
+# Map the streaming method names to dicts mapping the classes to a tuple (streaming method, rendering steps),
+# see _get_render_step_fun()
+_render_step_fun_dict = {'write_inline': dict(), 'write_freestanding': dict()}
+
+def _get_render_step_fun(node, write_fun_name):
+    """Return the function giving the rendering steps that the streaming method *write_fun_name*
+    of *node* would run, or None if this method must be called.
+
+    The method is called when it was not built from rendering steps, for example when the class
+    only implements the classic methods or when the method is instrumented by :class:`RenderProfiler`,
+    and when the node uses the render cache or has its own inline_str_filter.
+    """
+    cls = type(node)
+    write_fun = getattr(cls, write_fun_name)
+    class_dict = _render_step_fun_dict[write_fun_name]
+    try:
+        cached_write_fun, step_fun = class_dict[cls]
+    except KeyError:
+        cached_write_fun = None
+    # The methods of the classes can be replaced, for example by RenderProfiler
+    if cached_write_fun is not write_fun:
+        step_fun = _render_step_driver_dict.get(getattr(write_fun, '__wrapped__', None))
+        class_dict[cls] = (write_fun, step_fun)
+
+    if step_fun is None or node.render_cache_enabled:
+        return None
+    # Some instances have their own write_inline() method, to apply their inline_str_filter
+    if getattr(getattr(node, write_fun_name), '__func__', None) is not write_fun:
+        return None
+    return step_fun
+
+class WriteCall:
+    """This class represents a call to a streaming method of a node, yielded by the rendering steps of another node.
+
+    The rendering steps of a node (see :meth:`NodeABC.iter_write_inline`) are given by a generator that writes the
+    content of the node to the emitter, and yields a :class:`WriteCall` instead of calling the streaming method of a
+    child node. :func:`run_render_steps` then renders the child with its own rendering steps, so the depth of the tree
+    does not translate into nested Python calls.
+    """
+    __slots__ = ('node', 'write_fun_name', 'emitter', 'idt')
+
+    def __init__(self, node, write_fun_name, emitter, idt=None):
+        """
+        :param write_fun_name: the name of the streaming method, *write_inline* or *write_freestanding*.
+        """
+        self.node = node
+        self.write_fun_name = write_fun_name
+        self.emitter = emitter
+        self.idt = idt
+
+    @classmethod
+    def inline(cls, node, emitter, idt=None):
+        """Build the call to ``node.write_inline(emitter, idt)``."""
+        return cls(node, 'write_inline', emitter, idt)
+
+    @classmethod
+    def freestanding(cls, node, emitter, idt=None):
+        """Build the call to ``node.write_freestanding(emitter, idt)``."""
+        return cls(node, 'write_freestanding', emitter, idt)
+
+    def start(self):
+        """Return the rendering steps of the call, or call the streaming method and return None if the
+        node cannot be rendered with its rendering steps.
+        """
+        node = self.node
+        step_fun = _get_render_step_fun(node, self.write_fun_name)
+        if step_fun is None:
+            getattr(node, self.write_fun_name)(self.emitter, self.idt)
+            return None
+
+        # Do what the render cache wrapper of the streaming method would do
+        if _render_cache_stack:
+            _record_render_dependency(node)
+        return step_fun(node, self.emitter, self.idt)
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r})'.format(type(self).__name__, self.node, self.write_fun_name)
+
+def run_render_steps(step_iter):
+    """Run the rendering steps *step_iter*, and the rendering steps of the nodes it yields, using an explicit stack.
+
+    *step_iter* is a generator like the ones returned by :meth:`NodeABC.iter_write_inline`. It can yield
+    :class:`WriteCall` instances, that are rendered with the rendering steps of their node when it has some,
+    and other generators of rendering steps, that are run in place. An exception raised while rendering
+    an item is thrown into the generator that yielded it, as if the methods had been called recursively,
+    so the *with* statements of the generators are left in the right order.
+    """
+    stack = [step_iter]
+    exc = None
+    while stack:
+        step_iter = stack[-1]
+        try:
+            if exc is None:
+                item = next(step_iter)
+            else:
+                pending_exc, exc = exc, None
+                item = step_iter.throw(pending_exc)
+        except StopIteration:
+            stack.pop()
+            continue
+        except BaseException as e:
+            stack.pop()
+            if not stack:
+                raise
+            exc = e
+            continue
+
+        if item.__class__ is WriteCall:
+            # Same as WriteCall.start(), without the overhead of a method call for each node
+            node = item.node
+            try:
+                step_fun = _get_render_step_fun(node, item.write_fun_name)
+                if step_fun is None:
+                    getattr(node, item.write_fun_name)(item.emitter, item.idt)
+                    continue
+                if _render_cache_stack:
+                    _record_render_dependency(node)
+                item = step_fun(node, item.emitter, item.idt)
+            except BaseException as e:
+                exc = e
+                continue
+        stack.append(item)
 
 
 class NonIterable:
@@ -192,13 +1448,152 @@ class NonIterable:
     """
     pass
 
+def _make_filtered_str_fun(str_fun):
+    """Wrap the string method *str_fun* to call *inline_str_filter* on its return string."""
+    @functools.wraps(str_fun)
+    def wrapper_fun(self, *args, **kwargs):
+        return self.inline_str_filter(str_fun(self, *args, **kwargs))
+    wrapper_fun._applies_inline_str_filter = True
+    return wrapper_fun
+
+def _filtered_write_inline(self, emitter, idt=None):
+    # The filter needs the whole string
+    emitter.write(self.inline_str(idt))
+_filtered_write_inline._applies_inline_str_filter = True
+
+def _make_filtered_method(method_name):
+    """Build a method calling *inline_str_filter* on the string returned by the method *method_name*
+    of the class of the instance."""
+    def filtered_fun(self, *args, **kwargs):
+        return self.inline_str_filter(getattr(type(self), method_name)(self, *args, **kwargs))
+    filtered_fun.__name__ = method_name
+    return filtered_fun
+
+_filtered_method_dict = {
+    'inline_str': _make_filtered_method('inline_str'),
+    'self_inline_str': _make_filtered_method('self_inline_str'),
+}
+
+class InlineStrFilterAttribute:
+    """This class is the descriptor of the *inline_str_filter* attribute of :class:`NodeABC`.
+
+    When a function is assigned to *inline_str_filter* on a node, the :meth:`NodeABC.inline_str`,
+    :meth:`NodeABC.self_inline_str` and :meth:`NodeABC.write_inline` methods of that node are replaced
+    by methods applying the filter on the string they print. Reading the attribute raises
+    :exc:`AttributeError` when no filter was assigned.
+    """
+    # Name of the attribute of the instances storing the filter
+    storage_name = '_inline_str_filter'
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # Looking up the attribute does not create the __dict__ of the nodes that do not have one yet
+        try:
+            return getattr(instance, self.storage_name)
+        except AttributeError:
+            raise AttributeError("'"+type(instance).__name__+"' object has no attribute 'inline_str_filter'") from None
+
+    def __set__(self, instance, filter_fun):
+        instance_dict = instance.__dict__
+        instance_dict[self.storage_name] = filter_fun
+        self.install(instance)
+        invalidate_render_cache(instance)
+
+    def __delete__(self, instance):
+        instance_dict = instance.__dict__
+        try:
+            del instance_dict[self.storage_name]
+        except KeyError:
+            raise AttributeError('inline_str_filter') from None
+        for method_name in self.instance_method_name_list:
+            instance_dict.pop(method_name, None)
+        invalidate_render_cache(instance)
+
+    # Methods replaced in the instances that have a filter
+    instance_method_name_list = ('inline_str', 'self_inline_str', 'write_inline')
+
+    @staticmethod
+    def install(instance):
+        """Install the filtering methods in the *instance* that has a filter."""
+        cls = type(instance)
+        instance_dict = instance.__dict__
+        for method_name in NodeMeta.filtered_method_name_list:
+            if hasattr(cls, method_name):
+                instance_dict[method_name] = types.MethodType(_filtered_method_dict[method_name], instance)
+        instance_dict['write_inline'] = types.MethodType(_filtered_write_inline, instance)
+
 class NodeMeta(abc.ABCMeta):
     """Meta class used for every node, i.e. every class representing source code constructs.
 
-    Currently, it only does a bit of black magic on :meth:`NodeABC.inline_str` and :meth:`NodeABC.self_inline_str` methods:
-    it creates a wrapper around them that calls *inline_str_filter* if it exists on their return string, to
-    let the user apply some naming convention at the latest stage.
+    It does a bit of black magic on :meth:`NodeABC.inline_str` and :meth:`NodeABC.self_inline_str` methods:
+    when a class defines an *inline_str_filter* method, they are wrapped to call it on their return string, to
+    let the user apply some naming convention at the latest stage. Instances get the same wrappers when
+    *inline_str_filter* is set as an instance attribute (see :class:`InlineStrFilterAttribute`), so the nodes
+    without filter are printed without any overhead.
+
+    It also keeps each string method consistent with its streaming counterpart
+    (:meth:`NodeABC.inline_str` with :meth:`NodeABC.write_inline` and :meth:`NodeABC.freestanding_str`
+    with :meth:`NodeABC.write_freestanding`): when a class only defines one method of the pair, the other one
+    is built from it. That way, classes only implementing the string methods can still be streamed, and classes
+    only implementing the streaming methods can still be printed.
+
+    Likewise, the streaming methods are built from the rendering steps (:meth:`NodeABC.iter_write_inline`
+    and :meth:`NodeABC.iter_write_freestanding`) when a class only defines the latter, and the rendering
+    steps of the classes defining a streaming method are built from it, so they can be used by
+    :func:`run_render_steps` and by the rendering steps of the subclasses.
     """
+
+    # Methods whose output goes through inline_str_filter
+    filtered_method_name_list = ('inline_str', 'self_inline_str')
+
+    # Pairs of (string method name, streaming method name)
+    render_method_pair_list = (
+        ('inline_str', 'write_inline'),
+        ('freestanding_str', 'write_freestanding'),
+    )
+
+    # Pairs of (streaming method name, rendering steps method name)
+    render_step_method_pair_list = (
+        ('write_inline', 'iter_write_inline'),
+        ('write_freestanding', 'iter_write_freestanding'),
+    )
+
+    @staticmethod
+    def make_writer(str_fun):
+        """Build a streaming method that writes the string returned by *str_fun*."""
+        def write_fun(self, emitter, idt=None):
+            emitter.write(str_fun(self, idt))
+        return write_fun
+
+    @staticmethod
+    def make_str_renderer(write_fun):
+        """Build a string method that returns what *write_fun* writes."""
+        def str_fun(self, idt=None):
+            emitter = Emitter()
+            write_fun(self, emitter, idt)
+            return emitter.getvalue()
+        str_fun.__doc__ = write_fun.__doc__
+        return str_fun
+
+    @staticmethod
+    def make_step_writer(step_fun):
+        """Build a streaming method that runs the rendering steps given by *step_fun*."""
+        def write_fun(self, emitter, idt=None):
+            run_render_steps(step_fun(self, emitter, idt))
+        write_fun.__doc__ = step_fun.__doc__
+        _render_step_driver_dict[write_fun] = step_fun
+        return write_fun
+
+    @staticmethod
+    def make_step_fun(write_fun):
+        """Build a rendering steps method that calls *write_fun* in a single step."""
+        def step_fun(self, emitter, idt=None):
+            write_fun(self, emitter, idt)
+            yield from ()
+        step_fun.__doc__ = write_fun.__doc__
+        return step_fun
+
     def __new__(meta, name, bases, dct):
         # Add automatic 'inheritance' for __format_string class attribute
         attr_name = '_'+name+'__format_string'
@@ -208,32 +1603,138 @@ class NodeMeta(abc.ABCMeta):
             except KeyError:
                 pass
 
-        # Wrap inline_str function to allow automatic filtering on its output
-        def make_wrapper(wrapped_fun):
-            @functools.wraps(wrapped_fun)
-            def wrapper_fun(self, *args, **kwargs):
-                result = wrapped_fun(self, *args, **kwargs)
-                try:
-                    filter_fun = self.inline_str_filter
-                except AttributeError:
-                    # Just return the string as is, no filter hook is installed
-                    return result
-                else:
-                    # Call the filter on the resulting string
-                    return filter_fun(result)
+        # Build the streaming methods from the rendering steps defined in the class
+        for write_fun_name, step_fun_name in meta.render_step_method_pair_list:
+            if step_fun_name in dct and write_fun_name not in dct:
+                dct[write_fun_name] = meta.make_step_writer(dct[step_fun_name])
+
+        # Add the render cache to the methods defined in the class, and build the string
+        # methods from the streaming methods
+        user_write_fun_dict = dict()
+        for str_fun_name, write_fun_name in meta.render_method_pair_list:
+            if write_fun_name in dct:
+                user_write_fun_dict[write_fun_name] = _make_cached_writer(dct[write_fun_name])
+                dct[write_fun_name] = user_write_fun_dict[write_fun_name]
+                if str_fun_name not in dct:
+                    dct[str_fun_name] = meta.make_str_renderer(dct[write_fun_name])
+                    continue
+            if str_fun_name in dct:
+                dct[str_fun_name] = _make_cached_str_renderer(dct[str_fun_name])
+
+        # Build the streaming methods from the string methods defined in the class
+        for str_fun_name, write_fun_name in meta.render_method_pair_list:
+            if write_fun_name not in user_write_fun_dict and str_fun_name in dct:
+                dct[write_fun_name] = meta.make_writer(dct[str_fun_name])
+
+        cls = super().__new__(meta, name, bases, dct)
+
+        # Mixin classes that are not nodes may define only one method of a pair, so
+        # the nearest definition in the MRO is used to build the other one
+        for str_fun_name, write_fun_name in meta.render_method_pair_list:
+            for klass in cls.__mro__:
+                str_fun = klass.__dict__.get(str_fun_name)
+                write_fun = klass.__dict__.get(write_fun_name)
+                if str_fun is None and write_fun is None:
+                    continue
+                elif write_fun is None:
+                    str_fun = _make_cached_str_renderer(str_fun)
+                    setattr(cls, str_fun_name, str_fun)
+                    setattr(cls, write_fun_name, meta.make_writer(str_fun))
+                elif str_fun is None:
+                    write_fun = _make_cached_writer(write_fun)
+                    setattr(cls, write_fun_name, write_fun)
+                    setattr(cls, str_fun_name, meta.make_str_renderer(write_fun))
+                break
+
+        # Map the names of all the slots of the class to their member descriptor, to get their value
+        # without going through the descriptors that may use the same name in subclasses
+        slot_member_dict = dict()
+        for klass in reversed(cls.__mro__):
+            slot_name_list = klass.__dict__.get('__slots__', ())
+            if isinstance(slot_name_list, str):
+                slot_name_list = (slot_name_list,)
+            for slot_name in slot_name_list:
+                member = klass.__dict__.get(slot_name)
+                if isinstance(member, types.MemberDescriptorType):
+                    slot_member_dict[slot_name] = member
+        cls._slot_member_dict = slot_member_dict
+
+        # Classes with an inline_str_filter method get the filtering methods, the other ones
+        # are left untouched so printing them does not pay for the filters
+        if not isinstance(getattr(cls, 'inline_str_filter', None), (type(None), InlineStrFilterAttribute)):
+            for stringify_fun_name in meta.filtered_method_name_list:
+                fun = getattr(cls, stringify_fun_name, None)
+                if fun is not None and not getattr(fun, '_applies_inline_str_filter', False):
+                    setattr(cls, stringify_fun_name, _make_filtered_str_fun(fun))
+            if not getattr(cls.write_inline, '_applies_inline_str_filter', False):
+                cls.write_inline = _filtered_write_inline
+
+        # The rendering steps of the class must do what its streaming methods do
+        for write_fun_name, step_fun_name in meta.render_step_method_pair_list:
+            write_fun = cls.__dict__.get(write_fun_name)
+            if write_fun is not None and getattr(write_fun, '__wrapped__', None) not in _render_step_driver_dict:
+                setattr(cls, step_fun_name, meta.make_step_fun(write_fun))
+
+        return cls
 
-            return wrapper_fun
+class NodeABC(metaclass=NodeMeta):
+    """This class is an Abstract Base Class describing the most basic API evey node should conform to.
+
+    The most common attributes of the nodes are stored in slots declared by the base classes, instead
+    of in the *__dict__* of each instance, which is only created when another attribute is set. Subclasses
+    that do not declare *__slots__* still get a *__dict__*, so they can store any attribute.
+
+    Instead of the streaming methods, node classes can implement the rendering steps methods *iter_write_inline*
+    and *iter_write_freestanding*, taking the same parameters. They are generators writing the content of the
+    node to the emitter like the streaming methods, but they yield a :class:`WriteCall` (or the rendering steps
+    of a base class) instead of calling the streaming methods of the nodes they contain. :class:`NodeMeta` builds
+    the streaming methods from them, which render the tree with :func:`run_render_steps`, so deeply nested trees
+    do not reach the recursion limit. Nodes only implementing the classic methods are called as usual.
+    """
+    __slots__ = ('__dict__', '__weakref__', '_render_cache_state')
+    __format_string = ''
 
-        for stringify_fun_name in ['inline_str', 'self_inline_str']:
-            if stringify_fun_name in dct:
-                wrapped_fun = dct[stringify_fun_name]
-                dct[stringify_fun_name] = make_wrapper(wrapped_fun)
+    render_cache_enabled = False
+    """When True, the output of the rendering methods of the node is cached for each indentation, until
+    the node or one of the nodes it printed is modified. See :func:`invalidate_render_cache`."""
 
-        return super().__new__(meta, name, bases, dct)
+    inline_str_filter = InlineStrFilterAttribute()
+    """Function called with the string printed by :meth:`inline_str` and returning the string to use instead.
+    It can be defined as a method in a class, or assigned to an instance."""
 
-class NodeABC(metaclass=NodeMeta):
-    """This class is an Abstract Base Class describing the most basic API evey node should conform to."""
-    __format_string = ''
+    # Attributes only meaningful in the current process, which are not pickled. The methods installed
+    # by an instance inline_str_filter are bound to the instance, and are installed again when unpickled.
+    _unpickled_attribute_set = frozenset(('_render_cache_state', '_source_map_serial', '_view_cache')+InlineStrFilterAttribute.instance_method_name_list)
+
+    def __getstate__(self):
+        state = dict()
+        for name, member in self._slot_member_dict.items():
+            try:
+                state[name] = member.__get__(self)
+            except AttributeError:
+                pass
+        state.update(self.__dict__)
+        if not self._unpickled_attribute_set.isdisjoint(state):
+            state = {
+                key: value for key, value in state.items()
+                if key not in self._unpickled_attribute_set
+            }
+        return state
+
+    def __setstate__(self, state):
+        slot_member_dict = self._slot_member_dict
+        for name, value in state.items():
+            member = slot_member_dict.get(name)
+            if member is None:
+                self.__dict__[name] = value
+            else:
+                member.__set__(self, value)
+        if InlineStrFilterAttribute.storage_name in state:
+            InlineStrFilterAttribute.install(self)
+
+    def _copy_attributes(self, other):
+        """Copy the attributes of *other* to this node, except the ones specific to *other*, such as its render cache."""
+        self.__setstate__(other.__getstate__())
 
     @abc.abstractmethod
     def inline_str(self, idt=None):
@@ -254,6 +1755,22 @@ class NodeABC(metaclass=NodeMeta):
         """
         pass
 
+    def write_inline(self, emitter, idt=None):
+        """This function is the streaming counterpart of *inline_str*: it writes the content of the
+        node to the :class:`Emitter` *emitter* instead of returning a string.
+
+        :class:`NodeMeta` builds it from *inline_str* when a class only defines the latter.
+        """
+        emitter.write(self.inline_str(idt))
+
+    def write_freestanding(self, emitter, idt=None):
+        """This function is the streaming counterpart of *freestanding_str*: it writes the content of the
+        node to the :class:`Emitter` *emitter* instead of returning a string.
+
+        :class:`NodeMeta` builds it from *freestanding_str* when a class only defines the latter.
+        """
+        emitter.write(self.freestanding_str(idt))
+
     @abc.abstractmethod
     def adopt_node(self, child):
         pass
@@ -278,6 +1795,12 @@ class NodeAttrProxy(NodeABC):
     def freestanding_str(self, idt=None):
         return getattr(self.obj, self.attr_name).freestanding_str(idt)
 
+    def write_inline(self, emitter, idt=None):
+        getattr(self.obj, self.attr_name).write_inline(emitter, idt)
+
+    def write_freestanding(self, emitter, idt=None):
+        getattr(self.obj, self.attr_name).write_freestanding(emitter, idt)
+
     def adopt_node(self, child):
         return getattr(self.obj, self.attr_name).adopt_node(child)
 
@@ -295,7 +1818,8 @@ class EnsureNode:
     """
     def __init__(self, storage_attr_name, node_factory, node_classinfo=()):
         """
-        :param storage_attr_name: the underlying attribute used to store the object.
+        :param storage_attr_name: the underlying attribute used to store the object. It can be a slot
+                                  declared in the class using the descriptor or in one of its bases.
         :param node_factory: the factory called when someone tries to store a non :class:`NodeABC` inside the attribute.
         :param node_classinfo: this is a tuple that containes classes.
                                The value stored in the attribute is checked against this tuple using :func:`isinstance` to
@@ -311,8 +1835,22 @@ class EnsureNode:
 
         self.node_classinfo = node_classinfo
 
+    # Member descriptor of the slot used to store the object, if the storage attribute is a slot
+    _slot = None
+
+    def __set_name__(self, owner, name):
+        # When the storage attribute is a slot of the class, the object is stored in the slot
+        # instead of the __dict__ of the instance
+        for klass in owner.__mro__:
+            member = klass.__dict__.get(self.storage_attr_name)
+            if isinstance(member, types.MemberDescriptorType):
+                self._slot = member
+                break
+
     def __get__(self, instance, owner):
         if instance is not None:
+            if self._slot is not None:
+                return self._slot.__get__(instance, owner)
             return instance.__dict__[self.storage_attr_name]
         # If the descriptor is called as a class attribute, it
         # just returns itself, to allow the world to see that it
@@ -323,13 +1861,57 @@ class EnsureNode:
     def __set__(self, instance, value):
         if not isinstance(value, self.node_classinfo):
             value = self.node_factory(value)
-        instance.__dict__[self.storage_attr_name] = value
+        if self._slot is not None:
+            self._slot.__set__(instance, value)
+        else:
+            instance.__dict__[self.storage_attr_name] = value
+        invalidate_render_cache(instance)
+
+class RenderedAttribute:
+    """This class is a descriptor for the attributes that are not nodes but change the source code printed
+    by the node, such as its options.
+
+    Like :class:`EnsureNode`, it invalidates the render cache of the node when the attribute is set,
+    so the nodes with a render cache that printed it are printed again.
+    """
+    def __init__(self, storage_attr_name):
+        """
+        :param storage_attr_name: the underlying attribute used to store the value. It can be a slot
+                                  declared in the class using the descriptor or in one of its bases.
+        """
+        self.storage_attr_name = storage_attr_name
+
+    # Member descriptor of the slot used to store the value, if the storage attribute is a slot
+    _slot = None
+
+    __set_name__ = EnsureNode.__set_name__
+
+    def __get__(self, instance, owner):
+        if instance is not None:
+            if self._slot is not None:
+                return self._slot.__get__(instance, owner)
+            try:
+                return instance.__dict__[self.storage_attr_name]
+            except KeyError:
+                raise AttributeError(self.storage_attr_name) from None
+        else:
+            return self
+
+    def __set__(self, instance, value):
+        if self._slot is not None:
+            self._slot.__set__(instance, value)
+        else:
+            instance.__dict__[self.storage_attr_name] = value
+        invalidate_render_cache(instance)
 
 class NodeBase(NodeABC):
     """This class is the base classes of most nodes.
 
     It provides some default implementations for methods of :class:`NodeABC`.
     """
+    # The parent is only set by the views, but it is declared here because a class can be
+    # both a view and a token list
+    __slots__ = ('comment', 'side_comment', 'parent')
     @classmethod
     def ensure_node(cls, obj, factory=None):
         """Ensure that the given object *obj* is an instance of the class this method is called from or of :class:`NodeABC`
@@ -384,18 +1966,31 @@ class NodeBase(NodeABC):
                 raise NotImplementedError("The given parent does not support child adoption")
 
 
-    def freestanding_str(self, idt=None):
+    def iter_write_freestanding(self, emitter, idt=None):
         """See :class:`NodeABC` for the role of this function.
 
-        This implementation just calls *inline_str* and prepends a new line and indentation string.
+        This implementation just calls *write_inline* and prepends a new line and indentation string.
         """
         idt = Indentation.ensure_idt(idt)
-        snippet = self.inline_str(idt)
-        # Do not output anything if the string is empty
-        if snippet:
-            return '\n'+str(idt)+snippet
+        # Do not output anything if the node writes nothing
+        with emitter.lazy_prefix('\n'+str(idt)):
+            yield WriteCall.inline(self, emitter, idt)
+
+    def _printed_node(self):
+        """Return the node printed by :meth:`__str__` and :meth:`write`, or None if there is none."""
+        # We dont use try: ... except: to avoid catching exceptions
+        # occuring inside decl or defi call
+
+        # Try to display a declaration
+        if hasattr(self, 'decl'):
+            node = self.decl()
+        # Or a definition
+        elif hasattr(self, 'defi'):
+            node = self.defi()
         else:
-            return ''
+            return self
+
+        return node if isinstance(node, NodeABC) else None
 
     def __str__(self, idt=None):
         """This implementation tries to print the node by probing the object for some methods:
@@ -404,26 +1999,27 @@ class NodeBase(NodeABC):
         2. *defi()*: it is usually used to return a :class:`NodeViewBase` corresponding to the definition of the node
         3. *freestanding_str()*: see :class:`NodeABC`
         """
-        # We dont use try: ... except: to avoid catching exceptions
-        # occuring inside freestanding_str call
+        node = self._printed_node()
+        if node is not None:
+            return node.freestanding_str(idt)
 
-        # Try to display a declaration
-        if hasattr(self, 'decl'):
-            self_decl = self.decl()
-            if isinstance(self_decl, NodeABC):
-                return self_decl.freestanding_str(idt)
-        # Or a definition
-        elif hasattr(self, 'defi'):
-            self_defi = self.defi()
-            if isinstance(self_defi, NodeABC):
-                return self_defi.freestanding_str(idt)
+    def write(self, stream, idt=None, binary=None, encoding='utf-8', source_map=None):
+        """Write the source code printed by :meth:`__str__` to the file object *stream*.
 
-        else:
-            return self.freestanding_str(idt)
+        The source code is written while the tree is walked, so the memory usage only
+        depends on the depth of the tree and not on the size of the output. See :func:`render_to`.
+        """
+        node = self._printed_node()
+        if node is not None:
+            render_to(stream, node, idt, binary=binary, encoding=encoding, source_map=source_map)
 
     def adopt_node(self, child):
         self.append(child)
 
+    def invalidate_render_cache(self):
+        """See :func:`invalidate_render_cache`."""
+        invalidate_render_cache(self)
+
 
 class DelegatedAttribute:
     """This class is a descriptor that allows an object to use the value of that attribute of another instance.
@@ -453,7 +2049,7 @@ class DelegatedAttribute:
     def __get__(self, instance, owner):
         if instance is not None:
             # If the attribute has been set on the instance, just get it
-            if instance.__dict__.get('__'+self.attr_name+'_is_set', False):
+            if getattr(instance, '__'+self.attr_name+'_is_set', False):
                 if self.descriptor is not None:
                     return self.descriptor.__get__(instance, owner)
                 else:
@@ -483,6 +2079,8 @@ class DelegatedAttribute:
         if value not in self.default_value_list:
             instance.__dict__['__'+self.attr_name+'_is_set'] = True
 
+        invalidate_render_cache(instance)
+
 
 class NodeViewBase(NodeBase):
     """This is the base class of the node that are view of other node.
@@ -502,6 +2100,43 @@ class NodeViewBase(NodeBase):
         """
         return type(self) is type(other) and self.parent is other.parent
 
+class _ViewCache:
+    """Views of a node shared by :func:`shared_view`."""
+    __slots__ = ('owner_id', 'view_dict')
+
+    def __init__(self, owner):
+        # The cache is stored in the __dict__ of the node, which can be copied with the node,
+        # so it must be able to tell which node it belongs to
+        self.owner_id = id(owner)
+        # Map the names of the methods to the view they built
+        self.view_dict = dict()
+
+def shared_view(node, view_method_name):
+    """Return the view of *node* built by calling its method *view_method_name* without parameters,
+    such as ``'decl'``. The view is built on the first call and the same instance is returned afterwards.
+
+    This is used by the nodes printing one of their views each time they are printed, to avoid building
+    new views over and over. The views only read their parent when they are printed, so they stay up to
+    date when the node is modified. As the view is shared, it must not be modified: the methods like
+    *decl()* and *defi()* still build a new view, so that the caller can set its comment for example.
+
+    A new view is built on each call when the *_view_cache_enabled* attribute of the node is False,
+    for example when each view must record where it was requested.
+    """
+    if not getattr(node, '_view_cache_enabled', True):
+        return getattr(node, view_method_name)()
+    instance_dict = node.__dict__
+    view_cache = instance_dict.get('_view_cache')
+    if view_cache is None or view_cache.owner_id != id(node):
+        view_cache = _ViewCache(node)
+        instance_dict['_view_cache'] = view_cache
+    view_dict = view_cache.view_dict
+    try:
+        return view_dict[view_method_name]
+    except KeyError:
+        view = getattr(node, view_method_name)()
+        view_dict[view_method_name] = view
+        return view
 
 
 class PhantomNode(NodeBase):
@@ -521,10 +2156,33 @@ class PhantomNode(NodeBase):
 
     freestanding_str = inline_str
 
+    def __reduce__(self):
+        # Unpickle as the shared instance
+        return 'PHANTOM_NODE'
+
 # Instance used everywhere, instead of creating billions of identical PhantomNode
 PHANTOM_NODE = PhantomNode()
 
 
+class _NodeFactoryWrapper:
+    """Callable wrapping a node factory to make sure that it returns a :class:`NodeABC`.
+    Unlike a closure, it can be pickled.
+    """
+    __slots__ = ('factory',)
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, node):
+        result = self.factory(node)
+        if not isinstance(result, NodeABC):
+            raise ValueError("The node factory did not give a NodeABC")
+        else:
+            return result
+
+    def __reduce__(self):
+        return (_NodeFactoryWrapper, (self.factory,))
+
 class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
     """This is the base class of all the nodes that contains a list of other nodes.
 
@@ -539,6 +2197,8 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
     overloaded operators like *+=* are used. See the *node_classinfo* and *node_factory* constructor arguments.
     """
 
+    __slots__ = ('node_list', 'node_classinfo', 'node_factory')
+
     default_node_classinfo = (NodeABC,)
 
     def __init__(self, node_list=None, node_classinfo=None, node_factory=None, *args, **kwargs):
@@ -577,16 +2237,7 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
 
         # A wrapper to make sure that the output of the node_factory is
         # indeed a NodeABC
-        def make_node_factory_wrapper(factory):
-            def wrapper(node):
-                result = factory(node)
-                if not isinstance(result, NodeABC):
-                    raise ValueError("The node factory did not give a NodeABC")
-                else:
-                    return result
-            return wrapper
-
-        self.node_factory = make_node_factory_wrapper(node_factory)
+        self.node_factory = _NodeFactoryWrapper(node_factory)
 
         self.node_list = [
             item if isinstance(item, self.node_classinfo) else self.node_factory(item)
@@ -594,30 +2245,30 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
         ]
         super().__init__(*args, **kwargs)
 
-    def inline_str(self, idt=None):
-        """Print all the contained nodes using their *freestanding_str* method,
+    def iter_write_inline(self, emitter, idt=None):
+        """Print all the contained nodes using their *write_freestanding* method,
         because a container is a freestanding context.
         It also strips the blank lines at the beginning.
         """
-        snippet = ""
-        for node in self.node_list:
-            if hasattr(node, 'comment'):
-                snippet += node.comment.freestanding_str(idt)
-            snippet += node.freestanding_str(idt)
-
-        return strip_starting_blank_lines(snippet)
-
-    def freestanding_str(self, idt=None):
-        """Calls super().freestanding_str, and strip the blank lines
+        with emitter.strip_starting_blank_lines():
+            for node in self.node_list:
+                # The placeholder used when there is no comment prints nothing
+                comment = getattr(node, 'comment', PHANTOM_NODE)
+                if comment is not PHANTOM_NODE:
+                    yield WriteCall.freestanding(comment, emitter, idt)
+                yield WriteCall.freestanding(node, emitter, idt)
+
+    def iter_write_freestanding(self, emitter, idt=None):
+        """Calls super().write_freestanding, and strip the blank lines
         at the beginning.
         """
-        snippet = super().freestanding_str(idt)
-        return strip_starting_blank_lines(snippet)
+        with emitter.strip_starting_blank_lines():
+            yield from super().iter_write_freestanding(emitter, idt)
 
     def __copy__(self):
         cls = type(self)
         new_obj = cls.__new__(cls)
-        new_obj.__dict__.update(self.__dict__)
+        new_obj._copy_attributes(self)
         new_obj.node_list = copy.copy(self.node_list)
         new_obj.node_classinfo = copy.copy(self.node_classinfo)
         new_obj.node_factory = copy.copy(self.node_factory)
@@ -633,6 +2284,7 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
             if not isinstance(elem, self.node_classinfo):
                 elem = self.node_factory(elem)
             self.node_list.insert(index+i, elem)
+        invalidate_render_cache(self)
 
 
     def index(self, *args, **kwargs):
@@ -642,13 +2294,16 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
         return self.node_list.count(*args, **kwargs)
 
     def pop(self, *args, **kwargs):
+        invalidate_render_cache(self)
         return self.node_list.pop(*args, **kwargs)
 
     def reverse(self):
         self.node_list.reverse()
+        invalidate_render_cache(self)
 
     def remove(self, *args, **kwargs):
         self.node_list.remove(*args, **kwargs)
+        invalidate_render_cache(self)
 
     @abc.abstractmethod
     def __add__(self, other):
@@ -665,6 +2320,7 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
             for item in other_list
         ]
         self.node_list.extend(typed_other_list)
+        invalidate_render_cache(self)
         return self
 
     def append(self, other):
@@ -675,6 +2331,39 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
         for other in other_list:
             self.append(other)
 
+    def _fast_node_factory(self):
+        """Return the factory used by :meth:`extend_nodes` to build a node from an item.
+
+        When the factory given to the container is a node class, it is called directly,
+        without checking that it returned a node.
+        """
+        factory = self.node_factory.factory
+        if isinstance(factory, type) and issubclass(factory, NodeABC):
+            return factory
+        return self.node_factory
+
+    def extend_nodes(self, node_iterable):
+        """Append the items of *node_iterable* to the container, faster than :meth:`extend`.
+
+        Each item gives exactly one node: the items that are instances of the classes of *node_classinfo*
+        are stored as is, and the other ones, such as plain strings, are given to the node factory. Unlike
+        :meth:`extend`, the iterables among the items are not flattened. The classes of the items are only
+        checked once, and the render cache is only invalidated once.
+        """
+        node_classinfo = self.node_classinfo
+        node_factory = self._fast_node_factory()
+        # Map the classes of the items to True if they are stored as is
+        is_node_dict = dict()
+        node_list = list()
+        for item in node_iterable:
+            cls = item.__class__
+            is_node = is_node_dict.get(cls)
+            if is_node is None:
+                is_node = is_node_dict[cls] = isinstance(item, node_classinfo)
+            node_list.append(item if is_node else node_factory(item))
+        self.node_list.extend(node_list)
+        invalidate_render_cache(self)
+
     def __mul__(self, other):
         if isinstance(other, numbers.Integral):
             self_copy = copy.copy(self)
@@ -689,6 +2378,7 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
     def __imul__(self, other):
         if isinstance(other, numbers.Integral):
             self.node_list *= other
+            invalidate_render_cache(self)
             return self
         else:
             return NotImplemented
@@ -699,7 +2389,11 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
     def __reversed__(self):
         return reversed(self.node_list)
 
+    # The content of the container can be printed by another node without printing
+    # the container itself, so reading it is enough to depend on it
     def __getitem__(self, key):
+        if _render_cache_stack:
+            _record_render_dependency(self)
         return self.node_list[key]
 
     def __setitem__(self, key, value):
@@ -707,14 +2401,20 @@ class NodeContainerBase(NodeBase, collections.MutableSequence, NonIterable):
             value = self.node_factory(value)
 
         self.node_list[key] = value
+        invalidate_render_cache(self)
 
     def __delitem__(self, key):
         del self.node_list[key]
+        invalidate_render_cache(self)
 
     def __len__(self):
+        if _render_cache_stack:
+            _record_render_dependency(self)
         return len(self.node_list)
 
     def __iter__(self):
+        if _render_cache_stack:
+            _record_render_dependency(self)
         return iter(self.node_list)
 
 
@@ -736,6 +2436,8 @@ class DelegatedTokenListBase(TokenListABC):
 
     This class implements stubs to allow transparent object composition.
     """
+    __slots__ = ('tokenlist_attr_name',)
+
     @property
     def tokenlist_attr(self):
         """This property gives the attribute holding the real token list."""
@@ -748,7 +2450,8 @@ class DelegatedTokenListBase(TokenListABC):
 
     @tokenlist_attr.setter
     def tokenlist_attr(self, value):
-        return setattr(self, self.tokenlist_attr_name, value)
+        setattr(self, self.tokenlist_attr_name, value)
+        invalidate_render_cache(self)
 
     def __init__(self, tokenlist_attr_name, *args, **kwargs):
         """
@@ -764,10 +2467,17 @@ class DelegatedTokenListBase(TokenListABC):
     def freestanding_str(self, idt=None):
         return self.tokenlist_attr.freestanding_str(idt)
 
+    def write_inline(self, emitter, idt=None):
+        self.tokenlist_attr.write_inline(emitter, idt)
+
+    def write_freestanding(self, emitter, idt=None):
+        self.tokenlist_attr.write_freestanding(emitter, idt)
+
     def index(self, *args, **kwargs):
         return self.tokenlist_attr.index(*args, **kwargs)
 
     def insert(self, *args, **kwargs):
+        invalidate_render_cache(self)
         return self.tokenlist_attr.insert(*args, **kwargs)
 
     def index(self, *args, **kwargs):
@@ -777,13 +2487,16 @@ class DelegatedTokenListBase(TokenListABC):
         return self.tokenlist_attr.count(*args, **kwargs)
 
     def pop(self, *args, **kwargs):
+        invalidate_render_cache(self)
         return self.tokenlist_attr.pop(*args, **kwargs)
 
     def reverse(self):
         self.tokenlist_attr.reverse()
+        invalidate_render_cache(self)
 
     def remove(self, *args, **kwargs):
         self.tokenlist_attr.remove(*args, **kwargs)
+        invalidate_render_cache(self)
 
     def __add__(self, other):
         self_copy = copy.copy(self)
@@ -797,13 +2510,16 @@ class DelegatedTokenListBase(TokenListABC):
 
     def append(self, other):
         self.tokenlist_attr.append(other)
+        invalidate_render_cache(self)
 
     def __iadd__(self, *args, **kwargs):
         self.tokenlist_attr.__iadd__(*args, **kwargs)
+        invalidate_render_cache(self)
         return self
 
     def extend(self, other_list):
         self.tokenlist_attr.extend(other_list)
+        invalidate_render_cache(self)
 
     def __mul__(self, other):
         self_copy = copy.copy(self)
@@ -819,6 +2535,7 @@ class DelegatedTokenListBase(TokenListABC):
 
     def __imul__(self, other):
         self.tokenlist_attr.__imul__(other)
+        invalidate_render_cache(self)
         return self
 
     def __contains__(self, *args, **kwargs):
@@ -835,17 +2552,178 @@ class DelegatedTokenListBase(TokenListABC):
 
     def __setitem__(self, key, value):
         self.tokenlist_attr.__setitem__(key, value)
+        invalidate_render_cache(self)
 
     def __delitem__(self, key):
         self.tokenlist_attr.__delitem__(key)
+        invalidate_render_cache(self)
 
     def __len__(self):
         return self.tokenlist_attr.__len__()
 
 
+class _TokenListSnapshot:
+    """The first tokens of a list, that are only ever appended to, shared without copying them."""
+    __slots__ = ('_token_list', '_len')
+
+    def __init__(self, token_list):
+        self._token_list = token_list
+        self._len = len(token_list)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.islice(self._token_list, self._len)
+
+class _TokenRope:
+    """Concatenation of sequences of tokens, used by :class:`TokenListBase` to concatenate token lists
+    in O(1) instead of copying their tokens.
+
+    The concatenated sequences are shared, and only gathered in a tuple when the tokens are read,
+    without recursion so that long chains of concatenations can be flattened. The tokens appended
+    afterwards are stored in a separate tail list, and the other modifications are done on a list
+    with all the tokens. These lists are shared by all the token lists holding the rope, like they
+    would share a list after a shallow copy, while the ropes built on top of it keep the tokens
+    they were built with. The ropes only take a snapshot of the first items of these lists, which
+    are copied before being modified in another way than by appending tokens.
+    """
+    __slots__ = ('_left', '_right', '_len', '_flat', '_tail', '_list', '_shared_len')
+
+    def __init__(self, left, right):
+        self._left = left
+        self._right = right
+        self._len = len(left)+len(right)
+        self._flat = None
+        # Tokens appended to the tokens the rope was built with
+        self._tail = None
+        # All the tokens, once they have been modified in another way or read after an append
+        self._list = None
+        # Number of items of the tail or of the list that are shared with the snapshots
+        self._shared_len = 0
+
+    @staticmethod
+    def freeze(token_list):
+        """Return a sequence with the content of *token_list*, a list or a :class:`_TokenRope`,
+        that will not be modified, sharing it when possible.
+        """
+        if token_list.__class__ is not _TokenRope:
+            return tuple(token_list)
+        rope = token_list
+        if rope._list is not None:
+            rope._shared_len = len(rope._list)
+            return _TokenListSnapshot(rope._list)
+        if rope._tail is not None:
+            rope._shared_len = len(rope._tail)
+            return _TokenRope(rope, _TokenListSnapshot(rope._tail))
+        return rope
+
+    def flatten(self):
+        """Return the tuple of the tokens of the rope, as it was built."""
+        if self._flat is None:
+            token_list = list()
+            part_stack = [self]
+            while part_stack:
+                part = part_stack.pop()
+                if part.__class__ is not _TokenRope:
+                    token_list.extend(part)
+                elif part._flat is not None:
+                    token_list.extend(part._flat)
+                else:
+                    part_stack.append(part._right)
+                    part_stack.append(part._left)
+            self._flat = tuple(token_list)
+            # The parts are not needed anymore, they can be freed
+            self._left = None
+            self._right = None
+        return self._flat
+
+    def _merge(self):
+        if self._list is None:
+            token_list = list(self.flatten())
+            if self._tail is not None:
+                token_list.extend(self._tail)
+                # The snapshots of the tail keep using it, and it will not be modified anymore
+                self._tail = None
+            self._list = token_list
+            self._shared_len = 0
+        return self._list
+
+    def extend(self, token_list):
+        """Append the tokens of *token_list*, without flattening the rope."""
+        if self._list is not None:
+            self._list.extend(token_list)
+        elif self._tail is not None:
+            self._tail.extend(token_list)
+        else:
+            self._tail = list(token_list)
+
+    def get_list(self):
+        """Return the list shared by the token lists holding the rope, to modify the tokens.
+
+        It must not be kept, since it is replaced by a copy when a snapshot of it is taken.
+        """
+        token_list = self._merge()
+        if self._shared_len:
+            token_list = self._list = list(token_list)
+            self._shared_len = 0
+        return token_list
+
+    def tokens(self):
+        """Return the current tokens, as a sequence that must not be modified."""
+        if self._list is not None:
+            return self._list
+        if self._tail is not None:
+            return self._merge()
+        return self.flatten()
+
+    def __len__(self):
+        if self._list is not None:
+            return len(self._list)
+        if self._tail is not None:
+            return self._len+len(self._tail)
+        return self._len
+
+    def __iter__(self):
+        return iter(self.tokens())
+
+    def __reversed__(self):
+        return reversed(self.tokens())
+
+    def __getitem__(self, key):
+        # Slices are lists whatever the way the tokens are stored
+        if key.__class__ is slice:
+            return list(self.tokens()[key])
+        return self.tokens()[key]
+
+    def __contains__(self, token):
+        return token in self.tokens()
+
+    def index(self, *args, **kwargs):
+        return self.tokens().index(*args, **kwargs)
+
+    def count(self, token):
+        return self.tokens().count(token)
+
+    def __reduce__(self):
+        # The parts are not pickled, since they can form chains too deep for the pickle module
+        return (_restore_token_rope, (self.flatten(), self._list, self._tail))
+
+def _restore_token_rope(flat, token_list, tail=None):
+    rope = _TokenRope(flat, ())
+    rope._flat = flat
+    rope._list = token_list
+    rope._tail = tail
+    return rope
+
 class TokenListBase(TokenListABC):
     """This base class implements the :class:`TokenListABC` API with all of the operators overloading logic.
+
+    The tokens are stored in a list, or in a :class:`_TokenRope` after a concatenation, so building
+    an expression by adding tokens one by one does not copy all the previous tokens each time.
     """
+    __slots__ = ('_token_list',)
+
     def __init__(self, token_list=None, *args, **kwargs):
         """
         :param token_list: the list of tokens to store inside the token list
@@ -853,32 +2731,80 @@ class TokenListBase(TokenListABC):
         self._token_list = listify(token_list)
         super().__init__(*args, **kwargs)
 
-    def inline_str(self, idt=None):
+    def _mutable_token_list(self):
+        """Return the list of tokens, to modify it."""
+        token_list = self._token_list
+        if token_list.__class__ is _TokenRope:
+            return token_list.get_list()
+        return token_list
+
+    def write_inline(self, emitter, idt=None):
         """Print the tokens of the token list usin, and concatenate all the strings.
 
-        If the token is a :class:`NodeABC`, its *inline_str* method is used.
+        If the token is a :class:`NodeABC`, its *write_inline* method is used.
         otherwise, :func:`str` builtin is called on the token.
-        """
-        string = ''
-        for token in self._token_list:
-            if token is self:
-                # Special handling of self: allows to print itself using
-                # a different method to avoid infinite recursion and to provide
-                # a mean to subclasses to implement self printing without creating a
-                # "self-printer" class dedicated to printing themselves
-                string += self.self_inline_str(idt)
-            elif isinstance(token, NodeABC):
-                string += token.inline_str(idt)
-            else:
-                string += str(token)
 
-        return string
+        The nested token lists that would be printed by this method are walked with an explicit stack
+        instead of recursive calls, so expressions nested thousands of times, such as the ones built by
+        chaining operators, do not reach the recursion limit.
+        """
+        # Stack of the (node, token iterator, idt, indentation layer) of the enclosing token lists
+        stack = list()
+        node = self
+        token_iter = iter(self._token_list)
+        layer = None
+        try:
+            while True:
+                for token in token_iter:
+                    if token.__class__ is str:
+                        emitter.write(token)
+                    elif token is node:
+                        # Special handling of self: allows to print itself using
+                        # a different method to avoid infinite recursion and to provide
+                        # a mean to subclasses to implement self printing without creating a
+                        # "self-printer" class dedicated to printing themselves
+                        emitter.write(node.self_inline_str(idt))
+                    elif isinstance(token, NodeABC):
+                        indented = _nested_token_list_kind(token)
+                        if indented is None:
+                            token.write_inline(emitter, idt)
+                            continue
+
+                        # Do what the write_inline() method of the token would do
+                        if _render_cache_stack:
+                            _record_render_dependency(token)
+                        stack.append((node, token_iter, idt, layer))
+                        node = token
+                        token_iter = iter(token._token_list)
+                        if indented:
+                            idt = Indentation.ensure_idt(idt)
+                            layer = emitter.indent(idt)
+                            layer.__enter__()
+                        else:
+                            layer = None
+                        break
+                    else:
+                        emitter.write(str(token))
+                else:
+                    # All the tokens of the current token list have been printed
+                    if layer is not None:
+                        layer.__exit__(None, None, None)
+                    if not stack:
+                        return
+                    node, token_iter, idt, layer = stack.pop()
+        except BaseException:
+            # Leave the indentation layers that are still entered, from the innermost one
+            for layer in [layer]+[item[3] for item in reversed(stack)]:
+                if layer is not None:
+                    layer.__exit__(None, None, None)
+            raise
 
     def index(self, *args, **kwargs):
         return self._token_list.index(*args, **kwargs)
 
     def insert(self, *args, **kwargs):
-        return self._token_list.insert(*args, **kwargs)
+        invalidate_render_cache(self)
+        return self._mutable_token_list().insert(*args, **kwargs)
 
     def index(self, *args, **kwargs):
         return self._token_list.index(*args, **kwargs)
@@ -887,33 +2813,37 @@ class TokenListBase(TokenListABC):
         return self._token_list.count(*args, **kwargs)
 
     def pop(self, *args, **kwargs):
-        return self._token_list.pop(*args, **kwargs)
+        invalidate_render_cache(self)
+        return self._mutable_token_list().pop(*args, **kwargs)
 
     def reverse(self):
-        self._token_list.reverse()
+        self._mutable_token_list().reverse()
+        invalidate_render_cache(self)
 
     def remove(self, *args, **kwargs):
-        self._token_list.remove(*args, **kwargs)
+        self._mutable_token_list().remove(*args, **kwargs)
+        invalidate_render_cache(self)
 
     def __add__(self, other):
-        if isinstance(other, TokenListABC):
-            other_list = list(other)
-            self_copy = copy.copy(self)
-            self_copy._token_list = self._token_list+other_list
-            return self_copy
+        if isinstance(other, TokenListBase):
+            if _render_cache_stack:
+                _record_render_dependency(other)
+            other_list = _TokenRope.freeze(other._token_list)
+        elif isinstance(other, TokenListABC):
+            other_list = tuple(other)
         # The result of the addition with a NodeContainer is a NodeContainer
         elif isinstance(other, NodeContainerBase):
             return other.__radd__(self)
         else:
-            other_list = listify(other)
-            self_copy = copy.copy(self)
-            self_copy._token_list = self._token_list+other_list
-            return self_copy
+            other_list = tuple(listify(other))
+        self_copy = copy.copy(self)
+        self_copy._token_list = _TokenRope(_TokenRope.freeze(self._token_list), other_list)
+        return self_copy
 
     def __radd__(self, other):
-        other_list = listify(other)
+        other_list = tuple(listify(other))
         self_copy = copy.copy(self)
-        self_copy._token_list = other_list+self._token_list
+        self_copy._token_list = _TokenRope(other_list, _TokenRope.freeze(self._token_list))
         return self_copy
 
     def append(self, other):
@@ -922,7 +2852,9 @@ class TokenListBase(TokenListABC):
         else:
             other_list = listify(other)
 
+        # The rope is not flattened, so adding and appending tokens in turn stays linear
         self._token_list.extend(other_list)
+        invalidate_render_cache(self)
         return self
 
     def __iadd__(self, *args, **kwargs):
@@ -937,7 +2869,7 @@ class TokenListBase(TokenListABC):
     def __mul__(self, other):
         if isinstance(other, numbers.Integral):
             self_copy = copy.copy(self)
-            self_copy._token_list = self._token_list * other
+            self_copy._token_list = list(self._token_list) * other
             return self_copy
         else:
             return NotImplemented
@@ -947,7 +2879,9 @@ class TokenListBase(TokenListABC):
 
     def __imul__(self, other):
         if isinstance(other, numbers.Integral):
-            self._token_list *= other
+            token_list = self._mutable_token_list()
+            token_list *= other
+            invalidate_render_cache(self)
             return self
         else:
             return NotImplemented
@@ -955,34 +2889,83 @@ class TokenListBase(TokenListABC):
     def __contains__(self, *args, **kwargs):
         return self._token_list.__contains__(*args, **kwargs)
 
+    # The tokens can be printed by another node without printing the token list
+    # itself, so reading them is enough to depend on it
     def __iter__(self):
+        if _render_cache_stack:
+            _record_render_dependency(self)
         return iter(self._token_list)
 
     def __reversed__(self):
         return reversed(self._token_list)
 
     def __getitem__(self, key):
+        if _render_cache_stack:
+            _record_render_dependency(self)
         return self._token_list[key]
 
     def __setitem__(self, key, value):
-        self._token_list[key] = value
+        self._mutable_token_list()[key] = value
+        invalidate_render_cache(self)
 
     def __delitem__(self, key):
-        del self._token_list[key]
+        del self._mutable_token_list()[key]
+        invalidate_render_cache(self)
 
     def __len__(self):
         return len(self._token_list)
 
 
+# Map of the token list classes to a tuple (write_inline, kind), see _nested_token_list_kind()
+_nested_token_list_kind_dict = dict()
+
+def _nested_token_list_kind(token):
+    """Tell how the :meth:`TokenListBase.write_inline` method can print the node *token* without calling it.
+
+    Return False if *token* is a token list that prints its tokens with this method, True if it
+    prints them the same way inside an indentation layer, and None if the *write_inline* method
+    of *token* must be called, for example when it uses the render cache or an inline_str_filter.
+    """
+    cls = type(token)
+    write_fun = cls.write_inline
+    try:
+        cached_write_fun, kind = _nested_token_list_kind_dict[cls]
+    except KeyError:
+        cached_write_fun = None
+    # The methods of the classes can be replaced, for example by RenderProfiler
+    if cached_write_fun is not write_fun:
+        kind = None
+        if isinstance(token, TokenListBase):
+            wrapped_fun = getattr(write_fun, '__wrapped__', None)
+            if wrapped_fun is _token_list_write_inline:
+                kind = False
+            elif wrapped_fun is _IndentedTokenListBase.write_inline:
+                # The indented token list must print its tokens with TokenListBase.write_inline()
+                mro = cls.__mro__
+                for klass in mro[mro.index(_IndentedTokenListBase)+1:]:
+                    if 'write_inline' in klass.__dict__:
+                        if getattr(klass.__dict__['write_inline'], '__wrapped__', None) is _token_list_write_inline:
+                            kind = True
+                        break
+        _nested_token_list_kind_dict[cls] = (write_fun, kind)
+
+    if kind is None or token.render_cache_enabled:
+        return None
+    # Some instances have their own write_inline() method, to apply their inline_str_filter
+    if getattr(token.write_inline, '__func__', None) is not write_fun:
+        return None
+    return kind
+
 class _IndentedTokenListBase:
     """This class is the base class that implements a token list which indents its content when printed."""
-    def inline_str(self, idt=None):
+    def write_inline(self, emitter, idt=None):
         idt = Indentation.ensure_idt(idt)
 
-        snippet = super().inline_str(idt)
-        indented_new_line = "\n"+str(idt)
-        snippet = snippet.replace("\n", indented_new_line)
-        return snippet
+        with emitter.indent(idt):
+            super().write_inline(emitter, idt)
+
+# Function wrapped by NodeMeta in TokenListBase.write_inline
+_token_list_write_inline = TokenListBase.__dict__['write_inline'].__wrapped__
 
 class IndentedTokenListBase(_IndentedTokenListBase, TokenListBase):
     """This class is a base class for token lists that indent their content when printed."""
@@ -992,6 +2975,9 @@ class IndentedDelegatedTokenListBase(_IndentedTokenListBase, DelegatedTokenListB
     """This is a mix between :class:`DelegatedTokenListBase` and :class:`IndentedTokenListBase`."""
     pass
 
+# Replacement for the code objects of the frames recorded by BacktraceBase when they are pickled
+_CodeLocation = collections.namedtuple('_CodeLocation', ('co_filename', 'co_name'))
+
 class BacktraceBase(TokenListBase, NonIterable, metaclass=abc.ABCMeta):
     """This base class allows the instances to record the backtrace of the Python code that
     created them.
@@ -1001,30 +2987,103 @@ class BacktraceBase(TokenListBase, NonIterable, metaclass=abc.ABCMeta):
     and can avoid headache when ones want to track down which line of Python generated which line of
     generated source code.
     As a convenience, it is a subclass of :class:`TokenListBase` so it can be used inside a comment for example.
+
+    Only the code objects and line numbers of the frames are recorded when the instance is built. File names,
+    source lines and the final string are computed when the backtrace is printed, so building backtraces that
+    are never printed is cheap.
     """
     __frame_format_string = '{filename}:{lineno}({function})'
     __frame_joiner = ', '
 
-    def __init__(self, level=0, *args, **kwargs):
-        stack = inspect.stack()
-        self.stack_frame_list = [
-            frame[1:] for frame in stack
-            if os.path.dirname(frame[1]) != os.path.dirname(__file__)
-        ]
+    max_depth = None
+    """Maximum number of frames recorded, starting from the innermost one. None means no limit."""
+
+    # Cache telling if a file belongs to the library, to skip its frames
+    _library_file_dict = dict()
+
+    # Cache of the _CodeLocation used to pickle the code objects of the frames. The code objects are
+    # kept alive by the backtraces recording them, so the entries of the other ones are dropped
+    _code_location_dict = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def _is_library_file(cls, filename):
+        try:
+            return cls._library_file_dict[filename]
+        except KeyError:
+            is_library_file = os.path.dirname(filename) == os.path.dirname(__file__)
+            cls._library_file_dict[filename] = is_library_file
+            return is_library_file
+
+    def __init__(self, level=0, max_depth=None, *args, **kwargs):
+        """
+        :param max_depth: maximum number of frames recorded. It defaults to the class attribute *max_depth*.
+        """
+        if max_depth is None:
+            max_depth = self.max_depth
+
+        raw_frame_list = []
+        frame = sys._getframe()
+        while frame is not None and (max_depth is None or len(raw_frame_list) < max_depth):
+            code = frame.f_code
+            if not self._is_library_file(code.co_filename):
+                raw_frame_list.append((code, frame.f_lineno))
+            frame = frame.f_back
+        self._raw_frame_list = raw_frame_list
 
         super().__init__(self, *args, **kwargs)
 
+    @property
+    def stack_frame_list(self):
+        """List of the recorded frames, as *(filename, lineno, function, code_context, index)* tuples
+        like the ones given by :func:`inspect.stack`.
+        """
+        frame_list = []
+        for code, lineno in self._raw_frame_list:
+            line = linecache.getline(code.co_filename, lineno)
+            frame_list.append((code.co_filename, lineno, code.co_name, [line] if line else None, 0))
+        return frame_list
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # Code objects cannot be pickled, only keep what is printed
+        state = dict(state)
+        state['_raw_frame_list'] = [
+            (self._get_code_location(code), lineno)
+            for code, lineno in self._raw_frame_list
+        ]
+        return state
+
+    @classmethod
+    def _get_code_location(cls, code):
+        # The frames of a backtrace that was already pickled or copied are already _CodeLocation
+        if isinstance(code, _CodeLocation):
+            return code
+        # The same instance is used for a given code object, so pickle only stores it once
+        try:
+            return cls._code_location_dict[code]
+        except KeyError:
+            code_location = _CodeLocation(code.co_filename, code.co_name)
+            cls._code_location_dict[code] = code_location
+            return code_location
+
+    @property
+    def location_list(self):
+        """List of the recorded frames, as *(filename, lineno, function)* tuples."""
+        return [(code.co_filename, lineno, code.co_name) for code, lineno in self._raw_frame_list]
+
     @abc.abstractmethod
     def freestanding_str(self, idt=None):
         #Construct a comment by giving itself as a token and use its freestanding_str method
         pass
 
     def self_inline_str(self, idt=None):
+        # Only read the source files if the line is printed
+        with_line_content = '{line_content' in self.__frame_format_string
         return self.__frame_joiner.join(
             self.__frame_format_string.format(
-                filename = os.path.relpath(frame[0]),
-                lineno = frame[1],
-                function = frame[2],
-                line_content = frame[3][frame[4]] if frame[3] is not None else ''
-            ) for frame in self.stack_frame_list
+                filename = os.path.relpath(code.co_filename),
+                lineno = lineno,
+                function = code.co_name,
+                line_content = linecache.getline(code.co_filename, lineno) if with_line_content else ''
+            ) for code, lineno in self._raw_frame_list
         )
@@ -0,0 +1,60 @@
+
+# Copyright 2014 Douglas RAILLARD
+#
+# This file is part of BrownBat.
+#
+# BrownBat is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BrownBat is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with BrownBat. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. moduleauthor:: Douglas RAILLARD <douglas.raillard.github@gmail.com>
+
+This module is a command line tool showing which Python code created some lines of a generated file,
+using the source map saved with :meth:`brownbat.core.SourceMap.save`::
+
+    python -m brownbat.sourcemap generated.h.map 42 43
+"""
+
+import argparse
+import sys
+
+import brownbat.core as core
+
+
+def lookup(source_map, line_number_list):
+    """Return the lines of text describing the lines *line_number_list* of the generated file of *source_map*."""
+    output_list = []
+    for line_number in line_number_list:
+        entry_list = source_map.lookup(line_number)
+        if entry_list:
+            description = source_map.format_entry_list(entry_list)
+        else:
+            description = 'no node recorded'
+        output_list.append('{0}:{1}: {2}'.format(source_map.filename, line_number, description))
+    return output_list
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog = 'python -m brownbat.sourcemap',
+        description = 'Show the Python code that created lines of a generated file.'
+    )
+    parser.add_argument('source_map', help='source map saved next to the generated file')
+    parser.add_argument('line', type=int, nargs='+', help='line number in the generated file')
+    args = parser.parse_args(argv)
+
+    source_map = core.load_source_map(args.source_map)
+    for output in lookup(source_map, args.line):
+        print(output)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Tests of the backtraces recorded by the debug comments."""
+
+import gc
+import pickle
+import sys
+import unittest
+
+# If BrownBat is not installed, this enable the tests to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+
+
+class BacktraceTest(unittest.TestCase):
+    def test_pickle(self):
+        def make_backtrace():
+            return C.Backtrace()
+        backtrace = make_backtrace()
+        unpickled = pickle.loads(pickle.dumps(backtrace))
+        self.assertEqual(unpickled.location_list, backtrace.location_list)
+        self.assertEqual(str(unpickled), str(backtrace))
+        # An unpickled backtrace can be pickled again
+        self.assertEqual(pickle.loads(pickle.dumps(unpickled)).location_list, backtrace.location_list)
+
+    def test_code_location_cache(self):
+        namespace = dict()
+        exec('def make_backtrace(C):\n    return C.Backtrace()\n', namespace)
+        code = namespace['make_backtrace'].__code__
+        backtrace = namespace['make_backtrace'](C)
+        pickle.dumps(backtrace)
+        self.assertIn(code, C.Backtrace._code_location_dict)
+
+        # The cache does not keep alive the code objects no longer used
+        code_count = len(C.Backtrace._code_location_dict)
+        del namespace, code, backtrace
+        gc.collect()
+        self.assertEqual(len(C.Backtrace._code_location_dict), code_count-1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Tests of the ordering of the type definitions by :class:`brownbat.C.OrderedTypeContainer`."""
+
+import gc
+import sys
+import unittest
+
+# If BrownBat is not installed, this enable the tests to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+
+
+def make_struct(name, member_list):
+    return C.Struct(name, [C.StructMember(type=type_, name=member_name) for type_, member_name in member_list])
+
+class OrderedTypeContainerTest(unittest.TestCase):
+    def assert_defined_before(self, source, first_name, second_name):
+        self.assertLess(source.index('typedef struct '+first_name+'\n'), source.index('typedef struct '+second_name+'\n'))
+
+    def test_dependency_order(self):
+        container = C.OrderedTypeContainer([
+            make_struct('B', [('struct D', 'x')]),
+            make_struct('D', [('int', 'd')]),
+        ])
+        self.assert_defined_before(str(container), 'D', 'B')
+
+    def test_modified_member_type(self):
+        struct_b = make_struct('B', [('int', 'x')])
+        container = C.OrderedTypeContainer([struct_b, make_struct('D', [('int', 'd')])])
+        str(container)
+        struct_b[0].type = 'struct D'
+        self.assert_defined_before(str(container), 'D', 'B')
+
+    def test_removed_type_replaced(self):
+        container = C.OrderedTypeContainer([
+            make_struct('A', [('int', 'a')]),
+            make_struct('C', [('int', 'c')]),
+        ])
+        str(container)
+        removed_id = id(container[0])
+        del container[0]
+        gc.collect()
+
+        # Try to get a new type with the id of the removed one, which must not be mistaken for it
+        candidate_list = list()
+        for i in range(1000):
+            new_type = make_struct('B', [('struct D', 'x')])
+            if id(new_type) == removed_id:
+                break
+            candidate_list.append(new_type)
+        container.append(new_type)
+        container.append(make_struct('D', [('int', 'd')]))
+
+        source = str(container)
+        self.assertNotIn('struct A', source)
+        self.assert_defined_before(source, 'D', 'B')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Tests of the writing of the generated files by :class:`brownbat.core.OutputSet`."""
+
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+# If BrownBat is not installed, this enable the tests to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+import brownbat.core as core
+
+
+def get_mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+class OutputSetTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'foo.c')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, *stmt_list):
+        output_set = core.OutputSet(self.directory.name)
+        output_set.add(C.SourceFile('foo', node_list=list(stmt_list)))
+        return output_set.write()
+
+    def test_unchanged_file(self):
+        self.assertEqual(self.write('a++').written_path_list, [self.path])
+        self.assertEqual(self.write('a++').unchanged_path_list, [self.path])
+        self.assertEqual(self.write('b++').written_path_list, [self.path])
+        with open(self.path) as stream:
+            self.assertEqual(stream.read(), '\nb++;')
+
+    def test_new_file_mode(self):
+        # Same permissions as a file created with open()
+        reference_path = os.path.join(self.directory.name, 'reference')
+        open(reference_path, 'w').close()
+        self.write('a++')
+        self.assertEqual(get_mode(self.path), get_mode(reference_path))
+
+    def test_umask(self):
+        # The umask set after importing the library applies to the new files
+        old_umask = os.umask(0o027)
+        try:
+            self.write('a++')
+        finally:
+            os.umask(old_umask)
+        self.assertEqual(get_mode(self.path), 0o640)
+
+        # The permissions of the replaced files are kept whatever the umask
+        os.chmod(self.path, 0o664)
+        self.write('b++')
+        self.assertEqual(get_mode(self.path), 0o664)
+
+    def test_replaced_file_mode(self):
+        self.write('a++')
+        os.chmod(self.path, 0o640)
+        self.write('b++')
+        self.assertEqual(get_mode(self.path), 0o640)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Tests of the invalidation of the render cache when the nodes are modified."""
+
+import sys
+import unittest
+
+# If BrownBat is not installed, this enable the tests to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+
+
+def cached_container(node_list):
+    container = C.StmtContainer(node_list)
+    container.render_cache_enabled = True
+    return container
+
+class ViewInvalidationTest(unittest.TestCase):
+    """The views of a node are printed from the attributes of the node, so modifying the node
+    must invalidate the containers that printed its views.
+    """
+    def assert_invalidated(self, container, node, modify_list):
+        for modify in modify_list:
+            before = str(container)
+            modify(node)
+            # The same view must be printed as a container built afterwards would print it
+            self.assertNotEqual(str(container), before)
+            self.assertEqual(str(container), str(C.StmtContainer(list(container))))
+
+    def test_fun_defi(self):
+        fun = C.Fun(name='f', return_type='int', param_list=['int a'], storage_list='static')
+        fun.append('return a')
+        self.assert_invalidated(cached_container([fun.defi()]), fun, [
+            lambda fun: setattr(fun, 'name', 'g'),
+            lambda fun: setattr(fun, 'return_type', 'long'),
+            lambda fun: setattr(fun, 'storage_list', 'inline'),
+            lambda fun: fun.append('a++'),
+            lambda fun: fun.param_list.append('int b'),
+        ])
+
+    def test_fun_decl(self):
+        fun = C.Fun(name='f', return_type='int', param_list=['int a'])
+        self.assert_invalidated(cached_container([fun.decl()]), fun, [
+            lambda fun: setattr(fun, 'name', 'g'),
+            lambda fun: setattr(fun, 'return_type', 'long'),
+        ])
+
+    def test_var_defi(self):
+        var = C.Var(type='int', name='x')
+        self.assert_invalidated(cached_container([var.defi(), var.extern_decl()]), var, [
+            lambda var: setattr(var, 'name', 'y'),
+            lambda var: setattr(var, 'type', 'long'),
+            lambda var: setattr(var, 'initializer', '3'),
+        ])
+
+    def test_struct_forward_decl(self):
+        struct = C.Struct('S', [C.StructMember(type='int', name='m')])
+        self.assert_invalidated(cached_container([struct.forward_decl(), struct]), struct, [
+            lambda struct: setattr(struct, 'name', 'T'),
+            lambda struct: struct.append(C.StructMember(type='int', name='n')),
+        ])
+
+class OptionInvalidationTest(unittest.TestCase):
+    """The options of the nodes which are not nodes themselves must also invalidate the render cache."""
+    def assert_invalidated(self, node, attr_name, value):
+        container = cached_container([node])
+        before = str(container)
+        setattr(node, attr_name, value)
+        self.assertNotEqual(str(container), before)
+        self.assertEqual(str(container), str(C.StmtContainer([node])))
+
+    def test_switch_auto_break(self):
+        switch = C.Switch('x', {'1': 'a++', 'default': 'b++'})
+        self.assert_invalidated(switch, 'auto_break', False)
+
+    def test_switch_case_map(self):
+        switch = C.Switch('x', {'1': 'a++'})
+        self.assert_invalidated(switch, 'case_map', {'2': C.StmtContainer('b++')})
+
+    def test_prep_if_indent_content(self):
+        self.assert_invalidated(C.PrepIf('MACRO', node_list=['a++']), 'indent_content', True)
+
+    def test_prep_include_system(self):
+        self.assert_invalidated(C.PrepInclude('stdio.h'), 'system', True)
+
+    def test_compound_type_auto_typedef(self):
+        struct = C.Struct('S', [C.StructMember(type='int', name='m')])
+        self.assert_invalidated(struct, 'auto_typedef', False)
+
+    def test_com_auto_wrap(self):
+        self.assert_invalidated(C.Com('word '*40), 'auto_wrap', False)
+
+    def test_var_extern_decl_hide_initializer(self):
+        var = C.Var(type='int', name='x', initializer='3')
+        self.assert_invalidated(var.extern_decl(), 'hide_initializer', False)
+
+    def test_fun_call_param_joiner(self):
+        fun = C.Fun(name='f', return_type='int')
+        self.assert_invalidated(fun.call(['a', 'b']), 'param_joiner', ',')
+
+    def test_struct_member_default_initializer(self):
+        member = C.StructMember(type='int', name='m', initializer='1')
+        struct = C.Struct('S', [member])
+        container = cached_container([struct.designated_init()])
+        before = str(container)
+        member.initializer = '2'
+        self.assertNotEqual(str(container), before)
+
+class MappingInvalidationTest(unittest.TestCase):
+    """Setting or deleting the items of the nodes behaving as mappings must invalidate the render cache."""
+    def assert_invalidated(self, node, modify_list):
+        container = cached_container([node])
+        for modify in modify_list:
+            before = str(container)
+            modify(node)
+            self.assertNotEqual(str(container), before)
+            self.assertEqual(str(container), str(C.StmtContainer([node])))
+
+    def test_switch(self):
+        self.assert_invalidated(C.Switch('x', {'1': 'a++'}), [
+            lambda switch: switch.__setitem__('2', 'b++'),
+            lambda switch: switch.__delitem__('1'),
+        ])
+
+    def test_struct_designated_initializer(self):
+        self.assert_invalidated(C.StructDesignatedInitializer({'a': 1}), [
+            lambda initializer: initializer.__setitem__('b', 2),
+            lambda initializer: initializer.__setitem__('c.d', 3),
+            lambda initializer: initializer.__setitem__('c.e', 4),
+            lambda initializer: initializer['c'].__setitem__('f', 5),
+            lambda initializer: initializer.__delitem__('a'),
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
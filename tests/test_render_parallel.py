@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Tests of the rendering of nodes in a pool of processes."""
+
+import concurrent.futures
+import sys
+import unittest
+
+# If BrownBat is not installed, this enable the tests to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+import brownbat.core as core
+
+
+def build_node_list(prefix, node_nb):
+    return [C.StmtContainer([C.Var(type='int', name=prefix+str(i)).defi()]) for i in range(node_nb)]
+
+class RenderParallelTest(unittest.TestCase):
+    def test_output(self):
+        node_list = build_node_list('x', 4)
+        result_list = core.render_parallel(node_list, max_workers=2)
+        self.assertEqual([data for data, source_map in result_list], [str(node).encode('utf-8') for node in node_list])
+        self.assertEqual([source_map for data, source_map in result_list], [None]*4)
+
+        result_list = core.render_parallel(node_list, max_workers=2, with_source_map=True)
+        for data, source_map in result_list:
+            self.assertIsInstance(source_map, core.SourceMap)
+
+    def test_concurrent_calls(self):
+        # Each call renders its own nodes, even when several calls run at the same time
+        node_list_list = [build_node_list(prefix, 8) for prefix in ('a', 'b', 'c', 'd')]
+        with concurrent.futures.ThreadPoolExecutor(len(node_list_list)) as executor:
+            result_list_list = list(executor.map(
+                lambda node_list: core.render_parallel(node_list, max_workers=2),
+                node_list_list
+            ))
+
+        for node_list, result_list in zip(node_list_list, result_list_list):
+            self.assertEqual([data for data, source_map in result_list], [str(node).encode('utf-8') for node in node_list])
+
+if __name__ == '__main__':
+    unittest.main()
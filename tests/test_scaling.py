@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Asymptotic scaling guard of the node classes, see :mod:`benchmarks.scaling`.
+
+The number of function calls made to build and render each node class of :mod:`brownbat.C` with 100 and
+1000 nodes must grow linearly with the size of the output. The times of the builds and renderings with 1k,
+10k and 100k nodes are only checked if the ``BROWNBAT_SLOW_TESTS`` environment variable is set, as they take
+several minutes and depend on the load of the machine.
+"""
+
+import inspect
+import os
+import sys
+import unittest
+
+# If BrownBat is not installed, this enable the tests to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+import brownbat.core as core
+
+from benchmarks.scaling import (
+    check_workload, DEFAULT_SIZE_LIST, DEFAULT_MAX_EXPONENT, COUNT_SIZE_LIST, DEFAULT_MAX_COUNT_EXPONENT
+)
+from benchmarks.workloads import NODE_WORKLOAD_LIST, NODE_WORKLOAD_DICT
+
+
+# Base classes only used through their subclasses, and nodes only built by other nodes
+UNCHECKED_CLASS_NAME_SET = {
+    'DelegatedTokenList', 'IndentedDelegatedTokenList', 'DelegatedExpr',
+    'ConditionnalStmtBase', 'CompoundType', 'DebugSideComment',
+}
+
+class ScalingTest(unittest.TestCase):
+    def test_node_classes(self):
+        """Check that each node class has a workload."""
+        for name, cls in vars(C).items():
+            if (inspect.isclass(cls) and issubclass(cls, core.NodeABC) and cls.__module__ == C.__name__
+                and not inspect.isabstract(cls) and not name.startswith('_')
+                and name not in UNCHECKED_CLASS_NAME_SET
+            ):
+                self.assertIn(name, NODE_WORKLOAD_DICT)
+
+def make_count_test(workload):
+    def test(self):
+        failure_list = check_workload(workload, COUNT_SIZE_LIST,
+            max_exponent=DEFAULT_MAX_COUNT_EXPONENT, verbose=False, count=True)
+        self.assertEqual(failure_list, [])
+    test.__doc__ = 'Check the number of function calls of the workload of {0}.'.format(workload.description)
+    return test
+
+def make_scaling_test(workload):
+    @unittest.skipUnless(os.environ.get('BROWNBAT_SLOW_TESTS'), 'set BROWNBAT_SLOW_TESTS to check the times')
+    def test(self):
+        failure_list = check_workload(workload, DEFAULT_SIZE_LIST, max_exponent=DEFAULT_MAX_EXPONENT, verbose=False)
+        self.assertEqual(failure_list, [])
+    test.__doc__ = 'Check the scaling of the times of the workload of {0}.'.format(workload.description)
+    return test
+
+for workload in NODE_WORKLOAD_LIST:
+    setattr(ScalingTest, 'test_count_'+workload.name, make_count_test(workload))
+    setattr(ScalingTest, 'test_scaling_'+workload.name, make_scaling_test(workload))
+del workload
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Tests of the token lists built by concatenation, which share their tokens."""
+
+import copy
+import pickle
+import sys
+import unittest
+
+# If BrownBat is not installed, this enable the tests to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+
+
+class ConcatenationTest(unittest.TestCase):
+    def test_slice_type(self):
+        self.assertEqual((C.Expr('a')+'b')[1:], ['b'])
+        self.assertIs(type((C.Expr('a')+'b')[1:]), list)
+        self.assertIs(type(C.Expr(['a', 'b'])[1:]), list)
+
+    def test_append_after_add(self):
+        expr = C.Expr('a')
+        expr_list = list()
+        for token in 'bcdef':
+            expr = expr+token
+            expr.append(token.upper())
+            expr_list.append(expr)
+        self.assertEqual([expr.inline_str() for expr in expr_list], ['abB', 'abBcC', 'abBcCdD', 'abBcCdDeE', 'abBcCdDeEfF'])
+        self.assertEqual(len(expr), 11)
+        self.assertEqual(expr[-1], 'F')
+
+    def test_modify_after_add(self):
+        expr = C.Expr('a')+'b'
+        expr.append('c')
+        added = expr+'d'
+        # Modifying the tokens does not change the concatenations already built
+        expr[0] = 'x'
+        expr.append('y')
+        del expr[1]
+        self.assertEqual(expr.inline_str(), 'xcy')
+        self.assertEqual(added.inline_str(), 'abcd')
+
+        added.insert(0, 'z')
+        self.assertEqual(added.inline_str(), 'zabcd')
+        self.assertEqual((added+expr).inline_str(), 'zabcdxcy')
+
+    def test_shallow_copy(self):
+        expr = C.Expr('a')+'b'
+        expr_copy = copy.copy(expr)
+        # Like after a shallow copy of a list, the tokens are shared
+        expr.append('c')
+        self.assertEqual(expr_copy.inline_str(), 'abc')
+        expr[0] = 'x'
+        self.assertEqual(expr_copy.inline_str(), 'xbc')
+
+    def test_pickle(self):
+        expr = C.Expr('a')+'b'
+        expr.append('c')
+        added = expr+'d'
+        expr.append('e')
+        self.assertEqual(pickle.loads(pickle.dumps(expr)).inline_str(), 'abce')
+        self.assertEqual(pickle.loads(pickle.dumps(added)).inline_str(), 'abcd')
+
+if __name__ == '__main__':
+    unittest.main()
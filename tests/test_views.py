@@ -0,0 +1,57 @@
+#! /usr/bin/env python3
+# -*-coding:Utf-8 -*
+
+"""Tests of the views of the nodes, such as the declarations and definitions of variables and functions."""
+
+import sys
+import unittest
+
+# If BrownBat is not installed, this enable the tests to be run from the root of the project or this directory
+sys.path[0:0] = ['.', '..']
+
+import brownbat.C as C
+import brownbat.core as core
+
+
+class SharedViewTest(unittest.TestCase):
+    def test_shared_view(self):
+        var = C.Var(type='int', name='x')
+        self.assertIs(core.shared_view(var, 'decl'), core.shared_view(var, 'decl'))
+        fun = C.Fun(name='f', return_type='int')
+        self.assertIs(core.shared_view(fun, 'defi'), core.shared_view(fun, 'defi'))
+
+    def test_public_view(self):
+        var = C.Var(type='int', name='x')
+        self.assertIsNot(var.decl(), var.decl())
+        self.assertIsNot(var.defi(), core.shared_view(var, 'defi'))
+
+        # The views returned to the user can be modified without changing how the node is printed
+        decl = var.decl()
+        decl.side_comment = 'x'
+        self.assertEqual(var.decl().inline_str(), 'int x')
+        var.defi().side_comment = 'x'
+        self.assertEqual(var.freestanding_str(), str(C.Var(type='int', name='x')))
+
+        fun = C.Fun(name='f', return_type='int')
+        fun.defi().comment = 'x'
+        self.assertEqual(str(C.StmtContainer([fun])), str(C.StmtContainer([C.Fun(name='f', return_type='int')])))
+
+    def test_debug_comments_location(self):
+        old_config = C.Node.config
+        C.Node.config = C.Configuration(enable_debug_comments=True)
+        try:
+            var = C.Var(type='int', name='x')
+            first_decl = var.decl()
+            second_decl = var.decl()
+            first_line = sys._getframe().f_lineno-2
+        finally:
+            C.Node.config = old_config
+
+        # Each view records where it was requested, not where the first view was
+        self.assertIsNot(first_decl, second_decl)
+        self.assertIn('VarDecl created at', str(first_decl))
+        self.assertIn(':{0}('.format(first_line), str(first_decl))
+        self.assertIn(':{0}('.format(first_line+1), str(second_decl))
+
+if __name__ == '__main__':
+    unittest.main()